@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark suite running against the simulated mixer and a
+fake X-Touch, no hardware needed.
+
+Measures encoder-to-OSC latency, feedback-to-LED latency, initial sync
+time, the maximum sustained inbound message rate and the time to recover
+from a mixer outage.
+
+    $ python3 benchmarks/e2e.py --loss 0.02 --delay 1
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mido import Message
+from pythonosc.osc_message_builder import OscMessageBuilder
+from lib.commandqueue import PRIORITY_OSC
+from lib.midicontroller import MidiController
+from lib.mixerstate import MixerState
+from lib.simulator import MixerSimulator, FakeMidiBackend
+from lib.stats import stats
+from lib.timers import timers
+from lib.xair import XAirClient
+
+class Rig:
+    """
+    Application wired to a simulated mixer and a fake MIDI device
+    """
+    def __init__(self, loss, delay):
+        self.simulator = MixerSimulator(loss = loss, delay = delay).start()
+        self.backend = FakeMidiBackend()
+        self.state = MixerState()
+        self.midi = MidiController(self.state, backend = self.backend)
+        self.state.add_controller(self.midi)
+        self.xair = XAirClient('127.0.0.1', self.state, port = self.simulator.address[1])
+        self.state.xair_client = self.xair
+        self.state.commands.start()
+        self.inport = self.backend.inputs[self.midi.inport.name]
+        self.outport = self.backend.outputs[self.midi.outport.name]
+
+    def wait_idle(self, timeout = 5.0):
+        deadline = time.monotonic() + timeout
+        while self.state.commands.depth() > 0 and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+def report(name, samples, unit = 'ms'):
+    if len(samples) == 0:
+        print('%-22s no samples' % name)
+        return
+    samples = sorted(samples)
+    def pick(q):
+        return samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    print('%-22s p50 %7.3f %s  p95 %7.3f %s  max %7.3f %s  (%d samples)' % (name, pick(0.5), unit,
+            pick(0.95), unit, samples[-1] * 1000, unit, len(samples)))
+
+def bench_initial_sync(rig):
+    start = time.monotonic()
+    complete = rig.state.read_initial_state()
+    rig.wait_idle()
+    print('%-22s %7.3f s%s' % ('initial sync', time.monotonic() - start, '' if complete else ' (incomplete)'))
+    # watch the connection from now on
+    rig.xair.health.connected()
+    timers.start()
+
+def bench_encoder_to_osc(rig, samples):
+    rig.midi.change_layer(0)
+    rig.midi.activate_bank(0)
+    received = threading.Event()
+    expected = [None]
+    def on_receive(address, params):
+        if address == expected[0]:
+            received.set()
+    rig.simulator.on_receive = on_receive
+    latencies = []
+    for i in range(0, samples):
+        channel = i % 8
+        expected[0] = rig.state.banks[0][channel].fader_addr
+        received.clear()
+        start = time.monotonic()
+        rig.inport.inject(Message('control_change', channel = 0, control = MidiController.MIDI_ENCODER[channel],
+                                  value = 1 if i % 16 < 8 else 65))
+        if received.wait(1.0):
+            latencies.append(time.monotonic() - start)
+        # stay outside the coalescing window so every change is sent right away
+        time.sleep(rig.xair.scheduler.window / 8)
+    rig.simulator.on_receive = None
+    report('encoder to OSC', latencies)
+
+def bench_feedback_to_led(rig, samples):
+    rig.xair.send('/xremotenfb')
+    time.sleep(0.05)
+    updated = threading.Event()
+    expected = [None]
+    def on_send(msg):
+        if msg.type == 'control_change' and msg.control == expected[0]:
+            updated.set()
+    rig.outport.on_send = on_send
+    latencies = []
+    for i in range(0, samples):
+        channel = i % 8
+        expected[0] = MidiController.MIDI_RING[channel]
+        updated.clear()
+        start = time.monotonic()
+        rig.simulator.set(rig.state.banks[0][channel].fader_addr, 1.0 if (i // 8) % 2 == 0 else 0.0)
+        if updated.wait(1.0):
+            latencies.append(time.monotonic() - start)
+    rig.outport.on_send = None
+    report('feedback to LED', latencies)
+
+def bench_inbound_rate(rig, count):
+    addresses = []
+    for bank in rig.state.banks:
+        for channel in bank:
+            if channel != None:
+                addresses.append(channel.fader_addr)
+    datagrams = []
+    for i in range(0, count):
+        builder = OscMessageBuilder(address = addresses[i % len(addresses)])
+        builder.add_arg((i % 100) / 100)
+        datagrams.append(builder.build().dgram)
+    target = ('127.0.0.1', rig.xair.server.socket.getsockname()[1])
+    executed = rig.state.commands.executed
+    base = executed[PRIORITY_OSC]
+    start = time.monotonic()
+    # send in bursts that fit the socket buffer and wait for each burst to be handled
+    for offset in range(0, count, 200):
+        burst = datagrams[offset:offset + 200]
+        for data in burst:
+            rig.simulator.socket.sendto(data, target)
+        expected = base + offset + len(burst)
+        deadline = time.monotonic() + 0.5
+        while executed[PRIORITY_OSC] < expected and time.monotonic() < deadline:
+            time.sleep(0.0005)
+    elapsed = time.monotonic() - start
+    processed = executed[PRIORITY_OSC] - base
+    print('%-22s %8.0f msg/s  (%d of %d processed)' % ('inbound rate', processed / elapsed, processed, count))
+
+def bench_recovery(rig, outage):
+    """
+    Take the mixer offline, change a fader on it meanwhile and measure how
+    long it takes to notice the loss and to have the state back after the
+    mixer returned (mean time to recover)
+    """
+    health = rig.xair.health
+    address = rig.state.banks[0][0].fader_addr
+    value = 0.25 if rig.state.store.get(address) != 0.25 else 0.5
+    start = time.monotonic()
+    rig.simulator.go_offline()
+    rig.simulator.params[address] = value
+    while health.status == health.CONNECTED and time.monotonic() - start < outage + 10:
+        time.sleep(0.001)
+    detected = health.lost_at - start if health.status == health.LOST else None
+    time.sleep(max(0.0, start + outage - time.monotonic()))
+    returned = time.monotonic()
+    rig.simulator.go_online()
+    deadline = returned + 10
+    while time.monotonic() < deadline:
+        if health.recovered_at != None and health.recovered_at > returned:
+            rig.wait_idle()
+            if rig.state.store.get(address) == value:
+                break
+        time.sleep(0.001)
+    recovered = time.monotonic() - returned if rig.state.store.get(address) == value else None
+    print('%-22s %s' % ('loss detection', 'failed' if detected == None else '%7.3f s' % detected))
+    print('%-22s %s' % ('recovery (MTTR)', 'failed' if recovered == None else '%7.3f s' % recovered))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'End-to-end benchmarks against a simulated mixer')
+    parser.add_argument('--loss', help = 'packet loss probability of the simulated mixer (default: 0)', type = float, default = 0.0)
+    parser.add_argument('--delay', help = 'reply delay of the simulated mixer in ms (default: 0)', type = float, default = 0.0)
+    parser.add_argument('--samples', help = 'number of latency samples (default: 200)', type = int, default = 200)
+    parser.add_argument('--stats', help = 'collect and print hot path statistics', action = 'store_true')
+    parser.add_argument('--outage', help = 'mixer outage time for the recovery test in s (default: 2)', type = float, default = 2.0)
+    parser.add_argument('--flood', help = 'number of messages for the inbound rate test (default: 20000)', type = int, default = 20000)
+    args = parser.parse_args()
+
+    stats.enabled = args.stats
+    rig = Rig(args.loss, args.delay / 1000)
+    bench_initial_sync(rig)
+    bench_encoder_to_osc(rig, args.samples)
+    bench_feedback_to_led(rig, args.samples)
+    bench_inbound_rate(rig, args.flood)
+    bench_recovery(rig, args.outage)
+    print(rig.xair.health.summary())
+    print(rig.xair.scheduler.summary())
+    print(rig.state.commands.summary())
+    print(timers.summary())
+    if args.stats:
+        print(stats.dump())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the inbound OSC path
+
+A separate process floods the socket of the application with fader
+values as fast as it can. Reports how many packets per second the
+application handles, and how many were lost, with
+
+    pythonosc   the request handling and parsing of pythonosc
+    fast        the receive loop and routing table of OSCClientServer
+    asyncio     the fast path draining the socket from an event loop
+
+and the time to decode one fader message on both paths.
+
+    $ python3 benchmarks/flood.py --duration 3
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import threading
+import timeit
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pythonosc.osc_message_builder import OscMessageBuilder
+from pythonosc.osc_server import BlockingOSCUDPServer
+from lib.commandqueue import PRIORITY_OSC
+from lib.mixerstate import MixerState
+from lib.xair import XAirClient
+
+MODES = ['pythonosc', 'fast', 'asyncio']
+
+def datagrams(state):
+    addresses = [channel.fader_addr for bank in state.banks for channel in bank if channel != None]
+    result = []
+    for i in range(0, 1000):
+        builder = OscMessageBuilder(address = addresses[i % len(addresses)])
+        builder.add_arg((i % 100) / 100)
+        result.append(builder.build().dgram)
+    return result
+
+def flood(port, data, duration, sent):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    target = ('127.0.0.1', port)
+    count = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        for datagram in data:
+            sock.sendto(datagram, target)
+        count += len(data)
+    sent.value = count
+
+def serve(mode, xair):
+    server = xair.server
+    if mode == 'pythonosc':
+        # socketserver request handling and dispatching like before the fast path
+        server.finish_request = lambda request, client_address: BlockingOSCUDPServer.finish_request(server, request, client_address)
+        server.serve_forever()
+    elif mode == 'fast':
+        server.serve()
+    else:
+        async def main():
+            asyncio.get_running_loop().add_reader(server.socket, server.drain)
+            await asyncio.get_running_loop().create_future()
+        asyncio.run(main())
+
+def measure(mode, duration):
+    state = MixerState()
+    # the mixer address is never used, nothing is sent
+    xair = XAirClient('127.0.0.1', state, threaded = False, port = 9)
+    state.xair_client = xair
+    state.commands.start()
+    server = xair.server
+    server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    worker = threading.Thread(target = serve, args = (mode, xair))
+    worker.daemon = True
+    worker.start()
+    executed = state.commands.executed
+    base = executed[PRIORITY_OSC]
+    sent = multiprocessing.Value('q', 0)
+    sender = multiprocessing.Process(target = flood, args = (server.socket.getsockname()[1], datagrams(state), duration, sent))
+    start = time.monotonic()
+    sender.start()
+    sender.join()
+    # let the receiver take what is left in the socket buffer and the queue run
+    time.sleep(0.05)
+    deadline = time.monotonic() + 5.0
+    while state.commands.depth() > 0 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    elapsed = time.monotonic() - start
+    handled = executed[PRIORITY_OSC] - base
+    print('%-10s %12.0f %12.0f %8.1f%%' % (mode, sent.value / duration, handled / elapsed,
+            100.0 * max(0, sent.value - handled) / max(1, sent.value)))
+
+def bench_decode():
+    state = MixerState()
+    xair = XAirClient('127.0.0.1', state, threaded = False, port = 9)
+    server = xair.server
+    values = []
+    server.value_handler = lambda address, value: values.append(value)
+    server.dispatcher.set_default_handler(lambda address, *data: values.append(data[0]))
+    data = datagrams(state)[1]
+    count = 100000
+    slow = min(timeit.repeat(lambda: server.dispatcher.call_handlers_for_packet(data, None), number = count, repeat = 3))
+    fast = min(timeit.repeat(lambda: server.dispatch(data, len(data), None), number = count, repeat = 3))
+    print('decode fader message: pythonosc %.2f us, fast path %.2f us' % (slow / count * 1e6, fast / count * 1e6))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Maximum inbound OSC packet rate')
+    parser.add_argument('--duration', help = 'flooding time per mode in s (default: 3)', type = float, default = 3.0)
+    parser.add_argument('--modes', help = 'receive paths to measure (default: all)', nargs = '+', choices = MODES, default = MODES)
+    args = parser.parse_args()
+
+    bench_decode()
+    print('%-10s %12s %12s %9s' % ('mode', 'sent pkt/s', 'handled/s', 'lost'))
+    for mode in args.modes:
+        measure(mode, args.duration)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the meter mode
+
+Measures the time to decode one /meters/1 blob and the CPU use of the
+application process while a simulated mixer in a separate process
+streams meters at different rates to a fake X-Touch in meter mode.
+
+    $ python3 benchmarks/meters.py --rates 20 50
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib import meters
+from lib.midicontroller import MidiController
+from lib.mixerstate import MixerState
+from lib.simulator import MixerSimulator, FakeMidiBackend
+from lib.timers import timers
+from lib.xair import XAirClient
+
+def bench_decode():
+    blob = MixerSimulator(meter_interval = 1.0).meter_blob(time.monotonic())
+    count = 20000
+    seconds = min(timeit.repeat(lambda: meters.decode_meters(blob), number = count, repeat = 3))
+    print('decode /meters/1 (%s): %.2f us per blob' % ('numpy' if meters.numpy != None else 'struct',
+                                                     seconds / count * 1e6))
+
+def measure(rate, duration):
+    process = subprocess.Popen([sys.executable, '-u', '-m', 'lib.simulator', '-p', '0', '--meter-interval', str(1000 / rate)],
+                               cwd = ROOT, stdout = subprocess.PIPE, universal_newlines = True)
+    try:
+        # Simulated XR18 listening on 127.0.0.1:<port>
+        port = int(process.stdout.readline().strip().rsplit(':', 1)[1])
+        backend = FakeMidiBackend()
+        state = MixerState()
+        midi = MidiController(state, backend = backend, meter_mode = True)
+        state.add_controller(midi)
+        xair = XAirClient('127.0.0.1', state, port = port, meter_rate = rate)
+        state.xair_client = xair
+        state.commands.start()
+        xair.validate_connection()
+        state.read_initial_state()
+        xair.health.connected()
+        state.update_meter_stream()
+        timers.start()
+        output = backend.outputs[midi.outport.name]
+        # let the stream settle
+        time.sleep(0.5)
+        sent = len(output.sent)
+        shown = xair.meters.decoded
+        cpu = time.process_time()
+        time.sleep(duration)
+        cpu = time.process_time() - cpu
+        frames = xair.meters.decoded - shown
+        messages = len(output.sent) - sent
+        # the mixer goes away with the simulator
+        xair.meters.stop()
+        timers.cancel(xair.health.timer)
+        print('%6.0f Hz %9.1f/s %12.1f/s %9.1f%%' % (rate, frames / duration, messages / duration, cpu / duration * 100))
+    finally:
+        process.terminate()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Meter decoding time and CPU use of the meter mode')
+    parser.add_argument('--rates', help = 'meter rates in frames per second (default: 20 50)', type = float, nargs = '+', default = [20, 50])
+    parser.add_argument('--duration', help = 'measuring time per rate in s (default: 5)', type = float, default = 5.0)
+    args = parser.parse_args()
+
+    bench_decode()
+    print('%9s %11s %14s %10s' % ('rate', 'frames', 'ring updates', 'CPU'))
+    for rate in args.rates:
+        measure(rate, args.duration)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the MIDI path
+
+Compares the mido messages with the raw bytes used with rtmidi on a
+fake X-Touch: the CPU time per encoder event from the bytes delivered by
+the MIDI library to the fader change and ring update, and the time to
+send one ring or button LED update.
+
+    $ python3 benchmarks/midi.py --events 20000
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mido import Message
+from lib.commandqueue import PRIORITY_MIDI
+from lib.midicontroller import MidiController
+from lib.mixerstate import MixerState
+from lib.simulator import FakeMidiBackend
+from lib.timers import timers
+
+class NullClient:
+    """
+    Stands in for XAirClient, changes go nowhere
+    """
+    def send(self, address, param = None, coalesce = False):
+        pass
+
+def controller(raw):
+    state = MixerState()
+    state.xair_client = NullClient()
+    midi = MidiController(state, backend = FakeMidiBackend('X-TOUCH MINI (%s)' % ('raw' if raw else 'mido'), raw))
+    state.add_controller(midi)
+    timers.cancel(midi.watch_timer)
+    timers.cancel(midi.tempo_detector.timer)
+    # only count, the fake port would keep every message
+    midi.outport.send = lambda msg: None
+    return state, midi
+
+def bench_events(raw, count):
+    state, midi = controller(raw)
+    callback = midi.inport.callback
+    # encoder turns as the MIDI library receives them
+    events = [[MidiController.STATUS_CONTROL, MidiController.MIDI_ENCODER[i % 8], 1 if i % 32 < 16 else 65]
+              for i in range(0, count)]
+    done = threading.Event()
+    state.commands.start()
+    cpu = time.process_time()
+    start = time.monotonic()
+    if raw:
+        for data in events:
+            callback((data, 0.0), None)
+    else:
+        for data in events:
+            # the rtmidi backend of mido builds a message for every event
+            callback(Message.from_bytes(data))
+    state.commands.submit(PRIORITY_MIDI, done.set)
+    done.wait()
+    elapsed = time.monotonic() - start
+    cpu = time.process_time() - cpu
+    return cpu / count, elapsed / count
+
+def bench_leds(raw):
+    state, midi = controller(raw)
+    count = 100000
+    values = [i / 100 for i in range(0, 100)]
+    def rings():
+        for i in range(0, count):
+            midi.set_ring(i % 8, values[i % 100])
+    def buttons():
+        for i in range(0, count):
+            midi.set_button(i % 16, i % 3 == 0)
+    return (min(timeit.repeat(rings, number = 1, repeat = 3)) / count,
+            min(timeit.repeat(buttons, number = 1, repeat = 3)) / count)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Per event cost of mido messages and raw MIDI bytes')
+    parser.add_argument('--events', help = 'encoder events to feed per mode (default: 20000)', type = int, default = 20000)
+    args = parser.parse_args()
+
+    print('%-5s %14s %14s %12s %12s' % ('mode', 'CPU/event us', 'time/event us', 'ring us', 'button us'))
+    for raw in (False, True):
+        cpu, elapsed = bench_events(raw, args.events)
+        ring, button = bench_leds(raw)
+        print('%-5s %14.2f %14.2f %12.2f %12.2f' % ('raw' if raw else 'mido', cpu * 1e6, elapsed * 1e6,
+                ring * 1e6, button * 1e6))
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark for hosting several mixers and controllers in one process
+
+Starts simulated mixers in separate processes, attaches one fake X-Touch
+per mixer and drives a constant load of mixer feedback and encoder turns
+on every device. Reports the CPU use of the application process with a
+thread set per device and with all devices on one asyncio loop.
+
+    $ python3 benchmarks/multi.py --mixers 1 2 4
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mido import Message
+from pythonosc.osc_message_builder import OscMessageBuilder
+from lib.asyncruntime import AsyncRuntime
+from lib.midicontroller import MidiController
+from lib.mixerstate import MixerState
+from lib.simulator import FakeMidiBackend
+from lib.timers import timers
+from lib.xair import XAirClient
+
+def start_simulators(count):
+    processes = []
+    ports = []
+    for i in range(0, count):
+        process = subprocess.Popen([sys.executable, '-u', '-m', 'lib.simulator', '-p', '0'], cwd = ROOT,
+                                   stdout = subprocess.PIPE, universal_newlines = True)
+        # Simulated XR18 listening on 127.0.0.1:<port>
+        ports.append(int(process.stdout.readline().strip().rsplit(':', 1)[1]))
+        processes.append(process)
+    return processes, ports
+
+def build(ports, threaded):
+    clients = []
+    controllers = []
+    for i in range(0, len(ports)):
+        state = MixerState()
+        xair = XAirClient('127.0.0.1', state, threaded = threaded, port = ports[i])
+        state.xair_client = xair
+        midi = MidiController(state, backend = FakeMidiBackend('X-TOUCH MINI %d' % (i + 1)))
+        state.add_controller(midi)
+        clients.append(xair)
+        controllers.append(midi)
+    if threaded:
+        for xair in clients:
+            xair.state.commands.start()
+            xair.validate_connection()
+            xair.state.read_initial_state()
+            xair.health.connected()
+        timers.start()
+    else:
+        runtime = AsyncRuntime(clients, controllers, cache = False)
+        worker = threading.Thread(target = runtime.run)
+        worker.daemon = True
+        worker.start()
+        # connecting waits for the /xinfo reply
+        time.sleep(XAirClient._CONNECT_TIMEOUT + 1.0)
+    return clients, controllers
+
+def drive(ports, controllers, feedback_rate, midi_rate, duration):
+    """
+    Send parameter changes to every simulated mixer, which broadcasts them
+    to the application, and turn encoders on every controller
+    """
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    datagrams = []
+    for i in range(0, 16):
+        builder = OscMessageBuilder(address = '/ch/%02d/mix/fader' % (i + 1))
+        builder.add_arg(i / 16)
+        datagrams.append(builder.build().dgram)
+    tick = 0.01
+    per_tick = max(1, int(feedback_rate * tick))
+    midi_every = max(1, int(1 / (midi_rate * tick)))
+    inports = [midi.backend.inputs[midi.inport.name] for midi in controllers]
+    count = 0
+    start = time.monotonic()
+    while time.monotonic() - start < duration:
+        for port in ports:
+            for i in range(0, per_tick):
+                sender.sendto(datagrams[(count + i) % len(datagrams)], ('127.0.0.1', port))
+        if count % midi_every == 0:
+            for inport in inports:
+                inport.inject(Message('control_change', channel = 0, control = MidiController.MIDI_ENCODER[count % 8],
+                                      value = 1 if count % 16 < 8 else 65))
+        count += 1
+        time.sleep(max(0.0, start + count * tick - time.monotonic()))
+
+def child(args):
+    processes, ports = start_simulators(args.child)
+    try:
+        clients, controllers = build(ports, args.mode == 'threads')
+        # idle process: only keepalive and tempo blinking
+        cpu = time.process_time()
+        time.sleep(args.duration)
+        idle = time.process_time() - cpu
+        cpu = time.process_time()
+        drive(ports, controllers, args.feedback_rate, args.midi_rate, args.duration)
+        loaded = time.process_time() - cpu
+        print('RESULT %d %f %f' % (threading.active_count(), idle / args.duration, loaded / args.duration))
+    finally:
+        for process in processes:
+            process.terminate()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'CPU use with several mixers and controllers in one process')
+    parser.add_argument('--mixers', help = 'numbers of mixers to test (default: 1 2 4)', type = int, nargs = '+', default = [1, 2, 4])
+    parser.add_argument('--duration', help = 'measuring time per run in s (default: 3)', type = float, default = 3.0)
+    parser.add_argument('--feedback-rate', help = 'feedback messages per second per mixer (default: 500)', type = int, default = 500)
+    parser.add_argument('--midi-rate', help = 'encoder turns per second per controller (default: 50)', type = int, default = 50)
+    parser.add_argument('--mode', help = argparse.SUPPRESS, default = 'asyncio')
+    parser.add_argument('--child', help = argparse.SUPPRESS, type = int)
+    args = parser.parse_args()
+
+    if args.child != None:
+        child(args)
+        exit()
+
+    print('%-8s %6s %8s %10s %10s' % ('mode', 'mixers', 'threads', 'idle CPU', 'load CPU'))
+    for mode in ('threads', 'asyncio'):
+        for count in args.mixers:
+            # every run gets a fresh process so CPU times are not mixed up
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', str(count),
+                                              '--mode', mode, '--duration', str(args.duration),
+                                              '--feedback-rate', str(args.feedback_rate),
+                                              '--midi-rate', str(args.midi_rate)], universal_newlines = True)
+            result = [line for line in output.splitlines() if line.startswith('RESULT')][0].split()
+            print('%-8s %6d %8s %9.1f%% %9.1f%%' % (mode, count, result[1], float(result[2]) * 100, float(result[3]) * 100))
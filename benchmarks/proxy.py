@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the OSC proxy
+
+Runs a number of local OSC clients which subscribe with /xremote and
+poll fader values, first talking to the simulated mixer directly and
+then through the proxy of the application. Reports the packets per
+second the mixer has to handle, the number of subscribers it serves and
+the query round trip seen by the clients.
+
+    $ python3 benchmarks/proxy.py --clients 1 4 16 --rate 50
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pythonosc.osc_message_builder import OscMessageBuilder
+from pythonosc.osc_packet import OscPacket
+from lib.mixerstate import MixerState
+from lib.proxy import OSCProxy
+from lib.simulator import MixerSimulator
+from lib.stats import Histogram
+from lib.timers import timers
+from lib.xair import XAirClient
+
+def encode(address, *values):
+    builder = OscMessageBuilder(address = address)
+    for value in values:
+        builder.add_arg(value)
+    return builder.build().dgram
+
+def run_client(target, addresses, rate, duration, round_trips, lock):
+    """
+    Subscribes to target and queries one fader after the other rate
+    times per second like a mixing app refreshing its view
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(0.5)
+    sock.sendto(encode('/xremote'), target)
+    samples = []
+    start = time.monotonic()
+    next_query = start
+    i = 0
+    while next_query < start + duration:
+        time.sleep(max(0.0, next_query - time.monotonic()))
+        address = addresses[i % len(addresses)]
+        sent = time.monotonic()
+        sock.sendto(encode(address), target)
+        # skip the changes broadcast to the subscription until the reply arrives
+        while True:
+            try:
+                data = sock.recv(4096)
+            except socket.timeout:
+                break
+            if any(timed.message.address == address for timed in OscPacket(data).messages):
+                samples.append(time.monotonic() - sent)
+                break
+        i += 1
+        next_query += 1.0 / rate
+    sock.close()
+    with lock:
+        for sample in samples:
+            round_trips.add(sample)
+
+def measure(mode, clients, rate, duration):
+    simulator = MixerSimulator().start()
+    state = MixerState()
+    xair = XAirClient('127.0.0.1', state, port = simulator.address[1])
+    state.xair_client = xair
+    state.commands.start()
+    proxy = None
+    target = simulator.address
+    if mode == 'proxy':
+        xair.validate_connection()
+        state.read_initial_state()
+        xair.health.connected()
+        proxy = OSCProxy(xair, 0, '127.0.0.1')
+        proxy.start()
+        target = proxy.address
+    addresses = [channel.fader_addr for channel in state.banks[0] if channel != None]
+    round_trips = Histogram()
+    lock = threading.Lock()
+    received = simulator.received
+    workers = [threading.Thread(target = run_client, args = (target, addresses, rate, duration, round_trips, lock))
+               for i in range(0, clients)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    packets = simulator.received - received
+    subscribers = len(simulator.subscribers)
+    print('%-7s %7d %12.1f %12d %10.3f %10.3f' % (mode, clients, packets / duration, subscribers,
+            round_trips.percentile(0.5) * 1000, round_trips.percentile(0.99) * 1000))
+    if proxy != None:
+        proxy.close()
+        timers.cancel(xair.health.timer)
+    simulator.stop()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Mixer load with and without the OSC proxy')
+    parser.add_argument('--clients', help = 'numbers of local clients to run (default: 1 4 16)', type = int, nargs = '+', default = [1, 4, 16])
+    parser.add_argument('--rate', help = 'queries per second of every client (default: 50)', type = float, default = 50.0)
+    parser.add_argument('--duration', help = 'measuring time per run in s (default: 3)', type = float, default = 3.0)
+    args = parser.parse_args()
+
+    timers.start()
+    print('%-7s %7s %12s %12s %10s %10s' % ('mode', 'clients', 'mixer pkt/s', 'subscribers', 'p50 ms', 'p99 ms'))
+    for clients in args.clients:
+        for mode in ('direct', 'proxy'):
+            measure(mode, clients, args.rate, args.duration)
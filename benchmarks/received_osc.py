@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for MixerState.received_osc
+
+Compares the address index lookup against the previous nested
+bank/channel scan for a mix of fader, mute and send messages.
+
+    $ python3 benchmarks/received_osc.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.mixerstate import MixerState
+
+class NullController:
+    active_bank = 0
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+def legacy_received_osc(state, addr, value):
+    controller = state.controllers[0]
+    # channel part of the scan used before the address index existed
+    for i in range(0, 5):
+        for j in range(0, 8):
+            if state.banks[i][j] != None and addr.startswith(state.banks[i][j].osc_base_addr):
+                if addr.endswith('/fader'):
+                    state.banks[i][j].fader = value
+                    if i == controller.active_bank:
+                        controller.set_ring(j, value)
+                elif addr.endswith('/on'):
+                    state.banks[i][j].on = value
+                    if i == controller.active_bank:
+                        controller.set_channel_mute(j, value)
+                elif state.banks[i][j].sends != None and addr.endswith('/level'):
+                    bus = int(addr[-8:-6]) - 1
+                    state.banks[i][j].sends[bus] = value
+                    if i == controller.active_bank:
+                        controller.set_bus_send(bus, j, value)
+                break
+        else:
+            continue
+        break
+
+def main():
+    state = MixerState()
+    state.add_controller(NullController())
+    state.xair_client = NullController()
+
+    messages = []
+    for bank in state.banks:
+        for channel in bank:
+            if channel != None:
+                messages.append((channel.fader_addr, 0.5))
+                messages.append((channel.on_addr, 1))
+                if channel.send_addrs != None:
+                    messages.append((channel.send_addrs[4], 0.25))
+
+    def run_legacy():
+        for addr, value in messages:
+            legacy_received_osc(state, addr, value)
+
+    def run_index():
+        for addr, value in messages:
+            state.received_osc(addr, value)
+
+    rounds = 2000
+    total = rounds * len(messages)
+    for name, func in (('legacy scan', run_legacy), ('address index', run_index)):
+        elapsed = min(timeit.repeat(func, number = rounds, repeat = 3))
+        print('%-14s %8.0f msg/s  %6.2f us/msg' % (name, total / elapsed, elapsed / total * 1e6))
+
+if __name__ == '__main__':
+    main()
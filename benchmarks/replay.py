@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Replay a traffic log recorded with --record
+
+Feeds the recorded mixer feedback and MIDI input back into MixerState
+and MidiController, with the recorded timing, N times faster or as fast
+as possible, and reports the throughput and how long commands waited in
+the queue. The replayed app sends to a local socket nobody reads, the
+X-Touch is a fake one.
+
+    $ python3 xair-remote.py --record show.log
+    $ python3 benchmarks/replay.py show.log --speed 4
+    $ python3 benchmarks/replay.py show.log --speed 0
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mido import Message
+from lib.commandqueue import PRIORITY_OSC
+from lib.layout import load_layout
+from lib.midicontroller import MidiController
+from lib.mixerstate import MixerState
+from lib.recorder import read_log, KIND_NAMES, OSC_IN, OSC_OUT, MIDI_IN, MIDI_OUT, ATTACH
+from lib.simulator import FakeMidiBackend
+from lib.stats import Histogram
+from lib.timers import timers
+from lib.xair import XAirClient
+
+def build(entries, layout, sink):
+    """
+    One mixer state per recorded mixer and one fake controller per
+    recorded controller, attached like in the recording
+    """
+    mixers = sorted(set(source for t, kind, source, data in entries if kind in (OSC_IN, OSC_OUT)))
+    controllers = sorted(set(source for t, kind, source, data in entries if kind in (MIDI_IN, MIDI_OUT)))
+    attached = dict((source, data[0]) for t, kind, source, data in entries if kind == ATTACH)
+    clients = {}
+    for source in mixers or [0]:
+        state = MixerState(layout)
+        xair = XAirClient('127.0.0.1', state, port = sink.getsockname()[1])
+        state.xair_client = xair
+        state.commands.start()
+        clients[source] = xair
+    midis = {}
+    for source in controllers:
+        xair = clients.get(attached.get(source), clients[min(clients)])
+        midi = MidiController(xair.state, backend = FakeMidiBackend('X-TOUCH MINI %d' % (source + 1)))
+        xair.state.add_controller(midi)
+        midis[source] = midi
+    return clients, midis
+
+def replay(entries, clients, midis, speed):
+    inports = dict((source, midi.backend.inputs[midi.inport.name]) for source, midi in midis.items())
+    outputs = [midi.backend.outputs[midi.outport.name] for midi in midis.values()]
+    sent = sum(len(output.sent) for output in outputs)
+    sender = ('127.0.0.1', 10024)
+    lag = Histogram()
+    replayed = 0
+    first = entries[0][0]
+    start = time.monotonic()
+    for timestamp, kind, source, data in entries:
+        if kind == OSC_IN and source in clients:
+            target = clients[source].server
+        elif kind == MIDI_IN and source in inports:
+            target = inports[source]
+        else:
+            continue
+        if speed > 0:
+            due = start + (timestamp - first) / speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            lag.add(max(0.0, time.monotonic() - due))
+        if kind == OSC_IN:
+            target.handle_datagram(data, sender)
+        else:
+            target.inject(Message.from_bytes(data))
+        replayed += 1
+    fed = time.monotonic() - start
+    # a command queued last runs after everything queued before
+    for xair in clients.values():
+        done = threading.Event()
+        xair.state.commands.submit(PRIORITY_OSC, done.set)
+        done.wait()
+    elapsed = time.monotonic() - start
+    midi_out = sum(len(output.sent) for output in outputs) - sent
+    return replayed, fed, elapsed, midi_out, lag
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Replay a recorded traffic log against the application')
+    parser.add_argument('log', help = 'traffic log written with --record')
+    parser.add_argument('--speed', help = 'replay speed, 1 = as recorded, 0 = as fast as possible (default: 1)', type = float, default = 1.0)
+    parser.add_argument('-l', '--layout', help = 'control layout used while recording (default: layouts/default.json)')
+    args = parser.parse_args()
+
+    try:
+        entries = read_log(args.log)
+        layout = load_layout(args.layout)
+    except (IOError, ValueError) as e:
+        print('Error: %s' % e)
+        exit(1)
+    if len(entries) == 0:
+        print('Error: %s holds no traffic' % args.log)
+        exit(1)
+    counts = [0] * len(KIND_NAMES)
+    for timestamp, kind, source, data in entries:
+        if kind < len(counts):
+            counts[kind] += 1
+    print('Log: %.1f s, %s' % (entries[-1][0] - entries[0][0],
+            ', '.join('%d %s' % (counts[kind], KIND_NAMES[kind]) for kind in (OSC_IN, OSC_OUT, MIDI_IN, MIDI_OUT))))
+
+    # outbound datagrams pile up in this socket until the kernel drops them
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    clients, midis = build(entries, layout, sink)
+    timers.start()
+    replayed, fed, elapsed, midi_out, lag = replay(entries, clients, midis, args.speed)
+
+    print('Replayed %d inbound messages in %.2f s (%.0f msg/s), queue drained after %.2f s' % (replayed, fed,
+            replayed / max(elapsed, 1e-9), elapsed))
+    if lag.count > 0:
+        print('Replay lag: ' + lag.summary().strip())
+    print('MIDI out: %d replayed, %d recorded' % (midi_out, counts[MIDI_OUT]))
+    for xair in clients.values():
+        print(xair.scheduler.summary())
+        print(xair.state.commands.summary())
+    print(timers.summary())
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Benchmark for OSCClientServer.send_message
+
+Compares packets per second of the OscMessageBuilder path against the
+precompiled datagram templates. Packets are sent to a local UDP socket.
+
+    $ python3 benchmarks/send_message.py
+"""
+import os
+import sys
+import socket
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pythonosc.dispatcher import Dispatcher
+from lib.mixerstate import MixerState
+from lib.xair import OSCClientServer
+
+def main():
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+
+    state = MixerState()
+    builder = OSCClientServer(sink.getsockname(), Dispatcher())
+    compiled = OSCClientServer(sink.getsockname(), Dispatcher())
+    compiled.precompile(state.osc_index.keys())
+
+    messages = []
+    for bank in state.banks:
+        for channel in bank:
+            if channel != None:
+                messages.append((channel.fader_addr, 0.5))
+                messages.append((channel.on_addr, 1))
+
+    # both paths must produce identical datagrams
+    for addr, value in messages:
+        builder.send_message(addr, value)
+        expected = sink.recv(512)
+        compiled.send_message(addr, value)
+        assert sink.recv(512) == expected, addr
+
+    rounds = 500
+    total = rounds * len(messages)
+    for name, server in (('builder', builder), ('templates', compiled)):
+        def run():
+            for addr, value in messages:
+                server.send_message(addr, value)
+        elapsed = min(timeit.repeat(run, number = rounds, repeat = 3))
+        print('%-10s %8.0f packets/s  %6.2f us/packet' % (name, total / elapsed, elapsed / total * 1e6))
+
+if __name__ == '__main__':
+    main()
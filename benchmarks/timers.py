@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the tempo LED timing
+
+Blinks the tempo LED of a fake X-Touch for a while and records when the
+LED turns on. Compares the old sleep loop with the shared timers and
+reports the jitter (how late each beat started compared to the ideal
+anchor + n * tempo) and the drift (how far the last beat is off compared
+to the first one).
+
+    $ python3 benchmarks/timers.py --tempo 0.5 --duration 20 --load 2
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.midicontroller import MidiController
+from lib.mixerstate import MixerState
+from lib.simulator import FakeMidiBackend
+from lib.timers import timers
+
+def sleep_loop(midi, tempo, stop):
+    # the blink thread the application used before the shared timers
+    while not stop.is_set():
+        midi.tempo_led(True)
+        time.sleep(tempo * 0.2)
+        midi.tempo_led(False)
+        time.sleep(tempo * 0.8)
+
+def busy(stop):
+    # keeps the interpreter lock busy like heavy mixer feedback does
+    while not stop.is_set():
+        sum(range(1000))
+
+def record(mode, tempo, duration, load):
+    state = MixerState()
+    backend = FakeMidiBackend('X-TOUCH MINI (%s)' % mode)
+    midi = MidiController(state, backend = backend)
+    state.add_controller(midi)
+    led = midi.layers[midi.active_layer].leds_for('tap_tempo', None)[0]
+    edges = []
+    def on_send(msg):
+        if msg.type == 'note_on' and msg.note == led and msg.velocity == MidiController.LED_ON:
+            edges.append(time.monotonic())
+    backend.outputs[midi.outport.name].on_send = on_send
+
+    stop = threading.Event()
+    for i in range(0, load):
+        worker = threading.Thread(target = busy, args = (stop,))
+        worker.daemon = True
+        worker.start()
+    # only count the beats of the mode under test
+    timers.cancel(midi.tempo_detector.timer)
+    midi.tempo_led(False)
+    del edges[:]
+    if mode == 'sleep':
+        anchor = time.monotonic()
+        worker = threading.Thread(target = sleep_loop, args = (midi, tempo, stop))
+        worker.daemon = True
+        worker.start()
+    else:
+        anchor = time.monotonic()
+        midi.tempo_detector.set_tempo(tempo, anchor)
+    time.sleep(duration)
+    stop.set()
+    timers.cancel(midi.tempo_detector.timer)
+    # beat n should start at anchor + n * tempo
+    return [edge - (anchor + n * tempo) for n, edge in enumerate(edges)]
+
+def report(mode, lateness):
+    if len(lateness) < 2:
+        print('%-7s not enough beats' % mode)
+        return
+    ordered = sorted(lateness)
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    print('%-7s %6d %9.3f %9.3f %9.3f %10.3f' % (mode, len(lateness), pick(0.5), pick(0.99), ordered[-1] * 1000,
+                                               (lateness[-1] - lateness[0]) * 1000))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Jitter and drift of the tempo LED')
+    parser.add_argument('--tempo', help = 'beat length in s (default: 0.5)', type = float, default = 0.5)
+    parser.add_argument('--duration', help = 'measuring time per mode in s (default: 10)', type = float, default = 10.0)
+    parser.add_argument('--load', help = 'busy threads competing for the CPU (default: 0)', type = int, default = 0)
+    args = parser.parse_args()
+
+    timers.start()
+    results = [(mode, record(mode, args.tempo, args.duration, args.load)) for mode in ('sleep', 'timers')]
+    print('%-7s %6s %9s %9s %9s %10s' % ('mode', 'beats', 'p50 ms', 'p99 ms', 'max ms', 'drift ms'))
+    for mode, lateness in results:
+        report(mode, lateness)
+    print(timers.summary())
@@ -0,0 +1,125 @@
+import asyncio
+import time
+import threading
+from .timers import timers
+from .stats import timeline
+
+"""
+This module runs the application on a single asyncio event loop
+"""
+
+class OSCProtocol(asyncio.DatagramProtocol):
+    """
+    Receives OSC packets on the socket of an XAirClient or OSCProxy and
+    hands them to its handle_datagram like the server thread would
+    """
+    def __init__(self, handle):
+        self.handle = handle
+
+    def datagram_received(self, data, addr):
+        self.handle(data, addr)
+
+class LoopTimer:
+    """
+    Calls run(now) on the loop at the deadline it returned last, used for
+    the trailing sends of a SendScheduler and for the shared timers
+    """
+    def __init__(self, loop, run):
+        self.loop = loop
+        self.run = run
+        self.handle = None
+        self.due = None
+
+    def wakeup(self, due):
+        # may be called from executor threads during startup
+        self.loop.call_soon_threadsafe(self.schedule, due)
+
+    def schedule(self, due):
+        if self.handle != None:
+            if self.due <= due:
+                return
+            self.handle.cancel()
+        self.due = due
+        self.handle = self.loop.call_later(max(0.0, due - time.monotonic()), self.flush)
+
+    def flush(self):
+        self.handle = None
+        next_due = self.run(time.monotonic())
+        if next_due != None:
+            self.schedule(next_due)
+
+class AsyncRuntime:
+    """
+    Replaces the daemon threads of XAirClient and the timer thread with
+    callbacks on one event loop. Queued commands, keepalive, tempo
+    blink and MIDI port checks all run on the loop thread, so every
+    MixerState is only ever changed from one thread.
+
+    One runtime hosts any number of mixers and controllers: all sockets
+    and MIDI ports feed the same loop and their periodic work shares one
+    timer queue, so no threads are added per device.
+
+    XAirClient must be created with threaded = False.
+    """
+    def __init__(self, clients, controllers, cache = True, show_timeline = False):
+        self.clients = clients
+        self.controllers = controllers
+        self.cache = cache
+        self.show_timeline = show_timeline
+        self.loop = None
+        self.thread = None
+
+    def run(self):
+        try:
+            asyncio.run(self.main())
+        except KeyboardInterrupt:
+            # statistics are printed on exit with --stats
+            pass
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.thread = threading.get_ident()
+        for xair in self.clients:
+            if xair.server.drains:
+                # handle all waiting datagrams per wakeup instead of one per callback
+                self.loop.add_reader(xair.server.socket, xair.server.drain)
+            else:
+                await self.loop.create_datagram_endpoint(lambda xair = xair: OSCProtocol(xair.server.handle_datagram),
+                                                         sock = xair.server.socket)
+            if xair.proxy != None:
+                await self.loop.create_datagram_endpoint(lambda xair = xair: OSCProtocol(xair.proxy.handle_datagram),
+                                                         sock = xair.proxy.socket)
+            xair.scheduler.wakeup = LoopTimer(self.loop, xair.scheduler.flush).wakeup
+            # state changes are queued from the rtmidi thread and the protocol, the loop executes them
+            commands = xair.state.commands
+            commands.wakeup = lambda commands = commands: self.call_soon(commands.run_pending)
+
+        # tempo LEDs, port checks and connection health run on the shared timers
+        timer = LoopTimer(self.loop, timers.run_due)
+        timers.wakeup = timer.wakeup
+        next_due = timers.next_due()
+        if next_due != None:
+            timer.schedule(next_due)
+
+        # connect to all mixers at the same time
+        await asyncio.gather(*[self.connect(xair) for xair in self.clients])
+        if self.show_timeline:
+            # queued after the synced values, which are applied on the loop as well
+            self.loop.call_soon(lambda: print(timeline.report()))
+        # everything else happens in callbacks
+        await self.loop.create_future()
+
+    def call_soon(self, callback):
+        # writing to the self-pipe of the loop is only needed from other threads
+        if threading.get_ident() == self.thread:
+            self.loop.call_soon(callback)
+        else:
+            self.loop.call_soon_threadsafe(callback)
+
+    async def connect(self, xair):
+        # startup steps block while waiting for replies, run them outside the loop
+        if await self.loop.run_in_executor(None, xair.validate_connection):
+            if self.cache:
+                xair.state.load_cache(xair.info_response)
+            await self.loop.run_in_executor(None, xair.state.read_initial_state)
+            xair.health.connected()
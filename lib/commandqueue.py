@@ -0,0 +1,88 @@
+import time
+import heapq
+import threading
+from .stats import stats
+
+"""
+This module serializes all changes to the mixer state
+"""
+
+# Lower values are handled first
+PRIORITY_MIDI = 0
+PRIORITY_OSC = 1
+
+class CommandQueue:
+    """
+    Single writer queue for MixerState. MIDI input and OSC feedback submit
+    commands from their own threads and one consumer executes them in
+    order of priority, so controller input never waits behind a burst of
+    mixer feedback. Commands of the same priority keep their order.
+    """
+    def __init__(self):
+        self.heap = []
+        self.sequence = 0
+        self.lock = threading.Condition()
+        # called after a submit when no consumer thread is used
+        self.wakeup = None
+        # metrics per priority
+        self.executed = [0, 0]
+        self.wait_total = [0.0, 0.0]
+        self.wait_max = [0.0, 0.0]
+        self.max_depth = 0
+
+    def start(self):
+        worker = threading.Thread(target = self.run)
+        worker.daemon = True
+        worker.start()
+
+    def submit(self, priority, func, *args):
+        with self.lock:
+            idle = len(self.heap) == 0
+            heapq.heappush(self.heap, (priority, self.sequence, time.monotonic(), func, args))
+            self.sequence += 1
+            self.max_depth = max(self.max_depth, len(self.heap))
+            self.lock.notify()
+        # a non-empty queue is already drained by a pending run_pending
+        if idle and self.wakeup != None:
+            self.wakeup()
+
+    def run(self):
+        while True:
+            with self.lock:
+                while len(self.heap) == 0:
+                    self.lock.wait()
+            self.run_pending()
+
+    def run_pending(self):
+        """
+        Execute all queued commands, highest priority first
+        """
+        while True:
+            with self.lock:
+                if len(self.heap) == 0:
+                    return
+                priority, _, submitted, func, args = heapq.heappop(self.heap)
+                wait = time.monotonic() - submitted
+                self.executed[priority] += 1
+                self.wait_total[priority] += wait
+                self.wait_max[priority] = max(self.wait_max[priority], wait)
+            if stats.enabled:
+                stats.begin('midi' if priority == PRIORITY_MIDI else 'osc', submitted)
+            try:
+                func(*args)
+            except Exception as e:
+                print('Error: Command %s failed: %s' % (getattr(func, '__name__', func), e))
+            if stats.enabled:
+                stats.finish()
+
+    def depth(self):
+        return len(self.heap)
+
+    def summary(self):
+        lines = ['Command queue: depth %d, max depth %d' % (self.depth(), self.max_depth)]
+        for priority, name in ((PRIORITY_MIDI, 'MIDI'), (PRIORITY_OSC, 'OSC')):
+            count = self.executed[priority]
+            average = self.wait_total[priority] / count if count > 0 else 0.0
+            lines.append('  %-4s %8d commands, wait avg %.3f ms, max %.3f ms' % (name, count,
+                    average * 1000, self.wait_max[priority] * 1000))
+        return '\n'.join(lines)
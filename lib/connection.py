@@ -0,0 +1,206 @@
+import time
+import threading
+from .sync import StateSync
+from .timers import timers
+
+"""
+This module watches the connection to the mixer and recovers from
+mixer reboots and network dropouts without restarting the app
+"""
+
+class ConnectionHealth:
+    """
+    Tracks the liveness of the mixer from its replies. Every incoming
+    message counts as a sign of life. When the mixer was silent for the
+    probe interval, /xinfo is sent as ping and its round trip time is
+    measured; the reply timeout follows the smoothed round trip time.
+    After several unanswered pings in a row the mixer is considered lost
+    and pinged with a growing interval until it answers again. Then the
+    /xremotenfb subscription is renewed and the mixer state is synced
+    again in the background.
+
+    tick() does all sending and returns the time until it wants to be
+    called again, it runs on the shared timers once the startup is done.
+    """
+    _PROBE_INTERVAL = 1.0
+    _MIN_TIMEOUT = 0.05
+    # used until the first ping was answered
+    _INITIAL_TIMEOUT = 0.25
+    _MAX_TIMEOUT = 1.0
+    _MAX_MISSED = 3
+    _LOST_INTERVAL = 0.25
+    _MAX_LOST_INTERVAL = 1.0
+    # /xremotenfb subscriptions expire after 10 s on the mixer
+    _REFRESH_INTERVAL = 5.0
+
+    CONNECTING = 'connecting'
+    CONNECTED = 'connected'
+    LOST = 'lost'
+
+    def __init__(self, client):
+        self.client = client
+        self.status = self.CONNECTING
+        self.last_reply = 0.0
+        self.last_refresh = None
+        # outstanding ping
+        self.probe_sent = None
+        self.missed = 0
+        self.lost_interval = self._LOST_INTERVAL
+        # smoothed round trip time and its variation like TCP (RFC 6298)
+        self.srtt = None
+        self.rttvar = 0.0
+        self.resync_running = False
+        self.resync_needed = False
+        # time line of the last outage, for reports and benchmarks
+        self.lost_at = None
+        self.returned_at = None
+        self.recovered_at = None
+        self.losses = 0
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def received(self, addr):
+        """
+        Called by XAirClient for every incoming message
+        """
+        now = time.monotonic()
+        self.last_reply = now
+        if self.probe_sent != None:
+            # any reply proves the mixer is there, only pings give the round trip time
+            if addr == '/xinfo':
+                self.update_rtt(now - self.probe_sent)
+            self.probe_sent = None
+        self.missed = 0
+        if self.status == self.LOST:
+            # do not wait for the next tick, the mixer is back now
+            with self.lock:
+                if self.status == self.LOST:
+                    self.reconnect(now)
+
+    def update_rtt(self, rtt):
+        if self.srtt == None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+    def timeout(self):
+        if self.srtt == None:
+            return self._INITIAL_TIMEOUT
+        return min(max(self._MIN_TIMEOUT, self.srtt + 4 * self.rttvar), self._MAX_TIMEOUT)
+
+    def connected(self):
+        """
+        Startup found the mixer and synced its state
+        """
+        self.status = self.CONNECTED
+        self.last_reply = time.monotonic()
+        self.start()
+
+    def waiting(self):
+        """
+        Startup did not find the mixer, connect once it answers
+        """
+        with self.lock:
+            self.status = self.LOST
+            self.lost_at = time.monotonic()
+        self.start()
+
+    def start(self):
+        if self.timer == None:
+            self.timer = timers.add(time.monotonic(), self.run_timer)
+
+    def run_timer(self, due):
+        return time.monotonic() + self.tick()
+
+    def tick(self, now = None):
+        if now == None:
+            now = time.monotonic()
+        with self.lock:
+            alive = now - self.last_reply < self._PROBE_INTERVAL
+            if self.status == self.CONNECTING:
+                return self._PROBE_INTERVAL
+            elif self.status == self.LOST:
+                return self.probe_lost(now)
+            if self.last_refresh == None or now - self.last_refresh >= self._REFRESH_INTERVAL:
+                self.client.send('/xremotenfb')
+                self.last_refresh = now
+            if alive and self.probe_sent == None:
+                # traffic from the mixer, no ping needed until it is silent
+                return min(self._PROBE_INTERVAL - (now - self.last_reply), self.until_refresh(now))
+            if self.probe_sent != None:
+                if now - self.probe_sent < self.timeout():
+                    return self.timeout() - (now - self.probe_sent)
+                self.missed += 1
+                if self.missed >= self._MAX_MISSED:
+                    self.lose(now)
+                    return self.lost_interval
+            self.probe_sent = now
+            self.client.send('/xinfo')
+            return min(self.timeout(), self.until_refresh(now))
+
+    def until_refresh(self, now):
+        return max(0.0, self._REFRESH_INTERVAL - (now - self.last_refresh))
+
+    def probe_lost(self, now):
+        # back off while the mixer is gone, but keep asking
+        self.client.send('/xinfo')
+        interval = self.lost_interval
+        self.lost_interval = min(self.lost_interval * 2, self._MAX_LOST_INTERVAL)
+        return interval
+
+    def lose(self, now):
+        print('Connection to mixer lost, reconnecting...')
+        self.status = self.LOST
+        self.lost_at = now
+        self.losses += 1
+        self.probe_sent = None
+        self.missed = 0
+        self.lost_interval = self._LOST_INTERVAL
+        for sync in self.client.syncs:
+            sync.cancel()
+
+    def reconnect(self, now):
+        print('Mixer is back, syncing state')
+        self.status = self.CONNECTED
+        self.returned_at = now
+        self.lost_interval = self._LOST_INTERVAL
+        # the mixer forgets subscriptions on reboot
+        self.client.send('/xremotenfb')
+        self.client.meters.subscribe()
+        self.last_refresh = now
+        self.start_resync()
+
+    def start_resync(self):
+        if self.resync_running:
+            self.resync_needed = True
+            return
+        self.resync_running = True
+        worker = threading.Thread(target = self.resync)
+        worker.daemon = True
+        worker.start()
+
+    def resync(self):
+        """
+        Query the mixer state again. Values that did not change on the
+        mixer leave the surface alone, the LED shadow drops them.
+        """
+        while True:
+            self.resync_needed = False
+            # waits for a sync which is still running, e.g. the initial load
+            complete = StateSync(self.client, self.client.state).run()
+            if complete and self.status == self.CONNECTED:
+                self.recovered_at = time.monotonic()
+            with self.lock:
+                if not self.resync_needed or self.status != self.CONNECTED:
+                    self.resync_running = False
+                    return
+
+    def summary(self):
+        lines = ['Connection: %s, %d losses' % (self.status, self.losses)]
+        if self.srtt != None:
+            lines.append('  round trip %.2f ms, variation %.2f ms' % (self.srtt * 1000, self.rttvar * 1000))
+        if self.recovered_at != None and self.returned_at != None:
+            lines.append('  state recovered %.2f s after the mixer returned' % (self.recovered_at - self.returned_at))
+        return '\n'.join(lines)
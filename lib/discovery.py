@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import socket
+import struct
+import select
+from pythonosc.osc_message import OscMessage
+from .statecache import cache_directory
+from .stats import timeline
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+"""
+This module finds X-Air mixers in the local networks and remembers the
+last used mixer, so a normal startup only has to validate its address
+"""
+
+XAIR_PORT = 10024
+
+# ioctl to read the broadcast address of an interface on Linux
+_SIOCGIFBRDADDR = 0x8919
+
+def broadcast_addresses():
+    """
+    Broadcast addresses of all IPv4 interfaces, the global broadcast
+    address is always included
+    """
+    addresses = ['255.255.255.255']
+    if fcntl == None or not hasattr(socket, 'if_nameindex'):
+        return addresses
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for index, name in socket.if_nameindex():
+            try:
+                request = struct.pack('256s', name.encode()[:15])
+                address = socket.inet_ntoa(fcntl.ioctl(probe.fileno(), _SIOCGIFBRDADDR, request)[20:24])
+            except OSError:
+                # interface without IPv4 address or broadcast support
+                continue
+            if address not in addresses and address != '0.0.0.0':
+                addresses.append(address)
+    finally:
+        probe.close()
+    return addresses
+
+def cache_path():
+    return os.path.join(cache_directory(), 'mixer.json')
+
+def load_last_mixer():
+    """
+    Returns the /xinfo reply of the last used mixer or None
+    """
+    try:
+        with open(cache_path()) as f:
+            info = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if not isinstance(info, list) or len(info) != 4:
+        return None
+    return info
+
+def remember_mixer(info):
+    try:
+        os.makedirs(cache_directory(), exist_ok = True)
+        temp = cache_path() + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump([str(value) for value in info], f)
+        os.replace(temp, cache_path())
+    except OSError as e:
+        print('Warning: Can not remember mixer address: %s' % e)
+
+def discover(preferred = None, timeout = 1.0, retry_interval = 0.1, port = XAIR_PORT, settle = None):
+    """
+    Send /xinfo to the broadcast address of every interface and to the
+    preferred addresses, repeating every retry interval until the
+    timeout. Returns the /xinfo replies of all mixers that answered, or
+    only the first preferred mixer (given by ip address or name) as soon
+    as it answers. With settle, the search ends this long after the
+    first mixer answered.
+    """
+    preferred = preferred or []
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    client.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, True)
+    client.setblocking(False)
+    targets = broadcast_addresses() + [address for address in preferred if address.count('.') == 3]
+    found = {}
+    try:
+        start = time.monotonic()
+        deadline = start + timeout
+        next_send = start
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if now >= next_send:
+                for target in targets:
+                    try:
+                        client.sendto(b'/xinfo\0\0', (target, port))
+                    except OSError:
+                        # no route on this interface
+                        pass
+                next_send = now + retry_interval
+            readable, _, _ = select.select([client], [], [], max(0.0, min(next_send, deadline) - now))
+            while len(readable) > 0:
+                try:
+                    data, sender = client.recvfrom(512)
+                except BlockingIOError:
+                    break
+                try:
+                    response = OscMessage(data)
+                except Exception:
+                    continue
+                if response.address != '/xinfo' or len(response.params) < 4:
+                    continue
+                info = [str(value) for value in response.params[0:4]]
+                # the reply holds the configured ip, trust the sender if it is unset
+                if info[0] in ('', '0.0.0.0'):
+                    info[0] = sender[0]
+                if info[0] in preferred or info[1] in preferred:
+                    return [info]
+                if len(found) == 0 and settle != None:
+                    deadline = min(deadline, time.monotonic() + settle)
+                found[info[0]] = info
+    finally:
+        client.close()
+    return list(found.values())
+
+def find_mixer(name = None, timeout = 1.0):
+    """
+    Find the mixer to use: the one with the given name, else the last
+    used one if it is still there, else the first one that answered
+    """
+    preferred = [name] if name != None else []
+    last = load_last_mixer()
+    if last != None and (name == None or name in last[0:2]):
+        # ask the last used mixer directly, it answers before any broadcast reply
+        preferred += [last[0], last[1]]
+    print('Searching for mixer...')
+    # without a name any mixer will do, only wait a moment for others to answer
+    mixers = discover(preferred, timeout, settle = 0.2 if name == None else None)
+    if name != None:
+        mixers = [info for info in mixers if info[1] == name or info[0] == name]
+    if len(mixers) == 0:
+        print('No server found')
+        return None
+    for info in mixers[1:]:
+        print('Also found %s %s on IP %s' % (info[2], info[1], info[0]))
+    info = mixers[0]
+    timeline.mark('mixer found')
+    print('Found ' + info[2] + ' with firmware ' + info[3] + ' on IP ' + info[0])
+    remember_mixer(info)
+    return info[0]
@@ -0,0 +1,139 @@
+import os
+import json
+
+"""
+This module loads the control layout, which assigns actions to the
+controls of the X-Touch Mini and defines the fader banks.
+
+A layout is a JSON file with three entries:
+
+    banks   list of fader banks, each a list of 8 OSC base addresses
+            (e.g. "/ch/01/mix") or null for unassigned encoders
+    global  actions assigned in every layer
+    layers  list of layers, each a dict of control name -> action
+
+Controls are named like the labels: E1 - E8 for turning an encoder,
+E1.push - E8.push for pushing it, B01 - B16 for the buttons, LA and LB
+for the layer buttons and F1 for the fader. An action is a list of the
+action name followed by its argument, e.g. ["fader", 0], ["bank", 2] or
+["snapshot", "verse"].
+"""
+
+DEFAULT_LAYOUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'layouts', 'default.json')
+
+# action name -> (kind of control it can be assigned to, type of its argument)
+ACTIONS = {
+    'fader': ('encoder', int),
+    'bus_send': ('encoder', int),
+    'lr_fader': ('fader', None),
+    'channel_mute': ('button', int),
+    'mute_group': ('button', int),
+    'bank': ('button', int),
+    'bus': ('button', int),
+    'layer': ('button', int),
+    'tap_tempo': ('button', None),
+    'mpc': ('button', None),
+    'snapshot': ('button', str),
+    'meters': ('button', None)
+}
+
+BANK_SIZE = 8
+NUM_BUSES = 10
+NUM_MUTE_GROUPS = 4
+
+def control_kind(name):
+    """
+    Returns the kind of a control name or None if there is no such control
+    """
+    if name == 'F1':
+        return 'fader'
+    elif name in ('LA', 'LB'):
+        return 'button'
+    elif name.startswith('E') and name.endswith('.push') and name[1:-5] in ('1', '2', '3', '4', '5', '6', '7', '8'):
+        return 'button'
+    elif name.startswith('E') and name[1:] in ('1', '2', '3', '4', '5', '6', '7', '8'):
+        return 'encoder'
+    elif name.startswith('B') and len(name) == 3 and name[1:].isdigit() and 1 <= int(name[1:]) <= 16:
+        return 'button'
+    return None
+
+class Layout:
+    """
+    Validated control layout
+    """
+    def __init__(self, data, source = '<layout>'):
+        self.source = source
+        if not isinstance(data, dict):
+            self.error('a layout must be a JSON object')
+        self.banks = data.get('banks')
+        if not isinstance(self.banks, list) or len(self.banks) == 0:
+            self.error('banks must be a non-empty list')
+        seen = set()
+        for bank in self.banks:
+            if not isinstance(bank, list) or len(bank) != BANK_SIZE:
+                self.error('every bank needs exactly %d entries' % BANK_SIZE)
+            for addr in bank:
+                if addr != None and not (isinstance(addr, str) and addr.startswith('/')):
+                    self.error('invalid OSC address %r' % (addr,))
+                # mixer feedback for an address is shown in one place only
+                if addr != None and addr in seen:
+                    self.error('channel %s is in more than one bank' % addr)
+                seen.add(addr)
+
+        common = data.get('global', {})
+        if not isinstance(common, dict):
+            self.error('global must be a dict of control name -> action')
+        layers = data.get('layers')
+        if not isinstance(layers, list) or len(layers) == 0:
+            self.error('layers must be a non-empty list')
+        # every layer is a dict of control name -> (action, argument)
+        self.layers = []
+        for layer in layers:
+            if not isinstance(layer, dict):
+                self.error('every layer must be a dict of control name -> action')
+            controls = {}
+            for source_map in (common, layer):
+                for name, action in source_map.items():
+                    controls[name] = self.parse_action(name, action)
+            self.layers.append(controls)
+        for controls in self.layers:
+            for action, arg in controls.values():
+                if action == 'layer' and arg >= len(self.layers):
+                    self.error('layer %d does not exist' % arg)
+
+    def parse_action(self, name, action):
+        kind = control_kind(name)
+        if kind == None:
+            self.error('unknown control %s' % name)
+        if not isinstance(action, list) or len(action) == 0 or action[0] not in ACTIONS:
+            self.error('invalid action %r for %s' % (action, name))
+        action_kind, arg_type = ACTIONS[action[0]]
+        if action_kind != kind:
+            self.error('action %s can not be assigned to %s' % (action[0], name))
+        if arg_type == None:
+            return (action[0], None)
+        if arg_type == str:
+            if len(action) != 2 or not isinstance(action[1], str):
+                self.error('action %s for %s needs a name' % (action[0], name))
+            return (action[0], action[1])
+        # bool is an int in Python, but false is no bank number
+        if len(action) != 2 or not isinstance(action[1], int) or isinstance(action[1], bool) or action[1] < 0:
+            self.error('action %s for %s needs a number' % (action[0], name))
+        limit = {'fader': BANK_SIZE, 'bus_send': BANK_SIZE, 'channel_mute': BANK_SIZE,
+                 'mute_group': NUM_MUTE_GROUPS, 'bank': len(self.banks), 'bus': NUM_BUSES}.get(action[0])
+        if limit != None and action[1] >= limit:
+            self.error('%s %d out of range for %s' % (action[0], action[1], name))
+        return (action[0], action[1])
+
+    def error(self, message):
+        raise ValueError('%s: %s' % (self.source, message))
+
+def load_layout(path = None):
+    if path == None:
+        path = DEFAULT_LAYOUT
+    with open(path) as f:
+        try:
+            data = json.load(f)
+        except ValueError as e:
+            raise ValueError('%s: %s' % (path, e))
+    return Layout(data, path)
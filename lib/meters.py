@@ -0,0 +1,162 @@
+import time
+import struct
+from bisect import bisect_right
+from .commandqueue import PRIORITY_OSC
+from .timers import timers
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+"""
+This module streams the level meters of the mixer. The mixer sends
+/meters/1 as one blob holding the count of values followed by the
+signed 16 bit levels in 1/256 dB, both little endian:
+
+    16 channels, aux L/R, fx returns 1-4 L/R, buses 1-6,
+    fx sends 1-4, main L/R, monitor L/R
+"""
+
+METERS = '/meters/1'
+
+_COUNT = struct.Struct('<i')
+# unpackers per number of values, the count does not change for a mixer
+_UNPACKERS = {}
+
+def meter_index(base):
+    """
+    Position of the meter of a channel base address (e.g. /ch/01/mix) in
+    /meters/1, or None if there is no meter for it
+    """
+    if base == None:
+        return None
+    parts = base.split('/')
+    if base.startswith('/ch/') and parts[2].isdigit():
+        return int(parts[2]) - 1
+    elif base == '/rtn/aux/mix':
+        return 16
+    elif base.startswith('/rtn/') and parts[2].isdigit():
+        return 18 + 2 * (int(parts[2]) - 1)
+    elif base.startswith('/bus/') and parts[2].isdigit():
+        return 26 + int(parts[2]) - 1
+    elif base.startswith('/fxsend/') and parts[2].isdigit():
+        return 32 + int(parts[2]) - 1
+    elif base == '/lr/mix':
+        return 36
+    return None
+
+def decode_meters(data):
+    """
+    All levels of a meter blob in one call, as a NumPy array if NumPy is
+    installed, else as a tuple
+    """
+    if len(data) < 4:
+        raise ValueError('short meter blob')
+    count = _COUNT.unpack_from(data)[0]
+    if count < 0 or 4 + 2 * count > len(data):
+        raise ValueError('meter blob with %d values is too short' % count)
+    if numpy != None:
+        return numpy.frombuffer(data, '<i2', count, 4)
+    unpack = _UNPACKERS.get(count)
+    if unpack == None:
+        unpack = _UNPACKERS[count] = struct.Struct('<%dh' % count).unpack_from
+    return unpack(data, 4)
+
+class MeterScale:
+    """
+    Maps levels to the number of lit ring segments, one segment per 5 dB
+    from -55 dB up to 0 dB
+    """
+    SEGMENTS = 11
+    _FLOOR_DB = -55.0
+    _STEP_DB = 5.0
+
+    def __init__(self):
+        # lowest raw level lighting 1, 2, ... segments
+        self.thresholds = [round((self._FLOOR_DB + i * self._STEP_DB) * 256) for i in range(0, self.SEGMENTS)]
+
+    def segments(self, level):
+        return bisect_right(self.thresholds, int(level))
+
+scale = MeterScale()
+
+class MeterStream:
+    """
+    Subscribes to /meters/1 while a controller shows meters and hands the
+    levels to the mixer state at most rate times per second. The mixer
+    may send faster, frames in between are dropped unread and only the
+    last one is decoded.
+
+    The subscription expires after 10 s on the mixer and is renewed on
+    the shared timers.
+    """
+    _RENEW_INTERVAL = 5.0
+
+    def __init__(self, client, rate = 20):
+        self.client = client
+        self.rate = rate
+        self.active = False
+        # last blob received and last blob shown, compared by identity
+        self.latest = None
+        self.shown = None
+        self.renew_timer = None
+        self.refresh_timer = None
+        self.frames = 0
+        self.decoded = 0
+
+    def start(self):
+        if self.active:
+            return
+        self.active = True
+        now = time.monotonic()
+        self.renew_timer = timers.add(now, self.renew)
+        self.refresh_timer = timers.add(now, self.refresh)
+
+    def stop(self):
+        if not self.active:
+            return
+        self.active = False
+        timers.cancel(self.renew_timer)
+        timers.cancel(self.refresh_timer)
+        self.latest = None
+        self.shown = None
+
+    def subscribe(self):
+        if self.active:
+            self.client.send('/meters', METERS)
+
+    def renew(self, due):
+        self.subscribe()
+        return due + self._RENEW_INTERVAL
+
+    def received(self, data):
+        """
+        Called by XAirClient for every /meters/1 message
+        """
+        self.frames += 1
+        if self.active:
+            self.latest = data
+
+    def refresh(self, due):
+        data = self.latest
+        if data is not self.shown:
+            self.shown = data
+            try:
+                levels = decode_meters(data)
+            except ValueError:
+                levels = None
+            if levels is not None:
+                self.decoded += 1
+                state = self.client.state
+                state.commands.submit(PRIORITY_OSC, state.show_meters, levels)
+        interval = 1.0 / self.rate
+        next_due = due + interval
+        now = time.monotonic()
+        if next_due < now:
+            # skip refreshes that are already over instead of catching up
+            next_due += ((now - next_due) // interval + 1) * interval
+        return next_due
+
+    def summary(self):
+        return 'Meters: %d frames received, %d shown' % (self.frames, self.decoded)
@@ -1,28 +1,39 @@
-import threading
 import time
+import math
 import os
 from .mixerstate import MixerState
-from mido import Message, open_input, open_output, get_input_names, get_output_names
+from .commandqueue import PRIORITY_MIDI
+from .stats import stats, timeline
+from .timers import timers
+from .meters import scale
+from .recorder import MIDI_IN, MIDI_OUT
+from . import rawmidi
+import mido
+from mido import Message
 
 class TempoDetector:
     """
-    Detect song tempo via a tap button
+    Detect song tempo via a tap button and blink the tempo LED in phase
+    with the taps. The LED turns on at anchor + n * current_tempo, all
+    deadlines are absolute so the blinking does not drift.
     """
     _MAX_TAP_DURATION = 3.0
-    
-    current_tempo = 0.5
+    # part of a beat the LED is lit
+    _LED_ON_TIME = 0.2
+    # shortest beat shown, a delay time of 0 would stop the LED
+    _MIN_TEMPO = 0.05
     
     def __init__(self, midi_controller):
         self.midi_controller = midi_controller
+        self.current_tempo = 0.5
         self.last_tap = 0
         self.tap_num = 0
         self.tap_delta = 0
-        worker = threading.Thread(target = self.blink)
-        worker.daemon = True
-        worker.start()
+        self.anchor = time.monotonic()
+        self.timer = timers.add(self.anchor, self.blink)
     
     def tap(self):
-        current_time = time.time()
+        current_time = time.monotonic()
         if current_time - self.last_tap > self._MAX_TAP_DURATION:
             # Start with new tap cycle
             self.tap_num = 0
@@ -31,20 +42,64 @@ class TempoDetector:
             self.tap_num += 1
             self.tap_delta += current_time - self.last_tap
             if self.tap_num > 0:
-                # Update tempo in mixer after at least 2 taps
-                self.midi_controller.update_tempo(self.tap_delta / self.tap_num, True)
-                self.current_tempo = self.tap_delta / self.tap_num
+                # Update tempo in mixer after at least 2 taps, beats start with the last tap
+                self.midi_controller.update_tempo(self.tap_delta / self.tap_num, True, current_time)
         self.last_tap = current_time
-        
-    def blink(self):
-        try:
-            while True:
-                self.midi_controller.tempo_led(True)
-                time.sleep(self.current_tempo * 0.2)
-                self.midi_controller.tempo_led(False)
-                time.sleep(self.current_tempo * 0.8)
-        except KeyboardInterrupt:
-            exit()
+
+    def set_tempo(self, tempo, anchor = None):
+        if anchor == None:
+            # keep the phase, the new tempo starts with the current beat
+            anchor = self.beat_start(time.monotonic())
+        self.current_tempo = max(tempo, self._MIN_TEMPO)
+        self.anchor = anchor
+        timers.cancel(self.timer)
+        self.timer = timers.add(time.monotonic(), self.blink)
+
+    def beat_start(self, now):
+        # the small offset keeps rounding from putting a deadline into the previous beat
+        return self.anchor + math.floor((now - self.anchor) / self.current_tempo + 1e-9) * self.current_tempo
+
+    def blink(self, due):
+        beat = self.beat_start(due)
+        led_off = beat + self.current_tempo * self._LED_ON_TIME
+        if due < led_off:
+            self.midi_controller.tempo_led(True)
+            return led_off
+        self.midi_controller.tempo_led(False)
+        return beat + self.current_tempo
+
+class CompiledLayer:
+    """
+    Lookup tables of one layer: handlers per control change and note
+    number, and the LEDs and rings showing the state of each action
+    """
+    def __init__(self):
+        self.cc = [None] * 128
+        self.note = [None] * 128
+        self.pitchwheel = None
+        self.banks = []
+        self.leds = []
+        self.notes = set()
+        self.ring_list = []
+        self.rings = set()
+        self.led_index = {}
+        self.ring_index = {}
+
+    def add_led(self, action, arg, note):
+        self.leds.append((action, arg, note))
+        self.notes.add(note)
+        self.led_index.setdefault((action, arg), []).append(note)
+
+    def add_ring(self, action, arg, control):
+        self.ring_list.append((action, arg, control))
+        self.rings.add(control)
+        self.ring_index.setdefault((action, arg), []).append(control)
+
+    def leds_for(self, action, arg):
+        return self.led_index.get((action, arg), ())
+
+    def rings_for(self, action, arg):
+        return self.ring_index.get((action, arg), ())
 
 class MidiController:
     """
@@ -58,9 +113,18 @@ class MidiController:
     Buttons 1-8: Note 89, 90, 40, 41, 42, 43, 44, 45 
     Buttons 9-16: Note 87, 88, 91, 92, 86, 93, 94, 95
     Master Fader: Pitch Wheel
+
+    The actions of all controls are defined by the layout of the
+    MixerState and compiled into lookup tables per layer.
     """
     MC_CHANNEL = 0
 
+    # status bytes without the channel
+    STATUS_NOTE_OFF = 0x80
+    STATUS_NOTE_ON = 0x90
+    STATUS_CONTROL = 0xB0
+    STATUS_PITCHWHEEL = 0xE0
+
     MIDI_BUTTONS = [89, 90, 40, 41, 42, 43, 44, 45, 87, 88, 91, 92, 86, 93, 94, 95]
     MIDI_PUSH = [32, 33, 34, 35, 36, 37, 38, 39]
     MIDI_ENCODER = [16, 17, 18, 19, 20, 21, 22, 23]
@@ -71,216 +135,472 @@ class MidiController:
     LED_BLINK = 1
     LED_ON = 127
 
-    active_layer = 0
-    active_bus = 0
+    DEFAULT_PORT = 'x-touch mini'
 
-    inport = None
-    outport = None
+    # device checks while connected, with and without a cheap change indicator
+    _WATCH_INTERVAL = 0.25
+    _POLL_INTERVAL = 1.0
+    # reattach attempts while the device is gone
+    _MIN_RETRY_INTERVAL = 0.25
+    _MAX_RETRY_INTERVAL = 4.0
+    # changes whenever a sound device is added or removed on Linux
+    _DEVICE_DIR = '/dev/snd'
     
-    def __init__(self, state):
+    def __init__(self, state, backend = None, port = None, exit_on_disconnect = False, meter_mode = False,
+                 raw_midi = True):
         self.state = state
-    
-        for name in get_input_names():
-            if "x-touch mini" in name.lower():
-                print('Using MIDI input: ' + name)
-                try:
-                    self.inport = open_input(name)
-                except IOError:
-                    print('Error: Can not open MIDI input port ' + name)
-                    exit()
-                break
-
-        for name in get_output_names():
-            if "x-touch mini" in name.lower():
-                print('Using MIDI output: ' + name)
+        # module providing port enumeration and opening: rtmidi with raw bytes if
+        # available, else mido, unless a test backend is given
+        if backend == None:
+            backend = mido
+            if raw_midi and rawmidi.available():
                 try:
-                    self.outport = open_output(name)
-                except IOError:
-                    print('Error: Can not open MIDI input port ' + name)
-                    exit()
-                break
-        
-        if self.inport is None or self.outport is None:
-            print('X-Touch Mini not found. Make sure device is connected!')
-            exit()
+                    backend = rawmidi.RawMidiBackend()
+                except IOError as e:
+                    print('Error: Can not use rtmidi, falling back to mido: %s' % e)
+        self.backend = backend
+        # raw backends send and receive tuples of bytes instead of mido messages
+        self.raw = getattr(backend, 'raw', False)
+        # part of the port name to look for, selects one of several connected devices
+        self.port = (port if port != None else self.DEFAULT_PORT).lower()
+        self.inport = None
+        self.outport = None
+        self.active_layer = 0
+        self.active_bus = 0
+        self.active_bank = -1
+        # rings of fader encoders show the channel levels instead of the faders
+        self.meter_mode = meter_mode
+        self.meter_levels = None
+        # last values sent to the surface, indexed by control and note number
+        self.shadow_cc = [None] * 128
+        self.shadow_note = [None] * 128
+        # outgoing messages per control and note number, indexed by value
+        self.cc_out = [None] * 128
+        self.note_out = [None] * 128
+        if self.raw:
+            # all ring values and button states are ready before the first event
+            for value in range(0, 128):
+                for control in self.MIDI_RING:
+                    self.build_message(self.cc_out, self.STATUS_CONTROL, control, value)
+                for note in self.MIDI_BUTTONS + self.MIDI_LAYER:
+                    self.build_message(self.note_out, self.STATUS_NOTE_ON, note, value)
+        # traffic recorder and the controller number used in its log
+        self.recorder = None
+        self.source = 0
+    
+        # hotplug: ports are reopened when the device returns
+        self.exit_on_disconnect = exit_on_disconnect
+        self.port_failed = False
+        self.devices_stamp = self.devices_changed()
+        self.retry_interval = self._MIN_RETRY_INTERVAL
+        self.next_retry = 0.0
 
+        self.compile_layout(state.layout)
         self.tempo_detector = TempoDetector(self)
+        if not self.attach():
+            print('X-Touch Mini %snot found, waiting for it to be connected' % ('' if port == None else port + ' '))
         self.change_layer(0)
         self.activate_bank(0)
         #self.activate_bus(0)
 
-        worker = threading.Thread(target = self.midi_listener)
-        worker.daemon = True
-        worker.start()
+        self.watch_timer = timers.call_later(self._WATCH_INTERVAL, self.watch_ports)
+        timeline.mark('controller ready')
 
-    def monitor_ports(self):
+    def attach(self):
+        """
+        Open the ports of the device, returns False if it is not connected
+        """
+        inport = None
+        outport = None
         try:
-            while True:
-                if self.inport.name not in get_input_names():
-                    print("X-Touch disconnected - Exiting")
-                    os._exit(1)
-                time.sleep(1)
-        except KeyboardInterrupt:
-            exit()
-
-    def midi_listener(self):
+            for name in self.backend.get_input_names():
+                if self.port in name.lower():
+                    inport = self.backend.open_input(name)
+                    break
+            for name in self.backend.get_output_names():
+                if self.port in name.lower():
+                    outport = self.backend.open_output(name)
+                    break
+        except IOError as e:
+            print('Error: Can not open MIDI port: %s' % e)
+        if inport == None or outport == None:
+            for opened in (inport, outport):
+                if opened != None:
+                    opened.close()
+            return False
+        print('Using MIDI input: ' + inport.name)
+        print('Using MIDI output: ' + outport.name)
+        self.port_failed = False
+        self.outport = outport
+        self.inport = inport
+        # MIDI input is handled on the thread of the MIDI library
+        inport.callback = self.received_raw if self.raw else self.received_midi
+        return True
+
+    def detach(self):
+        ports = (self.inport, self.outport)
+        self.inport = None
+        self.outport = None
+        for port in ports:
+            try:
+                port.close()
+            except Exception:
+                # the device is already gone
+                pass
+
+    def received_midi(self, msg):
+        if self.recorder != None:
+            self.recorder.record(MIDI_IN, self.source, bytes(msg.bytes()))
+        self.state.commands.submit(PRIORITY_MIDI, self.handle_message, msg)
+
+    def received_raw(self, event, data = None):
+        # rtmidi passes the bytes and the time since the last event
+        message = event[0]
+        if self.recorder != None:
+            self.recorder.record(MIDI_IN, self.source, bytes(message))
+        self.state.commands.submit(PRIORITY_MIDI, self.handle_bytes, message)
+
+    def devices_changed(self):
+        """
+        Cheap check for added or removed sound devices. Returns a stamp
+        which changes when devices change, or None if the platform has
+        no such check and the ports have to be enumerated.
+        """
+        if not getattr(self.backend, 'hardware', self.backend == mido):
+            return None
         try:
-            for msg in self.inport:
-                #print('Received {}'.format(msg))
-                if msg.type == 'control_change':
-                    if msg.control in self.MIDI_ENCODER:
-                        delta = msg.value
-                        if delta > 64:
-                            delta = (delta - 64) * -1
-                        if self.active_layer == 0:
-                            self.state.change_fader(self.MIDI_ENCODER.index(msg.control), delta)
-                        else:
-                            self.state.change_bus_send(self.active_bus, self.MIDI_ENCODER.index(msg.control), delta)
-                    else:
-                        print('Received unknown {}'.format(msg))
-                elif msg.type == 'note_on' and msg.velocity == 127:
-                    if msg.note in self.MIDI_PUSH:
-                        self.knob_pushed(self.MIDI_PUSH.index(msg.note))
-                    elif msg.note in self.MIDI_BUTTONS:
-                        self.button_pushed(self.MIDI_BUTTONS.index(msg.note))
-                    elif msg.note in self.MIDI_LAYER:
-                        self.change_layer(self.MIDI_LAYER.index(msg.note))
-                    else:
-                        print('Received unknown {}'.format(msg))
-                elif msg.type == 'pitchwheel':
-                    value = (msg.pitch + 8192) / 16384
-                    self.state.set_lr_fader(value)
-                elif msg.type != 'note_off' and msg.type != 'note_on':
-                    print('Received unknown {}'.format(msg))
-        except KeyboardInterrupt:
-            self.inport.close()
-            self.outport.close()
-            exit()
-    
-    def button_pushed(self, button):
-        if button == 8:
-            # mute grp 4 pressed
-            self.state.toggle_mute_group(3)
-        elif button == 9:
-            # tempo button pressed
-            self.tempo_detector.tap()
-        elif button != 10:
-            if self.active_layer == 0:
-                if button >= 11 and button <= 15:
-                    # bank select buttons pressed
-                    self.activate_bank(button - 11)
+            return os.stat(self._DEVICE_DIR).st_mtime_ns
+        except OSError:
+            return None
+
+    def watch_ports(self, due):
+        return time.monotonic() + self.check_ports()
+
+    def check_ports(self):
+        """
+        Notice removal and return of the device, returns the time until
+        the next check
+        """
+        now = time.monotonic()
+        stamp = self.devices_changed()
+        changed = stamp != None and stamp != self.devices_stamp
+        self.devices_stamp = stamp
+        interval = self._WATCH_INTERVAL if stamp != None else self._POLL_INTERVAL
+        if self.outport != None:
+            if not self.port_failed and ((stamp != None and not changed) or self.inport.name in self.backend.get_input_names()):
+                return interval
+            if self.exit_on_disconnect:
+                print("X-Touch disconnected - Exiting")
+                os._exit(1)
+            print('X-Touch disconnected, waiting for it to return')
+            self.detach()
+            changed = True
+        # the device is gone: try right away when devices changed, else back off
+        if changed:
+            self.retry_interval = self._MIN_RETRY_INTERVAL
+            self.next_retry = now
+        if now >= self.next_retry:
+            if self.attach():
+                self.state.commands.submit(PRIORITY_MIDI, self.force_repaint)
+                return interval
+            self.next_retry = now + self.retry_interval
+            self.retry_interval = min(self.retry_interval * 2, self._MAX_RETRY_INTERVAL)
+        return min(interval, self.next_retry - now)
+
+    def compile_layout(self, layout):
+        """
+        Compile the layout into flat lookup tables per layer, so every
+        incoming event is resolved with a single list index
+        """
+        self.layers = []
+        for controls in layout.layers:
+            layer = CompiledLayer()
+            for name, (action, arg) in controls.items():
+                handler = getattr(self, 'action_' + action)
+                if name == 'F1':
+                    layer.pitchwheel = (handler, arg)
+                elif name in ('LA', 'LB'):
+                    note = self.MIDI_LAYER[0 if name == 'LA' else 1]
+                    layer.note[note] = (handler, arg)
+                    layer.add_led(action, arg, note)
+                elif name.endswith('.push'):
+                    layer.note[self.MIDI_PUSH[int(name[1:-5]) - 1]] = (handler, arg)
+                elif name.startswith('E'):
+                    encoder = int(name[1:]) - 1
+                    layer.cc[self.MIDI_ENCODER[encoder]] = (handler, arg)
+                    layer.add_ring(action, arg, self.MIDI_RING[encoder])
                 else:
-                    # mute buttons pressed
-                    self.state.toggle_channel_mute(button)
+                    note = self.MIDI_BUTTONS[int(name[1:]) - 1]
+                    layer.note[note] = (handler, arg)
+                    layer.add_led(action, arg, note)
+                if action == 'bank':
+                    layer.banks.append(arg)
+            # unassigned rings and buttons are switched off
+            for ring in self.MIDI_RING:
+                if ring not in layer.rings:
+                    layer.add_ring(None, None, ring)
+            for note in self.MIDI_BUTTONS:
+                if note not in layer.notes:
+                    layer.add_led(None, None, note)
+            self.layers.append(layer)
+
+    def handle_message(self, msg):
+        # messages of mido ports are decoded like the bytes of rtmidi
+        self.handle_bytes(msg.bytes())
+
+    def handle_bytes(self, data):
+        #print('Received {}'.format(data))
+        layer = self.layers[self.active_layer]
+        status = data[0] & 0xF0
+        if status == self.STATUS_CONTROL:
+            entry = layer.cc[data[1]]
+            if entry != None:
+                delta = data[2]
+                if delta > 64:
+                    delta = (delta - 64) * -1
+                entry[0](entry[1], delta)
             else:
-                if button >= 11 and button <= 13:
-                    # bank select buttons pressed
-                    self.activate_bank(button - 11)
-                else:
-                    self.active_bus = button if button < 8 else button - 6
-                    self.refresh_controls(self.state.active_bank)
+                self.unknown_message(data)
+        elif status == self.STATUS_NOTE_ON and data[2] == 127:
+            entry = layer.note[data[1]]
+            if entry != None:
+                entry[0](entry[1])
+            else:
+                self.unknown_message(data)
+        elif status == self.STATUS_PITCHWHEEL:
+            if layer.pitchwheel != None:
+                # 14 bit value, least significant 7 bits first
+                layer.pitchwheel[0](layer.pitchwheel[1], (data[1] | data[2] << 7) / 16384)
+        elif status != self.STATUS_NOTE_OFF and status != self.STATUS_NOTE_ON:
+            self.unknown_message(data)
+    
+    def unknown_message(self, data):
+        if stats.enabled:
+            stats.count('unknown midi')
+        try:
+            print('Received unknown {}'.format(Message.from_bytes(data)))
+        except ValueError:
+            print('Received unknown {}'.format(bytes(data).hex(' ')))
+
+    # Actions which can be assigned in the layout. Encoders get the
+    # turn delta, the fader its value from 0.0 to 1.0.
 
-    def knob_pushed(self, knob):
-        if knob >= 0 and knob <= 3:
-            self.state.toggle_mute_group(knob)
-        elif knob == 7:
-            self.state.toggle_mpc()
+    def action_fader(self, channel, delta):
+        self.state.change_fader(self.active_bank, channel, delta)
 
-    def activate_bank(self, bank):
+    def action_bus_send(self, channel, delta):
+        self.state.change_bus_send(self.active_bank, self.active_bus, channel, delta)
+
+    def action_lr_fader(self, arg, value):
+        self.state.set_lr_fader(value)
+
+    def action_channel_mute(self, channel):
+        self.state.toggle_channel_mute(self.active_bank, channel)
+
+    def action_mute_group(self, group):
+        self.state.toggle_mute_group(group)
+
+    def action_bank(self, bank):
+        self.activate_bank(bank)
+
+    def action_bus(self, bus):
+        self.active_bus = bus
+        self.refresh_controls(self.active_bank)
+
+    def action_layer(self, layer):
+        self.change_layer(layer)
+
+    def action_tap_tempo(self, arg):
+        self.tempo_detector.tap()
+
+    def action_mpc(self, arg):
+        self.state.toggle_mpc()
+
+    def action_snapshot(self, name):
+        self.state.snapshots.recall_async(name)
+
+    def action_meters(self, arg):
+        self.meter_mode = not self.meter_mode
+        self.meter_levels = None
+        self.state.update_meter_stream()
+        self.refresh_controls(self.active_bank)
+
+    def activate_bank(self, bank, refresh = False):
         #print("Switching to fader bank %d" % (bank + 1))
-        for i in range(0, 5):
-            if i == bank:
-                self.set_button(11 + i, True)
-            else:
-                self.set_button(11 + i, False)
-        if self.state.active_bank != bank:
+        changed = self.active_bank != bank
+        self.active_bank = bank
+        if changed or refresh:
             self.refresh_controls(bank)
-            self.state.active_bank = bank
         
     def change_layer(self, layer):
-        if layer == 0:
-            self.outport.send(Message('note_on', channel = self.MC_CHANNEL, note = self.MIDI_LAYER[0], velocity = self.LED_ON))
-            self.outport.send(Message('note_on', channel = self.MC_CHANNEL, note = self.MIDI_LAYER[1], velocity = self.LED_OFF))
-            self.activate_bank(self.state.active_bank)
-        else:
-            self.outport.send(Message('note_on', channel = self.MC_CHANNEL, note = self.MIDI_LAYER[0], velocity = self.LED_OFF))
-            self.outport.send(Message('note_on', channel = self.MC_CHANNEL, note = self.MIDI_LAYER[1], velocity = self.LED_ON))
-            if self.state.active_bank > 2:
-                self.activate_bank(2)
         self.active_layer = layer
-        self.refresh_controls(self.state.active_bank)
+        # stay in the current bank if the new layer can select it
+        banks = self.layers[layer].banks
+        bank = self.active_bank
+        if bank not in banks and len(banks) > 0:
+            lower = [b for b in banks if b <= bank]
+            bank = max(lower) if len(lower) > 0 else min(banks)
+        self.activate_bank(bank, True)
+
+    def force_repaint(self):
+        """
+        Forget what the surface is showing and send every LED again,
+        e.g. after the device was reconnected
+        """
+        self.shadow_cc = [None] * 128
+        self.shadow_note = [None] * 128
+        self.change_layer(self.active_layer)
     
     def refresh_controls(self, bank):
-        if self.active_layer == 0:
-            for i in range(0, 8):
-                if self.state.banks[bank][i] != None:
-                    # send fader for Layer A
-                    self.set_ring(i, self.state.banks[bank][i].fader)
-                    self.set_channel_mute(i, self.state.banks[bank][i].on)
-                else:
-                    # unassigned channel, disbale encoder and button
-                    self.set_ring(i, -1)
-                    self.set_button(i, False)
-        else:
-            for i in range(0, 10):
-                if i < 8:
-                    btn = i
-                else:
-                    # sends 9 & 10 need other button numbers
-                    btn = i + 6
-                if i != self.active_bus:
-                    self.set_button(btn, False)
-                else:
-                    self.set_button(btn, True)
-            for i in range(0, 8):
-                if self.state.banks[bank][i] != None and self.state.banks[bank][i].sends != None:
-                    self.set_ring(i, self.state.banks[bank][i].sends[self.active_bus])
-                else:
-                    self.set_ring(i, -1)
-        # set indicator for mute group 4
-        self.set_mute_grp(3, self.state.mute_groups[3].on)
+        layer = self.layers[self.active_layer]
+        for action, arg, note in layer.leds:
+            if action != 'tap_tempo':
+                self.send_note(note, self.LED_ON if self.led_state(bank, action, arg) else self.LED_OFF)
+        for action, arg, control in layer.ring_list:
+            self.send_control(control, self.ring_value(self.ring_state(bank, action, arg)))
+        if self.meter_mode and self.meter_levels is not None:
+            self.set_meters(self.meter_levels)
+
+    def led_state(self, bank, action, arg):
+        if action == 'channel_mute':
+            channel = self.state.banks[bank][arg] if bank >= 0 else None
+            return channel != None and channel.on == 0
+        elif action == 'mute_group':
+            return self.state.mute_groups[arg].on == 1
+        elif action == 'bank':
+            return bank == arg
+        elif action == 'bus':
+            return self.active_bus == arg
+        elif action == 'layer':
+            return self.active_layer == arg
+        elif action == 'snapshot':
+            return self.state.snapshots.current == arg
+        elif action == 'meters':
+            return self.meter_mode
+        return False
+
+    def ring_state(self, bank, action, arg):
+        channel = self.state.banks[bank][arg] if bank >= 0 and action != None else None
+        if channel == None:
+            return -1
+        elif action == 'fader' and self.meter_mode:
+            # the ring shows the last meter levels or waits for the next
+            return -1
+        elif action == 'fader':
+            return channel.fader
+        elif action == 'bus_send' and channel.sends != None:
+            return channel.sends[self.active_bus]
+        return -1
 
     def set_mute_grp(self, group, on):
-        if group == 3:
-            # we only need to update this group as all others have no led indicator
-            self.set_button(8, on == 1)
+        # only buttons assigned to this group have a led indicator
+        for note in self.layers[self.active_layer].leds_for('mute_group', group):
+            self.send_note(note, self.LED_ON if on == 1 else self.LED_OFF)
 
     def set_channel_mute(self, channel, on):
-        if self.active_layer == 0:
-            self.set_button(channel, on == 0)
+        for note in self.layers[self.active_layer].leds_for('channel_mute', channel):
+            self.send_note(note, self.LED_ON if on == 0 else self.LED_OFF)
 
     def set_channel_fader(self, channel, value):
-        if self.active_layer == 0:
-            self.set_ring(channel, value)
+        if self.meter_mode:
+            return
+        for control in self.layers[self.active_layer].rings_for('fader', channel):
+            self.send_control(control, self.ring_value(value))
 
     def set_bus_send(self, bus, knob, value):
-        if self.active_layer == 1 and self.active_bus == bus:
-            self.set_ring(knob, value)
+        if self.active_bus == bus:
+            for control in self.layers[self.active_layer].rings_for('bus_send', knob):
+                self.send_control(control, self.ring_value(value))
 
-    def set_ring(self, ring, value):
+    def set_meters(self, levels):
+        self.meter_levels = levels
+        slots = self.state.meter_slots[self.active_bank] if self.active_bank >= 0 else ()
+        for action, arg, control in self.layers[self.active_layer].ring_list:
+            if action == 'fader':
+                slot = slots[arg]
+                # the shadow drops rings whose number of lit segments did not change
+                self.send_control(control, self.meter_value(levels[slot]) if slot != None and slot < len(levels) else 0)
+
+    def meter_value(self, level):
+        # fan mode lights the segments from the left, 32 + n lights n segments
+        segments = scale.segments(level)
+        return 32 + segments if segments > 0 else 0
+
+    def ring_value(self, value):
         # 0 = off, 1-11 = single, 17-27 = trim, 33-43 = fan, 49-54 = spread
         # normalize value (0.0 - 1.0) to 0 - 11 range
         # values below 0 mean disabled
         if value >= 0.0:
-            self.outport.send(Message('control_change', channel = self.MC_CHANNEL, 
-                                  control = self.MIDI_RING[ring], 
-                                  value = 33 + round(value * 11)))
-        else:
-            self.outport.send(Message('control_change', channel = self.MC_CHANNEL, 
-                                  control = self.MIDI_RING[ring], 
-                                  value = 0))
+            return 33 + round(value * 11)
+        return 0
+
+    def set_ring(self, ring, value):
+        self.send_control(self.MIDI_RING[ring], self.ring_value(value))
 
     def set_button(self, button, on):
         if on == True:
-            self.outport.send(Message('note_on', channel = self.MC_CHANNEL, note = self.MIDI_BUTTONS[button], velocity = self.LED_ON))
+            self.send_note(self.MIDI_BUTTONS[button], self.LED_ON)
+        else:
+            self.send_note(self.MIDI_BUTTONS[button], self.LED_OFF)
+
+    def send_control(self, control, value):
+        # only send values the surface is not already showing
+        if self.shadow_cc[control] != value:
+            self.shadow_cc[control] = value
+            if stats.enabled:
+                stats.end('led')
+            row = self.cc_out[control]
+            msg = row[value] if row != None else None
+            if msg is None:
+                msg = self.build_message(self.cc_out, self.STATUS_CONTROL, control, value)
+            self.send(msg)
+
+    def send_note(self, note, velocity):
+        if self.shadow_note[note] != velocity:
+            self.shadow_note[note] = velocity
+            if stats.enabled:
+                stats.end('led')
+            row = self.note_out[note]
+            msg = row[velocity] if row != None else None
+            if msg is None:
+                msg = self.build_message(self.note_out, self.STATUS_NOTE_ON, note, velocity)
+            self.send(msg)
+
+    def build_message(self, table, status, number, value):
+        """
+        Build the message setting a control or note to value and keep it
+        in table for the next time, as byte tuple for raw backends and
+        as mido message otherwise. Ports do not change sent messages.
+        """
+        row = table[number]
+        if row == None:
+            row = table[number] = [None] * 128
+        if self.raw:
+            msg = (status | self.MC_CHANNEL, number, value)
         else:
-            self.outport.send(Message('note_on', channel = self.MC_CHANNEL, note = self.MIDI_BUTTONS[button], velocity = self.LED_OFF))
+            msg = Message.from_bytes([status | self.MC_CHANNEL, number, value])
+        row[value] = msg
+        return msg
+
+    def send(self, msg):
+        outport = self.outport
+        if outport == None:
+            # disconnected, the surface is repainted when it returns
+            return
+        if self.recorder != None:
+            self.recorder.record(MIDI_OUT, self.source, bytes(msg) if self.raw else bytes(msg.bytes()))
+        try:
+            outport.send(msg)
+        except Exception:
+            # let the port check notice the removal right away
+            self.port_failed = True
 
     def tempo_led(self, on):
-        self.set_button(9, on)
+        for note in self.layers[self.active_layer].leds_for('tap_tempo', None):
+            self.send_note(note, self.LED_ON if on else self.LED_OFF)
     
-    def update_tempo(self, tempo, detected = False):
+    def update_tempo(self, tempo, detected = False, anchor = None):
         if detected == True:
-            self.state.update_tempo(tempo)
+            self.state.update_tempo(tempo, anchor)
         else:
-            self.tempo_detector.current_tempo = tempo
+            self.tempo_detector.set_tempo(tempo, anchor)
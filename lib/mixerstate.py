@@ -1,5 +1,11 @@
-import time
-import subprocess
+from .sync import StateSync
+from .commandqueue import CommandQueue, PRIORITY_MIDI, PRIORITY_OSC
+from .statecache import StateCache
+from .snapshot import SnapshotManager
+from .stats import stats, timeline
+from .layout import load_layout
+from .meters import meter_index
+from .paramstore import ParameterStore, xair_parameters, FLOAT, INT, NUM_SENDS
 
 """
 This module holds the mixer state of the X-Air device
@@ -7,100 +13,147 @@ This module holds the mixer state of the X-Air device
 
 class Channel:
     """ 
-    Represents a single channel strip 
+    Represents a single channel strip, a view on its parameters in the store
     """
-    def __init__(self, addr):
-        self.fader = 0.0
+    __slots__ = ('store', 'osc_base_addr', 'fader_addr', 'on_addr', 'send_addrs', 'sends', 'fader_id', 'on_id')
+
+    def __init__(self, store, addr):
+        self.store = store
+        self.osc_base_addr = addr
+        self.fader_addr = addr + '/fader'
+        self.on_addr = addr + '/on'
+        self.fader_id = store.ids[self.fader_addr]
+        self.on_id = store.ids[self.on_addr] - store.num_floats
         if addr.startswith('/ch') or addr.startswith('/rtn'):
-            self.sends = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+            self.send_addrs = [addr + '/{:0>2d}/level'.format(bus + 1) for bus in range(0, NUM_SENDS)]
+            self.sends = store.view(self.send_addrs)
         else:
+            self.send_addrs = None
             self.sends = None
-        self.on = 1
+
+    @property
+    def fader(self):
+        return self.store.floats[self.fader_id]
+
+    @fader.setter
+    def fader(self, value):
+        self.store.floats[self.fader_id] = value
+
+    @property
+    def on(self):
+        return self.store.ints[self.on_id]
+
+    @on.setter
+    def on(self, value):
+        self.store.ints[self.on_id] = int(value)
+
+class MuteGroup:
+    """
+    Represents a mute group, a view on its switch in the store
+    """
+    __slots__ = ('store', 'osc_base_addr', 'on_id')
+
+    def __init__(self, store, addr):
+        self.store = store
         self.osc_base_addr = addr
-        
+        self.on_id = store.ids[addr] - store.num_floats
+
+    @property
+    def on(self):
+        return self.store.ints[self.on_id]
+
+    @on.setter
+    def on(self, value):
+        self.store.ints[self.on_id] = int(value)
 
 class MixerState:
     """
-    This stores the mixer state in the application. It also keeps
-    track of the current selected fader bank on the midi controller to
-    decide whether state changes from the X-Air device need to be
-    sent to the midi controller.
+    This stores the mixer state in the application. State changes are
+    shown on all midi controllers attached to this mixer which have
+    the changed fader bank selected.
     """
     
     # ID numbers for all available delay effects
     _DELAY_FX_IDS = [10, 11, 12, 21, 24, 25, 26]
-    
-    fx_slots = [0, 0, 0, 0]
-    
-    active_bank = -1
- 
-    # Each layer has 8 encoders and 8 buttons
-    banks = [
-        [
-            Channel('/ch/01/mix'),
-            Channel('/ch/02/mix'),
-            Channel('/ch/03/mix'),
-            Channel('/ch/04/mix'),
-            Channel('/ch/05/mix'),
-            Channel('/ch/06/mix'),
-            Channel('/ch/07/mix'),
-            Channel('/ch/08/mix')
-        ],
-        [
-            Channel('/ch/09/mix'),
-            Channel('/ch/10/mix'),
-            Channel('/ch/11/mix'),
-            Channel('/ch/12/mix'),
-            Channel('/ch/13/mix'),
-            Channel('/ch/14/mix'),
-            Channel('/ch/15/mix'),
-            Channel('/ch/16/mix')
-        ],
-        [
-            Channel('/rtn/aux/mix'),
-            None,
-            None,
-            None,
-            Channel('/dca/1'),
-            Channel('/dca/2'),
-            Channel('/dca/3'),
-            Channel('/dca/4')
-        ],
-        [
-            Channel('/fxsend/1/mix'),
-            Channel('/fxsend/2/mix'),
-            Channel('/fxsend/3/mix'),
-            Channel('/fxsend/4/mix'), 
-            Channel('/rtn/1/mix'),
-            Channel('/rtn/2/mix'),
-            Channel('/rtn/3/mix'),
-            Channel('/rtn/4/mix')
-        ],
-        [
-            Channel('/bus/1/mix'),
-            Channel('/bus/2/mix'),
-            Channel('/bus/3/mix'),
-            Channel('/bus/4/mix'), 
-            Channel('/bus/5/mix'),
-            Channel('/bus/6/mix'),
-            None,
-            None
-        ]
-    ]
-
-    lr = Channel('/lr/mix')
-
-    mute_groups = [
-        Channel('/config/mute/1'),
-        Channel('/config/mute/2'),
-        Channel('/config/mute/3'),
-        Channel('/config/mute/4')
-    ]
-
-    mpd_playing = True
-    
-    midi_controller = None
-    xair_client = None
+
+    # Parameter kinds used as first element of an osc_index target
+    PARAM_FADER = 0
+    PARAM_ON = 1
+    PARAM_LEVEL = 2
+    PARAM_MUTE_GRP = 3
+    PARAM_FX_TYPE = 4
+    PARAM_FX_TIME = 5
+
+    def __init__(self, layout = None):
+        if layout == None:
+            layout = load_layout()
+        self.layout = layout
+        self.controllers = []
+        self.xair_client = None
+        self.cache = None
+        self.store = ParameterStore(xair_parameters() + self.layout_parameters(layout))
+        # channels are on and mute groups engaged until the mixer tells otherwise
+        for address in self.store.int_addrs:
+            if address.endswith('/on') or address.startswith('/config/mute/'):
+                self.store.set(address, 1)
+        # Each bank has 8 encoders and 8 buttons
+        self.banks = [[Channel(self.store, addr) if addr != None else None for addr in bank] for bank in layout.banks]
+        # position of each channel in the /meters/1 levels, None for channels without meter
+        self.meter_slots = [[meter_index(addr) for addr in bank] for bank in layout.banks]
+        self.lr = Channel(self.store, '/lr/mix')
+        self.mute_groups = [MuteGroup(self.store, '/config/mute/%d' % (i + 1)) for i in range(0, 4)]
+        self.fx_slots = self.store.view(['/fx/%d/type' % (i + 1) for i in range(0, 4)])
+        self.mpd_playing = True
+        self.snapshots = SnapshotManager(self)
+        # all changes from MIDI input and OSC feedback are executed by this queue
+        self.commands = CommandQueue()
+        # time parameter addresses of each fx slot, parameter 02 is only used by fx 10
+        self.fx_time_addrs = [('/fx/%d/par/01' % (i + 1), '/fx/%d/par/02' % (i + 1)) for i in range(0, len(self.fx_slots))]
+        self.osc_index = self.build_osc_index()
+
+    def layout_parameters(self, layout):
+        # parameters of channels in custom layouts which are not part of the X-Air tree
+        params = []
+        for bank in layout.banks:
+            for addr in bank:
+                if addr != None:
+                    params += [(addr + '/fader', FLOAT), (addr + '/on', INT)]
+                    if addr.startswith('/ch') or addr.startswith('/rtn'):
+                        params += [(addr + '/{:0>2d}/level'.format(bus + 1), FLOAT) for bus in range(0, NUM_SENDS)]
+        return params
+
+    def add_controller(self, controller):
+        self.controllers.append(controller)
+
+    def build_osc_index(self):
+        """
+        Map every OSC address we track to a (param, bank, slot, bus) target,
+        so inbound messages are resolved with a single dict lookup.
+        Bank is None for channels not part of a fader bank (main LR).
+        """
+        index = {}
+        for i in range(0, len(self.banks)):
+            for j in range(0, len(self.banks[i])):
+                self._index_channel(index, self.banks[i][j], i, j)
+        # main LR may also be part of a bank, which then shows its changes
+        if self.lr.fader_addr not in index:
+            self._index_channel(index, self.lr, None, None)
+        for i in range(0, len(self.mute_groups)):
+            index[self.mute_groups[i].osc_base_addr] = (self.PARAM_MUTE_GRP, None, i, None)
+        for i in range(0, len(self.fx_slots)):
+            index['/fx/%d/type' % (i + 1)] = (self.PARAM_FX_TYPE, None, i, None)
+            for addr in self.fx_time_addrs[i]:
+                index[addr] = (self.PARAM_FX_TIME, None, i, None)
+        return index
+
+    def _index_channel(self, index, channel, bank, slot):
+        if channel == None:
+            return
+        index[channel.fader_addr] = (self.PARAM_FADER, bank, slot, None)
+        index[channel.on_addr] = (self.PARAM_ON, bank, slot, None)
+        if channel.send_addrs != None:
+            for bus in range(0, len(channel.send_addrs)):
+                index[channel.send_addrs[bus]] = (self.PARAM_LEVEL, bank, slot, bus)
 
     def toggle_mute_group(self, group):
         if self.mute_groups[group].on == 1:
@@ -109,19 +162,21 @@ class MixerState:
             self.mute_groups[group].on = 1
         self.xair_client.send(address = self.mute_groups[group].osc_base_addr, 
                     param = self.mute_groups[group].on)
-        self.midi_controller.set_mute_grp(group, self.mute_groups[group].on)
+        self.show_mute_grp(group, self.mute_groups[group].on)
 
-    def toggle_channel_mute(self, channel):
-        if self.banks[self.active_bank][channel] != None:
-            if self.banks[self.active_bank][channel].on == 1:
-                self.banks[self.active_bank][channel].on = 0
+    def toggle_channel_mute(self, bank, channel):
+        if self.banks[bank][channel] != None:
+            if self.banks[bank][channel].on == 1:
+                self.banks[bank][channel].on = 0
             else:
-                self.banks[self.active_bank][channel].on = 1
-            self.xair_client.send(address = self.banks[self.active_bank][channel].osc_base_addr + '/on', 
-                            param = self.banks[self.active_bank][channel].on)
-            self.midi_controller.set_channel_mute(channel, self.banks[self.active_bank][channel].on)
+                self.banks[bank][channel].on = 1
+            self.xair_client.send(address = self.banks[bank][channel].on_addr, 
+                            param = self.banks[bank][channel].on)
+            self.show_channel_mute(bank, channel, self.banks[bank][channel].on)
     
     def toggle_mpc(self):
+        # only needed for this action, keep it out of the startup time
+        import subprocess
         if self.mpd_playing:
             try:
                 subprocess.call(['mpc', 'pause'])
@@ -135,91 +190,129 @@ class MixerState:
                 pass
             self.mpd_playing = True
 
-    def change_fader(self, fader, delta):
-        if self.banks[self.active_bank][fader] != None:
-            self.banks[self.active_bank][fader].fader = min(max(0.0, self.banks[self.active_bank][fader].fader + (delta / 200)), 1.0)
-            self.xair_client.send(address = self.banks[self.active_bank][fader].osc_base_addr + '/fader', 
-                            param = self.banks[self.active_bank][fader].fader)
-            self.midi_controller.set_channel_fader(fader, self.banks[self.active_bank][fader].fader)
+    def change_fader(self, bank, fader, delta):
+        if self.banks[bank][fader] != None:
+            self.banks[bank][fader].fader = min(max(0.0, self.banks[bank][fader].fader + (delta / 200)), 1.0)
+            self.xair_client.send(address = self.banks[bank][fader].fader_addr, 
+                            param = self.banks[bank][fader].fader, coalesce = True)
+            self.show_channel_fader(bank, fader, self.banks[bank][fader].fader)
 
-    def change_bus_send(self, bus, channel, delta):
-        if self.banks[self.active_bank][channel] != None and self.banks[self.active_bank][channel].sends != None:
-            self.banks[self.active_bank][channel].sends[bus] = min(max(0.0, self.banks[self.active_bank][channel].sends[bus] + (delta / 200)), 1.0)
-            self.xair_client.send(address = self.banks[self.active_bank][channel].osc_base_addr + '/{:0>2d}/level'.format(bus + 1),
-                            param = self.banks[self.active_bank][channel].sends[bus])
-            self.midi_controller.set_bus_send(bus, channel, self.banks[self.active_bank][channel].sends[bus])
+    def change_bus_send(self, bank, bus, channel, delta):
+        if self.banks[bank][channel] != None and self.banks[bank][channel].sends != None:
+            self.banks[bank][channel].sends[bus] = min(max(0.0, self.banks[bank][channel].sends[bus] + (delta / 200)), 1.0)
+            self.xair_client.send(address = self.banks[bank][channel].send_addrs[bus],
+                            param = self.banks[bank][channel].sends[bus], coalesce = True)
+            self.show_bus_send(bank, bus, channel, self.banks[bank][channel].sends[bus])
 
     def set_lr_fader(self, value):
-        self.xair_client.send(address = self.lr.osc_base_addr + '/fader', param = value)
+        self.xair_client.send(address = self.lr.fader_addr, param = value, coalesce = True)
 
     def received_osc(self, addr, value):
-        if addr.startswith('/config/mute'):
-            group = int(addr[-1:]) - 1
-            self.mute_groups[group].on = value
-            self.midi_controller.set_mute_grp(group, value)
-        elif addr.startswith('/fx') and (addr.endswith('/par/01') or addr.endswith('/par/02')):
-            if self.fx_slots[int(addr[4:5]) - 1] in self._DELAY_FX_IDS:
-                self.midi_controller.update_tempo(value * 3)
-        elif addr.startswith('/fx/') and addr.endswith('/type'):
-            self.fx_slots[int(addr[4:5]) - 1] = value
+        param_id = self.store.ids.get(addr)
+        if param_id != None:
+            self.store.reported[param_id] = 1
+        target = self.osc_index.get(addr)
+        if target == None:
+            # keep track of all other mixer parameters
+            if not self.store.set(addr, value) and stats.enabled:
+                stats.count('ignored osc')
+            return
+        param, bank, slot, bus = target
+        if param == self.PARAM_MUTE_GRP:
+            self.mute_groups[slot].on = value
+            self.show_mute_grp(slot, value)
+        elif param == self.PARAM_FX_TIME:
+            self.store.set(addr, value)
+            if self.fx_slots[slot] in self._DELAY_FX_IDS:
+                for controller in self.controllers:
+                    controller.update_tempo(value * 3)
+        elif param == self.PARAM_FX_TYPE:
+            self.fx_slots[slot] = int(value)
             if value in self._DELAY_FX_IDS:
                 # slot contains a delay, get current time value
-                param_id = '01'
-                if value == 10:
-                    param_id = '02'
-                self.xair_client.send(address = '/fx/%s/par/%s' % (addr[4:5], param_id))
+                self.xair_client.send(address = self.delay_time_addr(slot))
+        elif bank == None:
+            # main LR has no encoder, just keep track of its state
+            if param == self.PARAM_FADER:
+                self.lr.fader = value
+            elif param == self.PARAM_ON:
+                self.lr.on = value
+        else:
+            channel = self.banks[bank][slot]
+            if param == self.PARAM_FADER:
+                channel.fader = value
+                self.show_channel_fader(bank, slot, value)
+            elif param == self.PARAM_ON:
+                channel.on = value
+                self.show_channel_mute(bank, slot, value)
+            else:
+                channel.sends[bus] = value
+                self.show_bus_send(bank, bus, slot, value)
+
+    # Show a change on every controller with the bank selected
+
+    def show_mute_grp(self, group, on):
+        for controller in self.controllers:
+            controller.set_mute_grp(group, on)
+
+    def show_channel_fader(self, bank, slot, value):
+        for controller in self.controllers:
+            if controller.active_bank == bank:
+                controller.set_channel_fader(slot, value)
+
+    def show_channel_mute(self, bank, slot, on):
+        for controller in self.controllers:
+            if controller.active_bank == bank:
+                controller.set_channel_mute(slot, on)
+
+    def show_bus_send(self, bank, bus, slot, value):
+        for controller in self.controllers:
+            if controller.active_bank == bank:
+                controller.set_bus_send(bus, slot, value)
+
+    def show_meters(self, levels):
+        for controller in self.controllers:
+            if controller.meter_mode:
+                controller.set_meters(levels)
+
+    def update_meter_stream(self):
+        # stream meters only while a controller shows them
+        if self.xair_client == None:
+            return
+        if any(controller.meter_mode for controller in self.controllers):
+            self.xair_client.meters.start()
         else:
-            for i in range(0, 5):
-                for j in range(0, 8):
-                    if self.banks[i][j] != None and addr.startswith(self.banks[i][j].osc_base_addr):
-                        if addr.endswith('/fader'):
-                            self.banks[i][j].fader = value
-                            if i == self.active_bank:
-                                self.midi_controller.set_ring(j, value)
-                        elif addr.endswith('/on'):
-                            self.banks[i][j].on = value
-                            if i == self.active_bank:
-                                self.midi_controller.set_channel_mute(j, value)
-                        elif self.banks[i][j].sends != None and addr.endswith('/level'):
-                            bus = int(addr[-8:-6]) - 1
-                            self.banks[i][j].sends[bus] = value
-                            if i == self.active_bank:
-                                self.midi_controller.set_bus_send(bus, j, value)
-                        break
-                else:
-                    continue
-                break
+            self.xair_client.meters.stop()
     
+    def load_cache(self, info):
+        """
+        Show the cached state of this mixer until the live state is loaded
+        and keep the cache up to date in the background
+        """
+        # the /xinfo reply holds ip, name, model and firmware
+        self.cache = StateCache(self.store, '%s-%s' % (info[2], info[1]))
+        if self.cache.load():
+            print('Showing cached mixer state until the current state is loaded')
+            for controller in self.controllers:
+                self.commands.submit(PRIORITY_MIDI, controller.refresh_controls, controller.active_bank)
+            self.commands.submit(PRIORITY_MIDI, timeline.mark, 'cached state shown')
+        self.cache.start()
+
     def read_initial_state(self):
-        # Refresh state for all faders and mutes
-        for i in range(0, 5):
-            for j in range(0, 8):
-                if self.banks[i][j] != None:
-                    self.xair_client.send(address = self.banks[i][j].osc_base_addr + '/fader')
-                    time.sleep(0.01)
-                    self.xair_client.send(address = self.banks[i][j].osc_base_addr + '/on')
-                    time.sleep(0.01)
-                    if self.banks[i][j].sends != None:
-                        for k in range(len(self.banks[i][j].sends)):
-                            self.xair_client.send(address = self.banks[i][j].osc_base_addr + '/{:0>2d}/level'.format(k + 1))
-                            time.sleep(0.01)
-           
-        # get all mute groups
-        for i in range(0, 4):
-            self.xair_client.send(address = self.mute_groups[i].osc_base_addr)
-            time.sleep(0.01)
-        
-        # get all fx types
-        for i in range(1, 5):
-            self.xair_client.send(address = '/fx/%d/type' % i)
-            time.sleep(0.01)
+        # Query all faders, mutes, sends, mute groups and fx types
+        complete = StateSync(self.xair_client, self).run()
+        self.commands.submit(PRIORITY_OSC, timeline.mark, 'mixer state synced')
+        return complete
     
-    def update_tempo(self, tempo):
-        for i in range(0, 4):
-            if self.fx_slots[i] in self._DELAY_FX_IDS:
-                param_id = '01'
-                if self.fx_slots[i] == 10:
-                    # only delay where time is set as parameter 02
-                    param_id = '02'
-                self.xair_client.send(address = '/fx/%d/par/%s' % (i + 1, param_id), param = tempo / 3)
-        
\ No newline at end of file
+    def delay_time_addr(self, slot):
+        if self.fx_slots[slot] == 10:
+            # only delay where time is set as parameter 02
+            return self.fx_time_addrs[slot][1]
+        return self.fx_time_addrs[slot][0]
+
+    def update_tempo(self, tempo, anchor = None):
+        for controller in self.controllers:
+            controller.update_tempo(tempo, anchor = anchor)
+        # all delays change at once
+        self.xair_client.send_batch([(self.delay_time_addr(i), tempo / 3) for i in range(0, 4)
+                                     if self.fx_slots[i] in self._DELAY_FX_IDS])
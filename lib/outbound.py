@@ -0,0 +1,171 @@
+import time
+import threading
+from collections import deque
+
+"""
+This module limits the outbound OSC traffic to the mixer
+"""
+
+class SendScheduler:
+    """
+    Sits between XAirClient and the OSC socket. Continuous values like
+    faders and send levels are coalesced per address: the first change
+    is sent right away, further changes within the send window only keep
+    the latest value which is sent when the window ends. Discrete values
+    like mutes are always sent immediately. All packets share a packets
+    per second budget.
+    """
+    def __init__(self, send_message, window = 0.02, rate = 500):
+        self.send_message = send_message
+        self.window = window
+        self.rate = rate
+        self.tokens = float(rate)
+        self.last_refill = time.monotonic()
+        self.last_sent = {}
+        self.pending = {}
+        self.lock = threading.Condition()
+        # called with the due time of a newly pending value when no worker thread is used
+        self.wakeup = None
+        # (send, data) of datagrams waiting for the budget when no worker thread is used
+        self.datagrams = deque()
+        # counters
+        self.requested = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.throttled = 0
+
+    def start(self):
+        worker = threading.Thread(target = self.run)
+        worker.daemon = True
+        worker.start()
+
+    def send(self, address, value, coalesce = False):
+        with self.lock:
+            self.requested += 1
+            now = time.monotonic()
+            waiting = None
+            if not coalesce:
+                # a discrete value supersedes anything still waiting for this address
+                pending = self.pending.pop(address, None)
+                if pending != None and value != None:
+                    self.coalesced += 1
+                elif pending != None:
+                    # a query must not drop it, send the waiting value first so the reply reports it
+                    waiting = pending[0]
+                    self.take_token(now, True)
+                    self.sent += 1
+                self.take_token(now, True)
+            elif address in self.pending:
+                self.pending[address][0] = value
+                self.coalesced += 1
+                return
+            elif (now - self.last_sent.get(address, 0.0) < self.window or len(self.datagrams) > 0
+                  or not self.take_token(now, False)):
+                # values wait behind queued datagrams, which may hold older values
+                due = max(now, self.last_sent.get(address, 0.0) + self.window)
+                self.pending[address] = [value, due]
+                self.lock.notify()
+                if self.wakeup != None:
+                    self.wakeup(due)
+                return
+            self.last_sent[address] = now
+            self.sent += 1
+        if waiting != None:
+            self.send_message(address, waiting)
+        self.send_message(address, value)
+
+    def send_datagram(self, send, data, messages = ()):
+        """
+        Send a prepared datagram holding the given (address, value)
+        messages within the packet budget. Blocks until the budget allows
+        another packet, or queues the datagram for flush() when the
+        scheduler runs on an event loop.
+        """
+        waiting = []
+        queued = False
+        with self.lock:
+            if self.wakeup != None:
+                queued = len(self.datagrams) > 0 or not self.take_token(time.monotonic(), False)
+                if queued:
+                    self.datagrams.append((send, data))
+            else:
+                while not self.take_token(time.monotonic(), False):
+                    self.lock.wait(1.0 / self.rate)
+            # like discrete values, the datagram supersedes values still waiting,
+            # queries go after them like in send()
+            for address, value in messages:
+                pending = self.pending.pop(address, None)
+                if pending != None and value != None:
+                    self.coalesced += 1
+                elif pending != None:
+                    waiting.append((address, pending[0]))
+                    self.take_token(time.monotonic(), True)
+                    self.sent += 1
+            self.requested += max(1, len(messages))
+            if not queued:
+                self.sent += 1
+        for address, value in waiting:
+            self.send_message(address, value)
+        if queued:
+            self.wakeup(time.monotonic() + 1.0 / self.rate)
+        else:
+            send(data)
+
+    def take_token(self, now, force):
+        self.tokens = min(float(self.rate), self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        if self.tokens >= 1.0 or force:
+            # forced sends may drive the budget negative, delaying coalesced values
+            self.tokens -= 1.0
+            return True
+        self.throttled += 1
+        return False
+
+    def flush(self, now):
+        """
+        Send the queued datagrams and all pending values which are due
+        and allowed by the budget. Returns the time of the next due value
+        or None if nothing is pending.
+        """
+        datagrams = []
+        ready = []
+        next_due = None
+        with self.lock:
+            while len(self.datagrams) > 0 and self.take_token(now, False):
+                datagrams.append(self.datagrams.popleft())
+                self.sent += 1
+            if len(self.datagrams) > 0:
+                # out of budget, pending values go after the queued datagrams
+                next_due = now + 1.0 / self.rate
+            else:
+                for address, (value, due) in list(self.pending.items()):
+                    if due <= now and self.take_token(now, False):
+                        del self.pending[address]
+                        self.last_sent[address] = now
+                        self.sent += 1
+                        ready.append((address, value))
+                    else:
+                        if due <= now:
+                            # out of budget, retry once a token is available
+                            due = now + 1.0 / self.rate
+                        if next_due == None or due < next_due:
+                            next_due = due
+        for send, data in datagrams:
+            send(data)
+        for address, value in ready:
+            self.send_message(address, value)
+        return next_due
+
+    def run(self):
+        while True:
+            with self.lock:
+                while len(self.pending) == 0:
+                    self.lock.wait()
+            next_due = self.flush(time.monotonic())
+            if next_due != None:
+                with self.lock:
+                    self.lock.wait(max(0.0, next_due - time.monotonic()))
+
+    def summary(self):
+        return 'OSC sends: %d requested, %d sent, %d coalesced, %d throttled' % (self.requested,
+                self.sent, self.coalesced, self.throttled)
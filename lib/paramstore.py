@@ -0,0 +1,230 @@
+import struct
+import zlib
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+"""
+This module stores the parameters of the X-Air mixer in two typed
+contiguous arrays, one for float and one for int parameters. Every
+parameter address maps to a precomputed ID: IDs below the number of
+float parameters index the float array, the remaining IDs the int array.
+The set of parameters is fixed when the store is created, so its memory
+use is bounded and known up front.
+"""
+
+FLOAT = 'f'
+INT = 'i'
+
+NUM_SENDS = 10
+
+def strip_parameters(root, mix, sends = False, eq_bands = 0, dynamics = False, gate = False, preamp = False):
+    """
+    Parameters of one channel strip. Send levels are listed consecutively
+    so they occupy a contiguous range of the float array.
+    """
+    params = [(mix + '/fader', FLOAT), (mix + '/on', INT), (mix + '/pan', FLOAT)]
+    if sends:
+        params += [(mix + '/%02d/level' % (i + 1), FLOAT) for i in range(0, NUM_SENDS)]
+    if preamp:
+        params += [(root + '/preamp/hpon', INT), (root + '/preamp/hpf', FLOAT), (root + '/preamp/invert', INT)]
+    if eq_bands > 0:
+        params.append((root + '/eq/on', INT))
+        for band in range(1, eq_bands + 1):
+            params += [(root + '/eq/%d/type' % band, INT), (root + '/eq/%d/f' % band, FLOAT),
+                       (root + '/eq/%d/g' % band, FLOAT), (root + '/eq/%d/q' % band, FLOAT)]
+    if gate:
+        params += [(root + '/gate/on', INT), (root + '/gate/mode', INT)]
+        params += [(root + '/gate/' + name, FLOAT) for name in ('thr', 'range', 'attack', 'hold', 'release')]
+    if dynamics:
+        params += [(root + '/dyn/' + name, INT) for name in ('on', 'mode', 'det', 'env', 'ratio', 'auto')]
+        params += [(root + '/dyn/' + name, FLOAT) for name in ('thr', 'knee', 'mgain', 'attack', 'hold', 'release', 'mix')]
+    return params
+
+def xair_parameters():
+    """
+    The parameter tree of an XR18 as list of (address, type)
+    """
+    params = []
+    for ch in range(1, 17):
+        root = '/ch/%02d' % ch
+        params += strip_parameters(root, root + '/mix', sends = True, eq_bands = 4, dynamics = True,
+                                   gate = True, preamp = True)
+        params += [(root + '/grp/dca', INT), (root + '/grp/mute', INT)]
+    params += strip_parameters('/rtn/aux', '/rtn/aux/mix', sends = True, eq_bands = 4)
+    for rtn in range(1, 5):
+        params += strip_parameters('/rtn/%d' % rtn, '/rtn/%d/mix' % rtn, sends = True, eq_bands = 4)
+    for fxsend in range(1, 5):
+        params += strip_parameters('/fxsend/%d' % fxsend, '/fxsend/%d/mix' % fxsend, eq_bands = 6)
+    for bus in range(1, 7):
+        params += strip_parameters('/bus/%d' % bus, '/bus/%d/mix' % bus, eq_bands = 6, dynamics = True)
+    params += strip_parameters('/lr', '/lr/mix', eq_bands = 6, dynamics = True)
+    for dca in range(1, 5):
+        params += [('/dca/%d/fader' % dca, FLOAT), ('/dca/%d/on' % dca, INT)]
+    params += [('/config/mute/%d' % group, INT) for group in range(1, 5)]
+    params += [('/headamp/%02d/gain' % ch, FLOAT) for ch in range(1, 17)]
+    params += [('/headamp/%02d/phantom' % ch, INT) for ch in range(1, 17)]
+    # fx types are consecutive so MixerState can view them as one slice
+    params += [('/fx/%d/type' % fx, INT) for fx in range(1, 5)]
+    for fx in range(1, 5):
+        params += [('/fx/%d/par/%02d' % (fx, par), FLOAT) for par in range(1, 65)]
+    return params
+
+class ParameterStore:
+    """
+    Array backed storage of all mixer parameters
+    """
+    _MAGIC = b'XAPS'
+    _HEADER = struct.Struct('<4sIII')
+    # number of values compared at once when diffing
+    _CHUNK = 64
+
+    def __init__(self, parameters):
+        self.float_addrs = []
+        self.int_addrs = []
+        seen = set()
+        for address, kind in parameters:
+            if address in seen:
+                continue
+            seen.add(address)
+            if kind == FLOAT:
+                self.float_addrs.append(address)
+            else:
+                self.int_addrs.append(address)
+        self.num_floats = len(self.float_addrs)
+        self.floats = array('f', [0.0] * self.num_floats)
+        self.ints = array('i', [0] * len(self.int_addrs))
+        self.addresses = self.float_addrs + self.int_addrs
+        self.ids = {}
+        for param_id in range(0, len(self.addresses)):
+            self.ids[self.addresses[param_id]] = param_id
+        # 1 for every parameter whose value was reported by the mixer, the
+        # others hold defaults or cached values
+        self.reported = bytearray(len(self.addresses))
+        # identifies the parameter set in serialized data
+        self.signature = zlib.crc32('\n'.join(self.addresses).encode())
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __contains__(self, address):
+        return address in self.ids
+
+    def get(self, address):
+        param_id = self.ids[address]
+        if param_id < self.num_floats:
+            return self.floats[param_id]
+        return self.ints[param_id - self.num_floats]
+
+    def has_value(self, address):
+        """
+        True if the mixer reported the value of the parameter
+        """
+        param_id = self.ids.get(address)
+        return param_id != None and self.reported[param_id] == 1
+
+    def set(self, address, value):
+        """
+        Store a value, returns False if the address is not part of the store
+        """
+        param_id = self.ids.get(address)
+        if param_id == None:
+            return False
+        if param_id < self.num_floats:
+            self.floats[param_id] = value
+        else:
+            self.ints[param_id - self.num_floats] = int(value)
+        return True
+
+    def view(self, addresses):
+        """
+        Writable view on parameters which are stored consecutively
+        """
+        first = self.ids[addresses[0]]
+        for i in range(1, len(addresses)):
+            if self.ids[addresses[i]] != first + i:
+                raise ValueError('parameters at %s are not consecutive' % addresses[0])
+        last = first + len(addresses) - 1
+        if first < self.num_floats and last < self.num_floats:
+            return memoryview(self.floats)[first:last + 1]
+        elif first >= self.num_floats:
+            return memoryview(self.ints)[first - self.num_floats:last - self.num_floats + 1]
+        raise ValueError('parameters at %s have different types' % addresses[0])
+
+    def snapshot(self):
+        """
+        Copy of all values, to be passed to diff or restore later
+        """
+        return (array('f', self.floats), array('i', self.ints))
+
+    def restore(self, snapshot):
+        self.floats[:] = snapshot[0]
+        self.ints[:] = snapshot[1]
+
+    def diff(self, snapshot):
+        """
+        Returns the IDs of all parameters whose value differs from the snapshot
+        """
+        return (self.diff_array(self.floats, snapshot[0], 0) +
+                self.diff_array(self.ints, snapshot[1], self.num_floats))
+
+    def diff_array(self, values, other, offset):
+        if numpy != None:
+            changed = numpy.nonzero(numpy.frombuffer(values, values.typecode) !=
+                                    numpy.frombuffer(other, other.typecode))[0]
+            return [int(index) + offset for index in changed]
+        # compare raw bytes chunk by chunk and only look at values in differing chunks
+        current = memoryview(values).cast('B')
+        previous = memoryview(other).cast('B')
+        size = values.itemsize * self._CHUNK
+        changed = []
+        for start in range(0, len(current), size):
+            if current[start:start + size] != previous[start:start + size]:
+                first = start // values.itemsize
+                for index in range(first, min(first + self._CHUNK, len(values))):
+                    if values[index] != other[index]:
+                        changed.append(index + offset)
+        return changed
+
+    def items(self, param_ids):
+        """
+        (address, value) pairs for a list of IDs
+        """
+        result = []
+        for param_id in param_ids:
+            if param_id < self.num_floats:
+                result.append((self.addresses[param_id], self.floats[param_id]))
+            else:
+                result.append((self.addresses[param_id], self.ints[param_id - self.num_floats]))
+        return result
+
+    def serialize(self, snapshot = None):
+        """
+        Binary representation of the current values or of a snapshot
+        """
+        floats, ints = snapshot if snapshot != None else (self.floats, self.ints)
+        return (self._HEADER.pack(self._MAGIC, self.signature, len(floats), len(ints)) +
+                floats.tobytes() + ints.tobytes())
+
+    def deserialize(self, data):
+        """
+        Load values from serialize() output. Raises ValueError if the data
+        was written for a different parameter set.
+        """
+        if len(data) < self._HEADER.size:
+            raise ValueError('truncated parameter data')
+        magic, signature, num_floats, num_ints = self._HEADER.unpack_from(data)
+        if magic != self._MAGIC or signature != self.signature:
+            raise ValueError('parameter data does not match this store')
+        start = self._HEADER.size
+        end = start + num_floats * self.floats.itemsize
+        if len(data) != end + num_ints * self.ints.itemsize:
+            raise ValueError('truncated parameter data')
+        floats = array('f')
+        floats.frombytes(data[start:end])
+        ints = array('i')
+        ints.frombytes(data[end:])
+        self.restore((floats, ints))
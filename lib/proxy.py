@@ -0,0 +1,220 @@
+import time
+import socket
+import threading
+from pythonosc.osc_packet import OscPacket, ParseError
+from .commandqueue import PRIORITY_OSC
+from .meters import METERS
+from .timers import timers
+from .stats import stats
+
+"""
+This module lets other OSC clients like X AIR Edit or a tablet use the
+mixer through this application. The mixer only serves a few /xremote
+subscribers, and every client polling the mixer adds to its load, so
+the proxy holds the only subscription and answers local clients from
+the mixer state:
+
+    /xinfo                      answered with the reply of the mixer
+    /xremote, /xremotenfb       subscribe to all changes for 10 s
+    parameter queries           answered from the mixer state if the mixer
+                                reported the value, else forwarded
+    parameter sets              applied to the mixer state, sent to all
+                                subscribers and to the mixer, faders
+                                are coalesced like the own changes
+    /meters /meters/1           /meters/1 is relayed for 10 s, the mixer
+                                subscription is renewed at most every 5 s
+    everything else             sent to the mixer, the reply goes back
+                                to the client which asked
+
+Changes reported by the mixer and the own changes of the application
+are sent to all subscribers, so the load of the mixer stays the same
+no matter how many clients connect.
+"""
+
+class OSCProxy:
+    """
+    Serves the mixer state of an XAirClient to local OSC clients on a UDP
+    port. Run it with start() on its own thread or feed handle_datagram()
+    from an event loop.
+    """
+    _SUBSCRIPTION_TIMEOUT = 10
+    _EXPIRE_INTERVAL = 1.0
+    _METER_RENEW_INTERVAL = 5.0
+    # forwarded queries the mixer never answered are forgotten after this
+    _QUERY_TIMEOUT = 2.0
+
+    def __init__(self, client, port = 10024, address = ''):
+        self.client = client
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((address, port))
+        self.address = self.socket.getsockname()
+        self.lock = threading.Lock()
+        # client address -> (expiry time, no feedback flag)
+        self.subscribers = {}
+        # client address -> expiry time of its /meters/1 subscription
+        self.meter_subscribers = {}
+        # snapshots of the subscribers for sending, replaced on every change
+        self.targets = ()
+        self.meter_targets = ()
+        # reply address -> list of (client address, expiry time) waiting for it
+        self.pending = {}
+        self.meters_renewed = 0.0
+        self.answered = 0
+        self.forwarded = 0
+        self.writes = 0
+        self.fanned = 0
+        self.timer = timers.add(time.monotonic() + self._EXPIRE_INTERVAL, self.expire)
+        client.proxy = self
+
+    def start(self):
+        worker = threading.Thread(target = self.run)
+        worker.daemon = True
+        worker.start()
+
+    def run(self):
+        while True:
+            try:
+                data, client = self.socket.recvfrom(65536)
+            except OSError:
+                break
+            self.handle_datagram(data, client)
+
+    def handle_datagram(self, data, client):
+        """
+        Handle one datagram of a local client, used by the proxy thread
+        and the asyncio runtime
+        """
+        try:
+            messages = OscPacket(data).messages
+        except ParseError:
+            if stats.enabled:
+                stats.count('invalid proxy osc')
+            return
+        for timed in messages:
+            self.handle(timed.message.address, timed.message.params, client)
+
+    def handle(self, address, params, client):
+        store = self.client.state.store
+        if address == '/xinfo':
+            if len(self.client.info_response) > 0:
+                self.reply(client, address, list(self.client.info_response))
+        elif address == '/xremote' or address == '/xremotenfb':
+            with self.lock:
+                self.subscribers[client] = (time.monotonic() + self._SUBSCRIPTION_TIMEOUT, address == '/xremotenfb')
+                self.targets = tuple(self.subscribers.items())
+        elif address == '/meters':
+            if len(params) > 0 and params[0] == METERS:
+                self.subscribe_meters(client)
+        elif len(params) == 0 and store.has_value(address):
+            self.answered += 1
+            self.reply(client, address, store.get(address))
+        elif len(params) == 1 and address in store:
+            self.write(address, params[0], client)
+        else:
+            self.forward(address, params, client)
+
+    def write(self, address, value, client):
+        self.writes += 1
+        state = self.client.state
+        state.commands.submit(PRIORITY_OSC, state.received_osc, address, value)
+        self.fan_out(address, value, client)
+        # the mixer does not echo changes to our /xremotenfb subscription, so
+        # XAirClient.send() would fan this out a second time
+        self.client.scheduler.send(address, value, isinstance(value, float))
+
+    def forward(self, address, params, client):
+        if len(params) == 0 or address == '/node':
+            # only queries get replies, /node replies start with the path asked for
+            key = address if address != '/node' else '/' + str(params[0]).split(' ')[0].strip('/')
+            with self.lock:
+                self.pending.setdefault(key, []).append((client, time.monotonic() + self._QUERY_TIMEOUT))
+        self.forwarded += 1
+        self.client.send(address, None if len(params) == 0 else list(params))
+
+    def subscribe_meters(self, client):
+        now = time.monotonic()
+        with self.lock:
+            self.meter_subscribers[client] = now + self._SUBSCRIPTION_TIMEOUT
+            self.meter_targets = tuple(self.meter_subscribers)
+            renew = now - self.meters_renewed >= self._METER_RENEW_INTERVAL
+            if renew:
+                self.meters_renewed = now
+        if renew:
+            self.client.send('/meters', METERS)
+
+    def upstream(self, address, data):
+        """
+        Called by XAirClient for every message of the mixer
+        """
+        if address == METERS:
+            targets = self.meter_targets
+            if len(targets) > 0:
+                self.send_all(targets, self.client.server.encode(address, data[0]))
+            return
+        key = address
+        if address == '/node' and len(data) > 0 and isinstance(data[0], str):
+            key = data[0].split(' ')[0]
+        if key in self.pending:
+            with self.lock:
+                waiting = self.pending.pop(key, ())
+            if len(waiting) > 0:
+                datagram = self.client.server.encode(address, list(data))
+                self.send_all(set(client for client, expiry in waiting), datagram)
+                return
+        if address == '/xinfo' or address == '/node' or len(data) == 0:
+            return
+        self.fan_out(address, data[0] if len(data) == 1 else list(data), None)
+
+    def fan_out(self, address, value, source):
+        """
+        Send a change to all subscribers, except a /xremotenfb subscriber
+        which made it
+        """
+        targets = self.targets
+        if len(targets) == 0:
+            return
+        data = self.client.server.encode(address, value)
+        self.send_all([client for client, (expiry, no_feedback) in targets
+                       if client != source or not no_feedback], data)
+
+    def send_all(self, clients, data):
+        for client in clients:
+            try:
+                self.socket.sendto(data, client)
+                self.fanned += 1
+            except OSError:
+                pass
+
+    def reply(self, client, address, value):
+        try:
+            self.socket.sendto(self.client.server.encode(address, value), client)
+        except OSError:
+            pass
+
+    def expire(self, due):
+        now = time.monotonic()
+        with self.lock:
+            for client, (expiry, no_feedback) in list(self.subscribers.items()):
+                if expiry < now:
+                    del self.subscribers[client]
+            for client, expiry in list(self.meter_subscribers.items()):
+                if expiry < now:
+                    del self.meter_subscribers[client]
+            for key, waiting in list(self.pending.items()):
+                waiting = [(client, expiry) for client, expiry in waiting if expiry >= now]
+                if len(waiting) > 0:
+                    self.pending[key] = waiting
+                else:
+                    del self.pending[key]
+            self.targets = tuple(self.subscribers.items())
+            self.meter_targets = tuple(self.meter_subscribers)
+        return due + self._EXPIRE_INTERVAL
+
+    def close(self):
+        timers.cancel(self.timer)
+        self.client.proxy = None
+        self.socket.close()
+
+    def summary(self):
+        return 'Proxy on port %d: %d subscribers, %d queries answered from the mixer state, %d forwarded, %d writes, %d messages sent' % (
+                self.address[1], len(self.targets), self.answered, self.forwarded, self.writes, self.fanned)
@@ -0,0 +1,103 @@
+try:
+    import rtmidi
+except ImportError:
+    rtmidi = None
+
+"""
+This module talks to MIDI devices with python-rtmidi directly instead
+of through mido. Messages are sent as tuples of status and data bytes
+and received as the byte lists rtmidi hands to its callback, so no
+message objects are built per event.
+
+A backend has the port functions of mido, pass it as backend to
+MidiController. Its raw attribute tells the controller to use bytes.
+"""
+
+def available():
+    """
+    True if python-rtmidi and its MIDI library can be loaded
+    """
+    return rtmidi != None
+
+class RawInput:
+    """
+    Input port. The callback gets the (bytes, delta time) pair and the
+    data argument of rtmidi, called on the thread of rtmidi.
+    """
+    def __init__(self, midiin, name):
+        self.midiin = midiin
+        self.name = name
+        self._callback = None
+
+    @property
+    def callback(self):
+        return self._callback
+
+    @callback.setter
+    def callback(self, callback):
+        # rtmidi calls it directly, without a wrapper in between
+        self._callback = callback
+        if callback != None:
+            self.midiin.set_callback(callback)
+        else:
+            self.midiin.cancel_callback()
+
+    def close(self):
+        self.midiin.close_port()
+        self.midiin.delete()
+
+class RawOutput:
+    """
+    Output port, send() takes a sequence of status and data bytes
+    """
+    def __init__(self, midiout, name):
+        self.midiout = midiout
+        self.name = name
+        self.send = midiout.send_message
+
+    def close(self):
+        self.midiout.close_port()
+        self.midiout.delete()
+
+class RawMidiBackend:
+    """
+    Port enumeration and opening with rtmidi
+    """
+    raw = True
+    # the ports belong to sound devices, so device changes can be watched
+    hardware = True
+
+    def __init__(self):
+        if rtmidi == None:
+            raise IOError('python-rtmidi is not installed')
+        try:
+            # kept open to list the ports, rtmidi asks the system every time
+            self.probe_in = rtmidi.MidiIn()
+            self.probe_out = rtmidi.MidiOut()
+        except rtmidi.RtMidiError as e:
+            raise IOError(str(e))
+
+    def get_input_names(self):
+        return self.probe_in.get_ports()
+
+    def get_output_names(self):
+        return self.probe_out.get_ports()
+
+    def open_input(self, name):
+        midiin = self.open(rtmidi.MidiIn, self.probe_in, name)
+        return RawInput(midiin, name)
+
+    def open_output(self, name):
+        midiout = self.open(rtmidi.MidiOut, self.probe_out, name)
+        return RawOutput(midiout, name)
+
+    def open(self, kind, probe, name):
+        try:
+            ports = probe.get_ports()
+            if name not in ports:
+                raise IOError('unknown port ' + name)
+            port = kind()
+            port.open_port(ports.index(name))
+            return port
+        except rtmidi.RtMidiError as e:
+            raise IOError(str(e))
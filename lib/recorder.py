@@ -0,0 +1,145 @@
+import time
+import struct
+import threading
+from collections import deque
+
+"""
+This module records the traffic of the application to a binary log, so
+problems seen during a show can be replayed later.
+
+The log starts with a magic string followed by entries of
+
+    time    float64, seconds since the start of the recording session
+    kind    uint8, one of the kinds below
+    source  uint8, number of the mixer or controller
+    length  uint16, length of the data
+    data    OSC datagram, raw MIDI bytes or session data
+
+all little endian. Recording again into the same file appends a new
+session which starts with a SESSION entry holding the wall clock time.
+"""
+
+MAGIC = b'XRLOG\x001\n'
+
+OSC_IN = 0
+OSC_OUT = 1
+MIDI_IN = 2
+MIDI_OUT = 3
+# data is the mixer number the controller is attached to
+ATTACH = 4
+# data is the wall clock time the session started at as float64
+SESSION = 5
+
+KIND_NAMES = ['OSC in', 'OSC out', 'MIDI in', 'MIDI out', 'attach', 'session']
+
+_ENTRY = struct.Struct('<dBBH')
+_WALL_TIME = struct.Struct('<d')
+
+class Recorder:
+    """
+    Append-only traffic log. record() only packs the entry and appends
+    it to a queue, a writer thread writes the queue to the file. When the
+    writer falls behind, entries are dropped and counted instead of
+    blocking the network and MIDI threads.
+    """
+    _FLUSH_INTERVAL = 0.5
+    _MAX_QUEUED = 100000
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        else:
+            with open(path, 'rb') as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    self.file.close()
+                    raise ValueError('%s is not a traffic log' % path)
+        self.queue = deque()
+        self.start = time.monotonic()
+        self.mixers = 0
+        self.controllers = 0
+        self.recorded = 0
+        self.dropped = 0
+        self.stopped = threading.Event()
+        self.worker = None
+        self.record(SESSION, 0, _WALL_TIME.pack(time.time()))
+
+    def add_client(self, client):
+        """
+        Record the OSC traffic of an XAirClient
+        """
+        client.server.recorder = self
+        client.server.source = self.mixers
+        self.mixers += 1
+
+    def add_controller(self, controller):
+        """
+        Record the MIDI traffic of a MidiController, add its mixer first
+        """
+        controller.recorder = self
+        controller.source = self.controllers
+        self.controllers += 1
+        server = controller.state.xair_client.server
+        if server.recorder == self:
+            self.record(ATTACH, controller.source, bytes([server.source]))
+
+    def record(self, kind, source, data):
+        if len(self.queue) >= self._MAX_QUEUED:
+            self.dropped += 1
+            return
+        self.queue.append(_ENTRY.pack(time.monotonic() - self.start, kind, source, len(data)) + data)
+
+    def start_writer(self):
+        self.worker = threading.Thread(target = self.run)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def run(self):
+        while not self.stopped.wait(self._FLUSH_INTERVAL):
+            self.write()
+
+    def write(self):
+        entries = []
+        while len(self.queue) > 0:
+            entries.append(self.queue.popleft())
+        if len(entries) > 0:
+            self.file.write(b''.join(entries))
+            self.file.flush()
+            self.recorded += len(entries)
+
+    def close(self):
+        self.stopped.set()
+        if self.worker != None:
+            self.worker.join()
+        self.write()
+        self.file.close()
+        print('Recorded %d entries to %s%s' % (self.recorded, self.path,
+                '' if self.dropped == 0 else ', dropped %d' % self.dropped))
+
+def read_log(path):
+    """
+    All entries of a log as (time, kind, source, data) tuples. Times
+    continue across sessions, so they can be replayed as one recording.
+    A truncated last entry, e.g. after a power loss, is ignored.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError('%s is not a traffic log' % path)
+    entries = []
+    offset = len(MAGIC)
+    # time of the last entry of the previous sessions
+    base = 0.0
+    last = 0.0
+    while offset + _ENTRY.size <= len(data):
+        timestamp, kind, source, length = _ENTRY.unpack_from(data, offset)
+        offset += _ENTRY.size
+        if offset + length > len(data):
+            break
+        if kind == SESSION:
+            base = last
+        last = base + timestamp
+        entries.append((last, kind, source, data[offset:offset + length]))
+        offset += length
+    return entries
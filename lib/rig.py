@@ -0,0 +1,94 @@
+import json
+
+"""
+This module loads the rig configuration, which lists several mixers and
+the controllers attached to each of them, so one process can serve a
+whole rig.
+
+A rig is a JSON file with two entries:
+
+    mixers       list of mixers, each with a unique "name", the ip
+                 "address" and optionally the control "layout" file
+                 and the UDP "port" of the mixer and the UDP port to
+                 serve the mixer state to local OSC clients on ("proxy")
+    controllers  list of controllers, each with the "mixer" name it
+                 controls and a "port", part of the MIDI port name
+                 which identifies the device
+
+Example:
+
+    {
+        "mixers": [
+            {"name": "foh", "address": "192.168.1.20"},
+            {"name": "monitors", "address": "192.168.1.21", "layout": "monitors.json", "proxy": 10025}
+        ],
+        "controllers": [
+            {"mixer": "foh", "port": "X-TOUCH MINI MIDI 1"},
+            {"mixer": "foh", "port": "X-TOUCH MINI MIDI 2"},
+            {"mixer": "monitors", "port": "X-TOUCH MINI MIDI 3"}
+        ]
+    }
+"""
+
+class Rig:
+    """
+    Validated rig configuration
+    """
+    def __init__(self, data, source = '<rig>'):
+        self.source = source
+        mixers = data.get('mixers')
+        if not isinstance(mixers, list) or len(mixers) == 0:
+            self.error('mixers must be a non-empty list')
+        # every mixer is a dict with name, address, port, layout and proxy port
+        self.mixers = []
+        names = []
+        proxies = []
+        for mixer in mixers:
+            if not isinstance(mixer, dict):
+                self.error('invalid mixer %r' % (mixer,))
+            name = mixer.get('name')
+            if not isinstance(name, str) or name in names:
+                self.error('every mixer needs a unique name')
+            names.append(name)
+            if not isinstance(mixer.get('address'), str):
+                self.error('mixer %s needs an address' % name)
+            port = mixer.get('port', 10024)
+            if not isinstance(port, int) or not 0 < port < 65536:
+                self.error('invalid port %r for mixer %s' % (port, name))
+            layout = mixer.get('layout')
+            if layout != None and not isinstance(layout, str):
+                self.error('invalid layout %r for mixer %s' % (layout, name))
+            proxy = mixer.get('proxy')
+            if proxy != None and (not isinstance(proxy, int) or not 0 < proxy < 65536 or proxy in proxies):
+                self.error('invalid proxy port %r for mixer %s' % (proxy, name))
+            proxies.append(proxy)
+            self.mixers.append({'name': name, 'address': mixer['address'], 'port': port, 'layout': layout,
+                                'proxy': proxy})
+
+        controllers = data.get('controllers')
+        if not isinstance(controllers, list) or len(controllers) == 0:
+            self.error('controllers must be a non-empty list')
+        # every controller is a dict with the MIDI port and the index of its mixer
+        self.controllers = []
+        ports = []
+        for controller in controllers:
+            if not isinstance(controller, dict):
+                self.error('invalid controller %r' % (controller,))
+            port = controller.get('port')
+            if not isinstance(port, str) or port.lower() in ports:
+                self.error('every controller needs a unique port')
+            ports.append(port.lower())
+            if controller.get('mixer') not in names:
+                self.error('controller %s uses unknown mixer %r' % (port, controller.get('mixer')))
+            self.controllers.append({'port': port, 'mixer': names.index(controller['mixer'])})
+
+    def error(self, message):
+        raise ValueError('%s: %s' % (self.source, message))
+
+def load_rig(path):
+    with open(path) as f:
+        try:
+            data = json.load(f)
+        except ValueError as e:
+            raise ValueError('%s: %s' % (path, e))
+    return Rig(data, path)
@@ -0,0 +1,327 @@
+import time
+import math
+import heapq
+import struct
+import queue
+import random
+import socket
+import argparse
+import threading
+from pythonosc.osc_packet import OscPacket
+from pythonosc.osc_message_builder import OscMessageBuilder
+from .mixerstate import MixerState
+from .sync import fader_to_db
+
+"""
+Stand-ins for the X-Air mixer and the X-Touch Mini, used to benchmark
+and test the application without hardware.
+
+Run a simulated mixer on the local machine:
+
+    $ python3 -m lib.simulator --loss 0.05
+"""
+
+class MixerSimulator:
+    """
+    Speaks the subset of the X-Air OSC protocol used by XAirClient:
+    /xinfo, parameter queries and sets, /node queries for channel mix and
+    mute group subtrees, /xremote and /xremotenfb subscriptions, the
+    /meters/1 stream and bundles of messages.
+    Incoming packets can be dropped and replies delayed to simulate a
+    busy network.
+    """
+    _SUBSCRIPTION_TIMEOUT = 10
+    _METER_COUNT = 40
+
+    def __init__(self, address = ('127.0.0.1', 0), name = 'XR18-SIM', model = 'XR18', firmware = '1.17',
+                 loss = 0.0, delay = 0.0, meter_interval = 0.05):
+        self.name = name
+        self.model = model
+        self.firmware = firmware
+        self.loss = loss
+        self.delay = delay
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(address)
+        self.address = self.socket.getsockname()
+        self.params = self.default_params()
+        # subscribed client address -> (expiry time, no feedback flag)
+        self.subscribers = {}
+        # client address -> expiry time of its /meters/1 subscription
+        self.meter_subscribers = {}
+        self.meter_interval = meter_interval
+        self.meter_frames = 0
+        self.lock = threading.Lock()
+        self.delayed = []
+        self.delay_event = threading.Condition()
+        self.running = False
+        # an offline mixer ignores everything, like during a reboot or network dropout
+        self.offline = False
+        # a mixer which does not accept bundles drops them silently
+        self.accept_bundles = True
+        # hooks and counters for benchmarks
+        self.on_receive = None
+        self.received = 0
+        self.dropped = 0
+
+    def default_params(self):
+        state = MixerState()
+        params = {}
+        for addr, (param, bank, slot, bus) in state.osc_index.items():
+            if param == MixerState.PARAM_FADER:
+                params[addr] = 0.75
+            elif param == MixerState.PARAM_ON:
+                params[addr] = 1
+            elif param == MixerState.PARAM_LEVEL:
+                params[addr] = 0.0
+            elif param == MixerState.PARAM_MUTE_GRP or param == MixerState.PARAM_FX_TYPE:
+                params[addr] = 0
+            else:
+                params[addr] = 0.5
+        return params
+
+    def start(self):
+        self.running = True
+        for target in (self.serve, self.deliver_delayed, self.send_meters):
+            worker = threading.Thread(target = target)
+            worker.daemon = True
+            worker.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.socket.close()
+        with self.delay_event:
+            self.delay_event.notify()
+
+    def serve(self):
+        while self.running:
+            try:
+                data, client = self.socket.recvfrom(4096)
+            except OSError:
+                break
+            if self.offline or (self.loss > 0.0 and random.random() < self.loss):
+                self.dropped += 1
+                continue
+            if not self.accept_bundles and data.startswith(b'#bundle'):
+                self.dropped += 1
+                continue
+            self.received += 1
+            try:
+                messages = OscPacket(data).messages
+            except Exception:
+                continue
+            for timed in messages:
+                msg = timed.message
+                if self.on_receive != None:
+                    self.on_receive(msg.address, msg.params)
+                self.handle(msg.address, msg.params, client)
+
+    def handle(self, address, params, client):
+        if address == '/xinfo':
+            self.reply(client, '/xinfo', [self.address[0], self.name, self.model, self.firmware])
+        elif address == '/xremote' or address == '/xremotenfb':
+            with self.lock:
+                self.subscribers[client] = (time.monotonic() + self._SUBSCRIPTION_TIMEOUT, address == '/xremotenfb')
+        elif address == '/meters':
+            if len(params) > 0 and params[0] == '/meters/1':
+                with self.lock:
+                    self.meter_subscribers[client] = time.monotonic() + self._SUBSCRIPTION_TIMEOUT
+        elif address == '/node':
+            if len(params) > 0:
+                text = self.node_text(params[0])
+                if text != None:
+                    self.reply(client, '/node', [text])
+        elif len(params) == 0:
+            if address in self.params:
+                self.reply(client, address, [self.params[address]])
+        else:
+            self.params[address] = params[0]
+            self.broadcast(address, params[0], client)
+
+    def node_text(self, path):
+        base = '/' + path
+        if base + '/fader' in self.params:
+            db = fader_to_db(self.params[base + '/fader'])
+            return '%s %s %s\n' % (base, 'ON' if self.params[base + '/on'] == 1 else 'OFF',
+                                   '-oo' if db <= -90.0 else '%+.1f' % db)
+        elif path == 'config/mute':
+            return base + ''.join(' ON' if self.params['/config/mute/%d' % (i + 1)] == 1 else ' OFF'
+                                  for i in range(0, 4)) + '\n'
+        return None
+
+    def go_offline(self):
+        """
+        Stop answering, the mixer forgets its subscribers like after a reboot
+        """
+        self.offline = True
+        with self.lock:
+            self.subscribers = {}
+            self.meter_subscribers = {}
+
+    def go_online(self):
+        self.offline = False
+
+    def meter_blob(self, now):
+        # post fader levels of the channels moving around -20 dB, silence elsewhere
+        levels = [-32768] * self._METER_COUNT
+        for i in range(0, 16):
+            db = fader_to_db(self.params['/ch/%02d/mix/fader' % (i + 1)]) - 20 + 15 * math.sin(now * (1 + i / 4))
+            levels[i] = max(-32768, int(db * 256))
+        return struct.pack('<i%dh' % self._METER_COUNT, self._METER_COUNT, *levels)
+
+    def send_meters(self):
+        next_frame = time.monotonic()
+        while self.running:
+            next_frame += self.meter_interval
+            time.sleep(max(0.0, next_frame - time.monotonic()))
+            now = time.monotonic()
+            with self.lock:
+                clients = [client for client, expiry in self.meter_subscribers.items() if expiry >= now]
+            if len(clients) > 0:
+                blob = self.meter_blob(now)
+                self.meter_frames += 1
+                for client in clients:
+                    self.reply(client, '/meters/1', [blob])
+
+    def set(self, address, value):
+        """
+        Change a parameter as if it was moved on the mixer itself
+        """
+        self.params[address] = value
+        self.broadcast(address, value, None)
+
+    def broadcast(self, address, value, source):
+        now = time.monotonic()
+        with self.lock:
+            for client, (expiry, no_feedback) in list(self.subscribers.items()):
+                if expiry < now:
+                    del self.subscribers[client]
+                elif client != source or not no_feedback:
+                    self.reply(client, address, [value])
+
+    def reply(self, client, address, values):
+        builder = OscMessageBuilder(address = address)
+        for value in values:
+            builder.add_arg(value)
+        data = builder.build().dgram
+        if self.delay > 0.0:
+            with self.delay_event:
+                heapq.heappush(self.delayed, (time.monotonic() + self.delay, id(data), data, client))
+                self.delay_event.notify()
+        else:
+            self.sendto(data, client)
+
+    def sendto(self, data, client):
+        try:
+            self.socket.sendto(data, client)
+        except OSError:
+            pass
+
+    def deliver_delayed(self):
+        while self.running:
+            with self.delay_event:
+                if len(self.delayed) == 0:
+                    self.delay_event.wait()
+                    continue
+                due = self.delayed[0][0]
+                now = time.monotonic()
+                if due > now:
+                    self.delay_event.wait(due - now)
+                    continue
+                _, _, data, client = heapq.heappop(self.delayed)
+            self.sendto(data, client)
+
+class FakeInput:
+    """
+    MIDI input port fed by inject(). Supports iteration like a blocking
+    mido port and the callback attribute used by the asyncio runtime.
+    A raw port hands the bytes of the message to the callback like
+    rtmidi does.
+    """
+    def __init__(self, name, raw = False):
+        self.name = name
+        self.raw = raw
+        self.callback = None
+        self.queue = queue.Queue()
+        self.closed = False
+
+    def inject(self, msg):
+        if self.callback != None:
+            if self.raw:
+                self.callback((msg.bytes(), 0.0), None)
+            else:
+                self.callback(msg)
+        else:
+            self.queue.put(msg)
+
+    def __iter__(self):
+        while True:
+            yield self.queue.get()
+
+    def close(self):
+        self.closed = True
+
+class FakeOutput:
+    """
+    MIDI output port recording every message sent to the surface, mido
+    messages or byte tuples for a raw port
+    """
+    def __init__(self, name):
+        self.name = name
+        self.sent = []
+        self.on_send = None
+        self.closed = False
+
+    def send(self, msg):
+        self.sent.append(msg)
+        if self.on_send != None:
+            self.on_send(msg)
+
+    def close(self):
+        self.closed = True
+
+class FakeMidiBackend:
+    """
+    Replacement for the mido port functions, pass as backend to MidiController.
+    With raw = True it behaves like the rtmidi backend of lib.rawmidi.
+    """
+    def __init__(self, name = 'X-TOUCH MINI (fake)', raw = False):
+        self.names = [name]
+        self.raw = raw
+        self.inputs = {}
+        self.outputs = {}
+
+    def get_input_names(self):
+        return list(self.names)
+
+    def get_output_names(self):
+        return list(self.names)
+
+    def open_input(self, name):
+        if name not in self.names:
+            raise IOError('unknown port ' + name)
+        self.inputs[name] = FakeInput(name, self.raw)
+        return self.inputs[name]
+
+    def open_output(self, name):
+        if name not in self.names:
+            raise IOError('unknown port ' + name)
+        self.outputs[name] = FakeOutput(name)
+        return self.outputs[name]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Simulated X-Air mixer for testing without hardware')
+    parser.add_argument('-p', '--port', help = 'UDP port to listen on (default: 10024)', type = int, default = 10024)
+    parser.add_argument('--loss', help = 'probability of dropping an incoming packet (default: 0)', type = float, default = 0.0)
+    parser.add_argument('--delay', help = 'reply delay in ms (default: 0)', type = float, default = 0.0)
+    parser.add_argument('--meter-interval', help = 'time between /meters/1 frames in ms (default: 50)', type = float, default = 50.0)
+    args = parser.parse_args()
+
+    simulator = MixerSimulator(('127.0.0.1', args.port), loss = args.loss, delay = args.delay / 1000,
+                               meter_interval = args.meter_interval / 1000).start()
+    print('Simulated %s listening on %s:%d' % (simulator.model, simulator.address[0], simulator.address[1]))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import threading
+from .commandqueue import PRIORITY_MIDI
+from .sync import StateSync, SyncRequest
+
+"""
+This module saves and recalls named snapshots of the mixer state
+"""
+
+def snapshot_directory():
+    base = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    return os.path.join(base, 'xair-remote', 'snapshots')
+
+class SnapshotManager:
+    """
+    Snapshots hold faders, mutes and sends of all channels in the fader
+    banks and main LR, the mute groups and the delay time of all fx
+    slots holding a delay. They are stored as JSON files.
+
+    Recall only sends the parameters which differ from the current state,
+    packed into bundles within the send budget, and then queries them
+    again to verify that the mixer took all values.
+    """
+    # relative tolerance when comparing echoed float values
+    _TOLERANCE = 0.001
+
+    def __init__(self, state, directory = None):
+        self.state = state
+        self.directory = directory if directory != None else snapshot_directory()
+        self.lock = threading.Lock()
+        self.current = None
+
+    def path(self, name):
+        safe = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+        return os.path.join(self.directory, safe + '.json')
+
+    def names(self):
+        try:
+            return sorted(f[:-5] for f in os.listdir(self.directory) if f.endswith('.json'))
+        except OSError:
+            return []
+
+    def addresses(self):
+        state = self.state
+        addresses = []
+        for channel in [channel for bank in state.banks for channel in bank] + [state.lr]:
+            if channel != None and channel.fader_addr not in addresses:
+                addresses += [channel.fader_addr, channel.on_addr]
+                if channel.send_addrs != None:
+                    addresses += channel.send_addrs
+        addresses += [group.osc_base_addr for group in state.mute_groups]
+        for slot in range(0, len(state.fx_slots)):
+            if state.fx_slots[slot] in state._DELAY_FX_IDS:
+                addresses.append(state.delay_time_addr(slot))
+        return addresses
+
+    def save(self, name):
+        values = {}
+        for address in self.addresses():
+            values[address] = self.state.store.get(address)
+        os.makedirs(self.directory, exist_ok = True)
+        with open(self.path(name), 'w') as f:
+            json.dump(values, f, indent = 1, sort_keys = True)
+        print('Saved snapshot %s (%d parameters)' % (name, len(values)))
+
+    def load(self, name):
+        with open(self.path(name)) as f:
+            values = json.load(f)
+        state = self.state
+        # a delay time only applies while its slot still holds that delay,
+        # other effects use the same parameters for something else
+        fx_times = set(address for addrs in state.fx_time_addrs for address in addrs)
+        delay_times = set(state.delay_time_addr(slot) for slot in range(0, len(state.fx_slots))
+                          if state.fx_slots[slot] in state._DELAY_FX_IDS)
+        # ignore parameters this layout does not know
+        return [(address, value) for address, value in values.items()
+                if address in state.store and (address not in fx_times or address in delay_times)]
+
+    def recall_async(self, name):
+        """
+        Recall without blocking, used by controller actions. Runs on the
+        command queue and verifies on the shared timers.
+        """
+        self.state.commands.submit(PRIORITY_MIDI, self.start_recall, name)
+
+    def start_recall(self, name):
+        recall = self.begin_recall(name)
+        if recall == None:
+            return
+        changed = recall[1]
+        if len(changed) == 0:
+            self.end_recall(recall, {}, True)
+            return
+        sync = StateSync(self.state.xair_client, self.state)
+        sync.start([SyncRequest(address) for address, value in changed],
+                   lambda complete: self.end_recall(recall, sync.values, complete))
+
+    def recall(self, name):
+        """
+        Send all differences to the snapshot and verify the mixer state.
+        Returns True if the mixer echoed every target value.
+        """
+        recall = self.begin_recall(name)
+        if recall == None:
+            return False
+        changed = recall[1]
+        values = {}
+        if len(changed) > 0:
+            sync = StateSync(self.state.xair_client, self.state)
+            sync.run([SyncRequest(address) for address, value in changed], quiet = True)
+            values = sync.values
+        return self.end_recall(recall, values, True)
+
+    def begin_recall(self, name):
+        """
+        Send the differences and repaint the controllers. Returns
+        (name, changed, number of targets, send time) holding the lock,
+        or None.
+        """
+        if not self.lock.acquire(blocking = False):
+            print('Snapshot recall already running, ignoring %s' % name)
+            return None
+        try:
+            targets = self.load(name)
+        except (IOError, ValueError) as e:
+            self.lock.release()
+            print('Error: Can not load snapshot %s: %s' % (name, e))
+            return None
+        start = time.monotonic()
+        state = self.state
+        store = state.store
+        changed = [(address, value) for address, value in targets if not self.equal(store.get(address), value)]
+        # update local state and surface, then the mixer
+        for address, value in changed:
+            state.commands.submit(PRIORITY_MIDI, state.received_osc, address, value)
+        state.xair_client.send_batch(changed)
+        sent = time.monotonic() - start
+        self.current = name
+        # the current snapshot is shown by snapshot buttons
+        for controller in state.controllers:
+            state.commands.submit(PRIORITY_MIDI, controller.refresh_controls, controller.active_bank)
+        return (name, changed, len(targets), sent)
+
+    def end_recall(self, recall, values, complete):
+        """
+        Check the values queried after the recall and release the lock
+        """
+        name, changed, count, sent = recall
+        try:
+            mismatched = [address for address, value in changed
+                          if address not in values or not self.equal(values[address], value)]
+            if len(mismatched) > 0:
+                print('Warning: Mixer did not take snapshot values for %s' % ', '.join(mismatched))
+            verified = len(mismatched) == 0
+            print('Recalled snapshot %s: %d of %d parameters changed, sent in %.1f ms, %s' % (name,
+                    len(changed), count, sent * 1000, 'verified' if verified else 'verification FAILED'))
+            return verified
+        finally:
+            self.lock.release()
+
+    def equal(self, current, target):
+        if isinstance(target, float) or isinstance(current, float):
+            return abs(current - target) <= self._TOLERANCE * max(1.0, abs(target))
+        return current == target
@@ -0,0 +1,85 @@
+import os
+import time
+import threading
+
+"""
+This module persists the last known mixer state between runs, so the
+X-Touch can show it right after startup while the live state is loaded
+"""
+
+def cache_directory():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'xair-remote')
+
+class StateCache:
+    """
+    Binary cache file of a ParameterStore, one file per mixer.
+
+    Writes happen on a background thread: every check interval it diffs
+    the store against the last written snapshot and only writes once
+    the state did not change for a whole interval, or after the maximum
+    delay during continuous changes. The hot path never touches the file.
+    """
+    _CHECK_INTERVAL = 2.0
+    _MAX_DELAY = 10.0
+
+    def __init__(self, store, identity, directory = None):
+        self.store = store
+        if directory == None:
+            directory = cache_directory()
+        name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in identity)
+        self.path = os.path.join(directory, name + '.bin')
+        self.written = store.snapshot()
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Load the cached state into the store, returns False if there is
+        no usable cache for this mixer
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                self.store.deserialize(f.read())
+        except (IOError, ValueError):
+            return False
+        self.written = self.store.snapshot()
+        return True
+
+    def start(self):
+        worker = threading.Thread(target = self.run)
+        worker.daemon = True
+        worker.start()
+
+    def run(self):
+        previous = self.store.snapshot()
+        dirty_since = None
+        while True:
+            time.sleep(self._CHECK_INTERVAL)
+            current = self.store.snapshot()
+            if len(self.store.diff(self.written)) == 0:
+                dirty_since = None
+            else:
+                if dirty_since == None:
+                    dirty_since = time.monotonic()
+                # debounce: wait until changes settle, but not forever
+                if len(self.store.diff(previous)) == 0 or time.monotonic() - dirty_since >= self._MAX_DELAY:
+                    self.write(current)
+                    dirty_since = None
+            previous = current
+
+    def flush(self):
+        if len(self.store.diff(self.written)) > 0:
+            self.write(self.store.snapshot())
+
+    def write(self, snapshot):
+        with self.lock:
+            data = self.store.serialize(snapshot)
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok = True)
+                temp = self.path + '.tmp'
+                with open(temp, 'wb') as f:
+                    f.write(data)
+                os.replace(temp, self.path)
+                self.written = snapshot
+            except OSError as e:
+                print('Warning: Can not write state cache %s: %s' % (self.path, e))
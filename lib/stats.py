@@ -0,0 +1,127 @@
+import time
+import threading
+
+"""
+This module collects latency histograms and message counters for the
+hot paths. Collection is disabled by default, every call site checks
+stats.enabled first so the cost is a single attribute lookup.
+"""
+
+class Histogram:
+    """
+    Latency histogram with power of two buckets in microseconds
+    """
+    _BUCKETS = 25
+
+    def __init__(self):
+        self.buckets = [0] * self._BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        bucket = min(int(seconds * 1000000).bit_length(), self._BUCKETS - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        # upper bound of the bucket holding the percentile, in seconds
+        limit = q * self.count
+        seen = 0
+        for bucket in range(0, self._BUCKETS):
+            seen += self.buckets[bucket]
+            if seen >= limit and seen > 0:
+                return min((1 << bucket) / 1000000, self.max)
+        return self.max
+
+    def summary(self):
+        return '%8d  avg %8.3f ms  p50 <%8.3f ms  p99 <%8.3f ms  max %8.3f ms' % (self.count,
+                self.total / self.count * 1000, self.percentile(0.5) * 1000,
+                self.percentile(0.99) * 1000, self.max * 1000)
+
+class Stats:
+    """
+    Per path latency histograms, OSC messages per address family and
+    counters for unknown or dropped messages.
+
+    The command queue marks where the current command came from (midi
+    or osc) and when it was submitted. Code further down the path calls
+    end() to record the latency from that origin to itself.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+        self.counters = {}
+        self.families = {}
+        self.current = threading.local()
+
+    def begin(self, origin, start):
+        self.current.origin = origin
+        self.current.start = start
+
+    def finish(self):
+        self.current.origin = None
+
+    def end(self, target):
+        origin = getattr(self.current, 'origin', None)
+        if origin == None:
+            return
+        self.record('%s to %s' % (origin, target), time.monotonic() - self.current.start)
+
+    def record(self, path, seconds):
+        histogram = self.histograms.get(path)
+        if histogram == None:
+            histogram = self.histograms[path] = Histogram()
+        histogram.add(seconds)
+
+    def count(self, name):
+        self.counters[name] = self.counters.get(name, 0) + 1
+
+    def count_osc(self, addr):
+        # address family is the first path element, e.g. /ch or /config
+        end = addr.find('/', 1)
+        family = addr if end < 0 else addr[:end]
+        self.families[family] = self.families.get(family, 0) + 1
+
+    def dump(self):
+        lines = ['Latency:']
+        for path in sorted(self.histograms):
+            lines.append('  %-16s %s' % (path, self.histograms[path].summary()))
+        lines.append('Inbound OSC messages:')
+        for family in sorted(self.families):
+            lines.append('  %-16s %8d' % (family, self.families[family]))
+        lines.append('Counters:')
+        for name in sorted(self.counters):
+            lines.append('  %-16s %8d' % (name, self.counters[name]))
+        return '\n'.join(lines)
+
+class Timeline:
+    """
+    Startup milestones, each recorded the first time it is reached.
+    Times are measured from the import of this module, which is the
+    first thing xair-remote.py imports.
+    """
+    def __init__(self):
+        self.start = time.monotonic()
+        self.events = []
+        self.lock = threading.Lock()
+
+    def mark(self, name):
+        now = time.monotonic()
+        with self.lock:
+            if name not in [event for event, at in self.events]:
+                self.events.append((name, now))
+
+    def report(self):
+        lines = ['Startup timeline:']
+        previous = self.start
+        for name, at in self.events:
+            lines.append('  %7.3f s  %-24s +%.3f s' % (at - self.start, name, at - previous))
+            previous = at
+        return '\n'.join(lines)
+
+stats = Stats()
+timeline = Timeline()
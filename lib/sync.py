@@ -0,0 +1,344 @@
+import time
+import threading
+from collections import deque
+from .commandqueue import PRIORITY_OSC
+from .stats import timeline
+from .timers import timers
+
+"""
+This module loads the complete mixer state with a bounded window of
+outstanding queries instead of sending one query after another
+"""
+
+def db_to_fader(db):
+    """
+    Convert a dB value as reported by /node replies to the
+    0.0 - 1.0 fader range used for /fader and /level parameters
+    """
+    if db <= -90.0:
+        return 0.0
+    elif db < -60.0:
+        value = (db + 90.0) / 480.0
+    elif db < -30.0:
+        value = (db + 70.0) / 160.0
+    elif db < -10.0:
+        value = (db + 50.0) / 80.0
+    else:
+        value = (db + 30.0) / 40.0
+    return min(max(0.0, value), 1.0)
+
+def fader_to_db(value):
+    """
+    Inverse of db_to_fader
+    """
+    if value <= 0.0:
+        return -90.0
+    elif value < 0.0625:
+        return value * 480.0 - 90.0
+    elif value < 0.25:
+        return value * 160.0 - 70.0
+    elif value < 0.5:
+        return value * 80.0 - 50.0
+    return value * 40.0 - 30.0
+
+def parse_db(token):
+    if token in ('-oo', '-inf'):
+        return -90.0
+    return float(token)
+
+def parse_switch(token):
+    if token == 'ON':
+        return 1
+    elif token == 'OFF':
+        return 0
+    raise ValueError('not a switch value: ' + token)
+
+class SyncRequest:
+    """
+    A single query sent during synchronization. Node queries carry a
+    parser for the text reply and fallback requests for mixers which
+    do not answer /node for this subtree.
+    """
+    def __init__(self, address, param = None, key = None, parser = None, fallback = None):
+        self.address = address
+        self.param = param
+        self.key = key if key != None else address
+        self.parser = parser
+        self.fallback = fallback
+        self.attempts = 0
+        self.sent = 0.0
+        # sent in a bundle the last time, or only alone from now on
+        self.bundled = False
+        self.single = False
+        # part of the fader banks shown on a controller
+        self.first = False
+
+class StateSync:
+    """
+    Queries all parameters tracked by MixerState. Replies are matched to
+    the outstanding requests, lost replies are retried and the sync is
+    complete once every request was answered or ran out of retries.
+
+    Queries are sent in batches of at least half the window, each batch
+    in one bundle. If bundled queries stay unanswered while the same
+    queries sent alone are answered, the mixer ignores bundles and the
+    client falls back to single messages.
+
+    The fader banks shown on the controllers are queried first, so the
+    surface is usable before the other banks are loaded.
+    """
+    _WINDOW = 16
+    _TIMEOUT = 0.2
+    _RETRIES = 3
+    # how often a sync running on the shared timers looks for replies
+    _STEP_INTERVAL = 0.01
+
+    def __init__(self, client, state):
+        self.client = client
+        self.state = state
+        self.lock = threading.Condition()
+        self.pending = deque()
+        self.outstanding = {}
+        self.failed = []
+        # values of answered single parameter queries
+        self.values = {}
+        self.retries = 0
+        self.sent = 0
+        self.bundle_replies = 0
+        # unanswered queries of the shown banks
+        self.first_pending = 0
+        self.cancelled = False
+        self.complete = threading.Event()
+        # called on the command queue when a sync started with start() is over
+        self.done = None
+
+    def build_requests(self):
+        shown = []
+        for controller in self.state.controllers:
+            if controller.active_bank >= 0 and controller.active_bank not in shown:
+                shown.append(controller.active_bank)
+        requests = []
+        for bank in shown + [bank for bank in range(0, len(self.state.banks)) if bank not in shown]:
+            for channel in self.state.banks[bank]:
+                if channel != None:
+                    requests.append(self.channel_request(channel))
+                    if channel.send_addrs != None:
+                        for addr in channel.send_addrs:
+                            requests.append(SyncRequest(addr))
+            if bank in shown:
+                for request in requests:
+                    request.first = True
+                self.first_pending = len(requests)
+        requests.append(self.channel_request(self.state.lr))
+        requests.append(self.mute_group_request())
+        for i in range(0, len(self.state.fx_slots)):
+            requests.append(SyncRequest('/fx/%d/type' % (i + 1)))
+        return requests
+
+    def channel_request(self, channel):
+        # /node reply: "/ch/01/mix ON -12.5 ..." holds on and fader
+        def parse(tokens):
+            return [(channel.on_addr, parse_switch(tokens[1])),
+                    (channel.fader_addr, db_to_fader(parse_db(tokens[2])))]
+        return SyncRequest('/node', channel.osc_base_addr[1:], key = channel.osc_base_addr, parser = parse,
+                           fallback = [SyncRequest(channel.fader_addr), SyncRequest(channel.on_addr)])
+
+    def mute_group_request(self):
+        # /node reply: "/config/mute OFF OFF OFF OFF"
+        groups = self.state.mute_groups
+        def parse(tokens):
+            return [(groups[i].osc_base_addr, parse_switch(tokens[i + 1])) for i in range(0, len(groups))]
+        return SyncRequest('/node', 'config/mute', key = '/config/mute', parser = parse,
+                           fallback = [SyncRequest(group.osc_base_addr) for group in groups])
+
+    def run(self, requests = None, quiet = False):
+        """
+        Run the synchronization and block until it is complete.
+        Returns True if every parameter was received.
+        """
+        start = time.monotonic()
+        if requests == None:
+            requests = self.build_requests()
+        # registered while waiting for the client, so a lost connection cancels it
+        self.begin(requests)
+        try:
+            # blocking syncs of a client run one after the other
+            with self.client.sync_lock:
+                while True:
+                    with self.lock:
+                        if self.finished():
+                            break
+                        self.expire(time.monotonic())
+                        batch = self.next_batch()
+                        if batch == None:
+                            self.lock.wait(self._TIMEOUT / 4)
+                    # sending may block on the send budget, replies must get the lock meanwhile
+                    if batch != None:
+                        self.send(batch)
+        finally:
+            self.client.remove_sync(self)
+        self.complete.set()
+        if not quiet:
+            self.report(time.monotonic() - start)
+        return len(self.failed) == 0 and not self.cancelled
+
+    def start(self, requests, done):
+        """
+        Run the synchronization on the shared timers instead of blocking.
+        done(complete) is submitted to the command queue when it is over.
+        """
+        self.done = done
+        self.begin(requests)
+        timers.add(time.monotonic(), self.step)
+
+    def begin(self, requests):
+        with self.lock:
+            self.pending.extend(requests)
+        # other syncs may be running, every one gets all replies
+        self.client.add_sync(self)
+
+    def step(self, due):
+        batch = None
+        with self.lock:
+            over = self.finished()
+            if not over:
+                self.expire(time.monotonic())
+                batch = self.next_batch()
+        if over:
+            self.client.remove_sync(self)
+            self.complete.set()
+            self.state.commands.submit(PRIORITY_OSC, self.done, len(self.failed) == 0 and not self.cancelled)
+            return None
+        if batch != None:
+            self.send(batch)
+        return time.monotonic() + self._STEP_INTERVAL
+
+    def finished(self):
+        return (len(self.pending) == 0 and len(self.outstanding) == 0) or self.cancelled
+
+    def cancel(self):
+        """
+        Stop waiting for replies, e.g. when the mixer is gone
+        """
+        with self.lock:
+            self.cancelled = True
+            self.lock.notify()
+
+    def report(self, elapsed):
+        if self.cancelled:
+            print('Mixer state sync cancelled')
+        elif len(self.failed) > 0:
+            print('Warning: No reply for %d of %d mixer parameters: %s' % (len(self.failed), self.sent,
+                    ', '.join(req.key for req in self.failed)))
+        else:
+            print('Mixer state loaded in %.2f s (%d queries, %d retries)' % (elapsed, self.sent, self.retries))
+
+    def next_batch(self):
+        """
+        Take the next queries from pending once at most half the window
+        is outstanding and mark them as sent, called with the lock held.
+        Returns the (single, bundled) queries to send or None.
+        """
+        if len(self.outstanding) > self._WINDOW // 2 or len(self.pending) == 0:
+            return None
+        requests = []
+        while len(self.pending) > 0 and len(self.outstanding) + len(requests) < self._WINDOW:
+            requests.append(self.pending.popleft())
+        now = time.monotonic()
+        bundled = [request for request in requests if not request.single] if self.client.bundles else []
+        if len(bundled) < 2:
+            bundled = []
+        for request in requests:
+            request.attempts += 1
+            request.sent = now
+            request.bundled = False
+            self.outstanding[request.key] = request
+        for request in bundled:
+            request.bundled = True
+        self.sent += len(requests)
+        return ([request for request in requests if not request.bundled], bundled)
+
+    def send(self, batch):
+        single, bundled = batch
+        for request in single:
+            self.client.send(address = request.address, param = request.param)
+        self.client.send_batch([(request.address, request.param) for request in bundled])
+
+    def expire(self, now):
+        for key, request in list(self.outstanding.items()):
+            if now - request.sent < self._TIMEOUT:
+                continue
+            del self.outstanding[key]
+            if request.bundled and self.bundle_replies == 0 and request.attempts >= 2:
+                # no bundle was answered yet, find out if this query is answered alone
+                request.single = True
+            if request.attempts <= self._RETRIES:
+                self.retries += 1
+                self.pending.appendleft(request)
+            elif request.fallback != None:
+                # mixer does not answer this node query, ask for single parameters
+                self.pending.extendleft(request.fallback)
+                self.first_done(request, request.fallback)
+            else:
+                self.failed.append(request)
+                self.first_done(request)
+
+    def received(self, addr, data):
+        """
+        Called by XAirClient for every incoming message
+        """
+        values = None
+        with self.lock:
+            if addr == '/node':
+                if len(data) == 0 or not isinstance(data[0], str):
+                    return
+                tokens = data[0].split()
+                if len(tokens) == 0:
+                    return
+                request = self.outstanding.pop(tokens[0], None)
+                if request == None:
+                    return
+                self.answered(request)
+                try:
+                    values = request.parser(tokens)
+                except (IndexError, ValueError):
+                    # unexpected reply format, query single parameters
+                    self.pending.extendleft(request.fallback)
+                    self.first_done(request, request.fallback)
+                else:
+                    self.first_done(request)
+            else:
+                request = self.outstanding.pop(addr, None)
+                if request == None:
+                    return
+                self.answered(request)
+                self.first_done(request)
+                if len(data) > 0:
+                    self.values[addr] = data[0]
+            self.lock.notify()
+        if values != None:
+            for value_addr, value in values:
+                self.state.commands.submit(PRIORITY_OSC, self.state.received_osc, value_addr, value)
+
+    def first_done(self, request, replaced_by = None):
+        """
+        A query of the shown banks was answered, failed or replaced by
+        single parameter queries
+        """
+        if not request.first:
+            return
+        request.first = False
+        if replaced_by != None:
+            for replacement in replaced_by:
+                replacement.first = True
+            self.first_pending += len(replaced_by)
+        self.first_pending -= 1
+        if self.first_pending == 0:
+            # the values are applied by the queue before this
+            self.state.commands.submit(PRIORITY_OSC, timeline.mark, 'shown banks synced')
+
+    def answered(self, request):
+        if request.bundled:
+            self.bundle_replies += 1
+        elif request.single and self.bundle_replies == 0:
+            self.client.disable_bundles()
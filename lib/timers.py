@@ -0,0 +1,121 @@
+import time
+import heapq
+import threading
+from .stats import Histogram
+
+"""
+This module runs all periodic work of the application (tempo LEDs,
+keepalive and connection checks, MIDI port checks) from one timer queue
+on the monotonic clock
+"""
+
+class Timer:
+    __slots__ = ('due', 'callback', 'cancelled')
+
+    def __init__(self, due, callback):
+        self.due = due
+        self.callback = callback
+        self.cancelled = False
+
+class Timers:
+    """
+    Timers are scheduled at absolute deadlines. A callback gets the
+    deadline it was due at and returns its next deadline or None to stop.
+    Periodic callbacks which add their period to the deadline instead of
+    the current time never drift, late runs only cause jitter.
+
+    Timers run on one thread started with start() or run(), or on an
+    event loop that calls run_due() and is told about new earlier
+    deadlines through the wakeup hook.
+    """
+    def __init__(self):
+        self.heap = []
+        self.sequence = 0
+        self.lock = threading.Condition()
+        self.running = False
+        # called with the earliest deadline when it moved forward
+        self.wakeup = None
+        # how late callbacks ran, for jitter reports
+        self.lateness = Histogram()
+
+    def add(self, due, callback):
+        timer = Timer(due, callback)
+        self.push(timer)
+        return timer
+
+    def call_later(self, delay, callback):
+        return self.add(time.monotonic() + delay, callback)
+
+    def cancel(self, timer):
+        timer.cancelled = True
+
+    def push(self, timer):
+        with self.lock:
+            earliest = len(self.heap) == 0 or timer.due < self.heap[0][0]
+            heapq.heappush(self.heap, (timer.due, self.sequence, timer))
+            self.sequence += 1
+            if earliest:
+                self.lock.notify()
+        if earliest and self.wakeup != None:
+            self.wakeup(timer.due)
+
+    def next_due(self):
+        with self.lock:
+            return self.heap[0][0] if len(self.heap) > 0 else None
+
+    def run_due(self, now = None):
+        """
+        Run all callbacks that are due, returns the next deadline
+        """
+        if now == None:
+            now = time.monotonic()
+        while True:
+            with self.lock:
+                if len(self.heap) == 0:
+                    return None
+                if self.heap[0][0] > now:
+                    return self.heap[0][0]
+                due, _, timer = heapq.heappop(self.heap)
+            if timer.cancelled:
+                continue
+            self.lateness.add(max(0.0, time.monotonic() - due))
+            try:
+                next_due = timer.callback(due)
+            except Exception as e:
+                print('Error: Timer %s failed: %s' % (getattr(timer.callback, '__name__', timer.callback), e))
+                next_due = None
+            if next_due != None and not timer.cancelled:
+                timer.due = next_due
+                with self.lock:
+                    heapq.heappush(self.heap, (next_due, self.sequence, timer))
+                    self.sequence += 1
+
+    def run(self):
+        self.running = True
+        while True:
+            next_due = self.run_due()
+            with self.lock:
+                # a timer added meanwhile may be due earlier
+                if len(self.heap) > 0 and (next_due == None or self.heap[0][0] < next_due):
+                    next_due = self.heap[0][0]
+                if next_due == None:
+                    self.lock.wait()
+                else:
+                    delay = next_due - time.monotonic()
+                    if delay > 0:
+                        self.lock.wait(delay)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        worker = threading.Thread(target = self.run)
+        worker.daemon = True
+        worker.start()
+
+    def summary(self):
+        if self.lateness.count == 0:
+            return 'Timers: no runs'
+        return 'Timers: lateness ' + self.lateness.summary().strip()
+
+timers = Timers()
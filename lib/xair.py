@@ -1,18 +1,170 @@
-import time
 import threading
 import socket
+import struct
 from pythonosc.dispatcher import Dispatcher
 from pythonosc.osc_server import BlockingOSCUDPServer
-from pythonosc.osc_message import OscMessage
 from pythonosc.osc_message_builder import OscMessageBuilder
 from .mixerstate import MixerState
+from .outbound import SendScheduler
+from .commandqueue import PRIORITY_OSC
+from .connection import ConnectionHealth
+from .meters import MeterStream, METERS
+from .timers import timers
+from .stats import stats, timeline
+from .recorder import OSC_IN, OSC_OUT
 
 class OSCClientServer(BlockingOSCUDPServer):
-    def __init__(self, address, dispatcher):
+    # Packers for the argument types a template can be compiled for
+    _PACKERS = {
+        float: struct.Struct('>f').pack,
+        int: struct.Struct('>i').pack,
+        type(None): None
+    }
+    _TYPE_TAGS = {float: ',f', int: ',i', type(None): ','}
+    # Unpackers for the argument types received on the fast path, blobs are copied
+    _UNPACKERS = {
+        'f': struct.Struct('>f').unpack_from,
+        'i': struct.Struct('>i').unpack_from,
+        'b': None
+    }
+    # datagrams handled per wakeup of the event loop before other callbacks get a turn
+    _DRAIN_LIMIT = 256
+    _BUFFER_SIZE = 65536
+    # drain() needs non-blocking receives on the blocking socket, not available on Windows
+    drains = hasattr(socket, 'MSG_DONTWAIT')
+
+    def __init__(self, address, dispatcher, value_handler = None):
         super().__init__(('', 0), dispatcher)
         self.xr_address = address
+        self.templates = {}
+        # padded address and type tag -> (address, unpacker) of the fast path
+        self.routes = {}
+        self.value_handler = value_handler
+        # every datagram is received into the same buffer
+        self.buffer = bytearray(self._BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        # traffic recorder and the mixer number used in its log
+        self.recorder = None
+        self.source = 0
+
+    def precompile(self, addresses):
+        """
+        Pre-encode the padded address and type tag of every address for
+        all single argument types, so sending only packs the argument
+        """
+        for address in addresses:
+            for kind, packer in self._PACKERS.items():
+                prefix = osc_string(address) + osc_string(self._TYPE_TAGS[kind])
+                self.templates[(address, kind)] = (prefix, packer)
+
+    def route(self, addresses, tags = 'fi'):
+        """
+        Pre-encode the padded address and type tag of every address for
+        the given single argument types, so received messages of this
+        form are handed to value_handler without parsing by pythonosc
+        """
+        for address in addresses:
+            for tag in tags:
+                self.routes[osc_string(address) + osc_string(',' + tag)] = (address, self._UNPACKERS[tag])
+
+    def finish_request(self, request, client_address):
+        # dispatch right away instead of creating a request handler
+        self.handle_datagram(request[0], client_address)
+
+    def handle_datagram(self, data, client_address):
+        """
+        Dispatch one received datagram, used by the server thread and the
+        asyncio runtime
+        """
+        if self.recorder != None:
+            self.recorder.record(OSC_IN, self.source, data)
+        self.dispatch(data, len(data), client_address)
+
+    def serve(self):
+        """
+        Receive loop of the server thread. Every datagram is received
+        into the same buffer and a datagram already waiting is returned
+        right away, so a burst is handled without waiting in between.
+        """
+        recv_into = self.socket.recvfrom_into
+        buffer = self.buffer
+        while True:
+            try:
+                size, client_address = recv_into(buffer)
+            except OSError:
+                return
+            self.received(size, client_address)
+
+    def drain(self):
+        """
+        Handle the datagrams waiting on the socket without blocking, used
+        as socket reader by the asyncio runtime
+        """
+        recv_into = self.socket.recvfrom_into
+        buffer = self.buffer
+        for i in range(0, self._DRAIN_LIMIT):
+            try:
+                size, client_address = recv_into(buffer, 0, socket.MSG_DONTWAIT)
+            except OSError:
+                # BlockingIOError once the socket is empty
+                return
+            self.received(size, client_address)
+
+    def received(self, size, client_address):
+        if self.recorder != None:
+            self.recorder.record(OSC_IN, self.source, bytes(self.view[0:size]))
+        self.dispatch(self.buffer, size, client_address)
+
+    def dispatch(self, data, size, client_address):
+        """
+        Hand the value of a routed message straight to value_handler,
+        parse everything else with pythonosc
+        """
+        # the address ends with the first null and is padded to 4 bytes,
+        # the type tag of a single argument message takes another 4 bytes
+        end = data.find(0, 0, size)
+        if end > 0:
+            tag_end = (end & ~3) + 8
+            route = self.routes.get(bytes(data[0:tag_end]))
+            if route != None:
+                address, unpack = route
+                if unpack != None:
+                    if size == tag_end + 4:
+                        self.value_handler(address, unpack(data, tag_end)[0])
+                        return
+                elif size >= tag_end + 4:
+                    length = _SIZE.unpack_from(data, tag_end)[0]
+                    if 0 <= length <= size - tag_end - 4:
+                        self.value_handler(address, bytes(data[tag_end + 4:tag_end + 4 + length]))
+                        return
+        self.dispatcher.call_handlers_for_packet(bytes(data[0:size]), client_address)
 
     def send_message(self, address, value):
+        if stats.enabled:
+            stats.end('send')
+        template = self.templates.get((address, type(value)))
+        if template != None:
+            prefix, packer = template
+            data = prefix if packer == None else prefix + packer(value)
+        else:
+            data = self.encode(address, value)
+        if self.recorder != None:
+            self.recorder.record(OSC_OUT, self.source, data)
+        self.socket.sendto(data, self.xr_address)
+
+    def send_datagram(self, data):
+        if stats.enabled:
+            stats.end('send')
+        if self.recorder != None:
+            self.recorder.record(OSC_OUT, self.source, data)
+        self.socket.sendto(data, self.xr_address)
+
+    def encode(self, address, value):
+        template = self.templates.get((address, type(value)))
+        if template != None:
+            prefix, packer = template
+            return prefix if packer == None else prefix + packer(value)
+        # unknown address or argument type
         builder = OscMessageBuilder(address = address)
         if value is None:
             values = []
@@ -22,84 +174,191 @@ class OSCClientServer(BlockingOSCUDPServer):
             values = [value]
         for val in values:
             builder.add_arg(val)
-        msg = builder.build()
-        self.socket.sendto(msg.dgram, self.xr_address)
+        return builder.build().dgram
+
+    def build_bundles(self, messages, max_size):
+        """
+        Pack (address, value) messages into as few OSC bundles as
+        possible without exceeding max_size bytes per datagram. Returns
+        a list of (datagram, messages) pairs.
+        """
+        bundles = []
+        current = [_BUNDLE_HEADER]
+        packed = []
+        size = len(_BUNDLE_HEADER)
+        for address, value in messages:
+            data = self.encode(address, value)
+            if size + 4 + len(data) > max_size and len(current) > 1:
+                bundles.append((b''.join(current), packed))
+                current = [_BUNDLE_HEADER]
+                packed = []
+                size = len(_BUNDLE_HEADER)
+            current.append(_SIZE.pack(len(data)))
+            current.append(data)
+            packed.append((address, value))
+            size += 4 + len(data)
+        if len(current) > 1:
+            bundles.append((b''.join(current), packed))
+        return bundles
+
+# "#bundle" followed by the time tag for immediate execution
+_BUNDLE_HEADER = b'#bundle\0' + struct.pack('>Q', 1)
+_SIZE = struct.Struct('>i')
+
+def osc_string(value):
+    # OSC strings are null terminated and padded to a multiple of 4 bytes
+    data = value.encode()
+    return data + b'\0' * (4 - len(data) % 4)
 
 class XAirClient:
     """
     Handles the communication with the X-Air mixer via the OSC protocol
     """
     _CONNECT_TIMEOUT = 0.5
+    _CONNECT_ATTEMPTS = 5
     _WAIT_TIME = 0.02
-    _REFRESH_TIMEOUT = 5
+    # stay well below the MTU so datagrams are never fragmented
+    _MAX_DATAGRAM = 1024
 
     XAIR_PORT = 10024
-
-    info_response = []
     
-    def __init__(self, address, state):
+    def __init__(self, address, state, send_window = 0.02, send_rate = 500, threaded = True, port = XAIR_PORT,
+                 meter_rate = 20):
         self.state = state
+        # batches are sent as OSC bundles until the mixer turns out to ignore them
+        self.bundles = True
+        self.info_response = []
+        self.info_received = threading.Event()
+        self.health = ConnectionHealth(self)
+        self.meters = MeterStream(self, meter_rate)
+        # StateSync instances waiting for replies, replaced as a whole on
+        # changes so the receive thread can iterate it without a lock
+        self.syncs = ()
+        self.syncs_lock = threading.Lock()
+        # held by StateSync.run(), so the initial load, resyncs and snapshot
+        # verification do not query the mixer at the same time
+        self.sync_lock = threading.Lock()
+        # OSCProxy serving this mixer to local clients
+        self.proxy = None
         dispatcher = Dispatcher()
         dispatcher.set_default_handler(self.msg_handler)
-        self.server = OSCClientServer((address, self.XAIR_PORT), dispatcher)
-        worker = threading.Thread(target = self.run_server)
-        worker.daemon = True
-        worker.start()
+        self.server = OSCClientServer((address, port), dispatcher, self.value_handler)
+        self.server.precompile(['/xinfo', '/xremotenfb'])
+        self.server.precompile(state.osc_index.keys())
+        self.server.route(state.store.ids.keys())
+        self.server.route([METERS], 'b')
+        self.scheduler = SendScheduler(self.server.send_message, send_window, send_rate)
+        if threaded:
+            self.scheduler.start()
+            worker = threading.Thread(target = self.run_server)
+            worker.daemon = True
+            worker.start()
     
     def validate_connection(self):
-        self.send('/xinfo')
-        time.sleep(self._CONNECT_TIMEOUT)
+        # ask again a few times within the timeout, continue as soon as the mixer answers
+        for attempt in range(0, self._CONNECT_ATTEMPTS):
+            self.send('/xinfo')
+            if self.info_received.wait(self._CONNECT_TIMEOUT / self._CONNECT_ATTEMPTS):
+                break
         if len(self.info_response) > 0:
+            timeline.mark('mixer connected')
             print('Successfully connected to %s with firmware %s at %s.' % (self.info_response[2], 
                     self.info_response[3], self.info_response[0]))
-        else:
-            print('Error: Failed to setup OSC connection to mixer. Please check for correct ip address.')
-            exit()
+            return True
+        print('Error: Mixer does not answer, waiting for it. Please check for correct ip address.')
+        self.health.waiting()
+        return False
         
     def run_server(self):
         try:
-            self.server.serve_forever()
+            self.server.serve()
         except KeyboardInterrupt:
-            self.server.shutdown()
             exit()
         
     def msg_handler(self, addr, *data):
             #print 'OSCReceived("%s", %s, %s)' % (addr, tags, data)
-            if addr.endswith('/fader') or addr.endswith('/on') or addr.endswith('/level') or addr.startswith('/config/mute') or addr.startswith('/fx/'):
-                self.state.received_osc(addr, data[0])
+            if stats.enabled:
+                stats.count_osc(addr)
+            self.health.received(addr)
+            if self.proxy != None:
+                self.proxy.upstream(addr, data)
+            for sync in self.syncs:
+                sync.received(addr, data)
+            if addr in self.state.store.ids:
+                self.state.commands.submit(PRIORITY_OSC, self.state.received_osc, addr, data[0])
+            elif addr == METERS:
+                self.meters.received(data[0])
             elif addr == '/xinfo':
                 self.info_response = data[:]
+                self.info_received.set()
+            elif stats.enabled and addr != '/node':
+                # /node replies are only used by the sync engine
+                stats.count('unknown osc')
     
+    def value_handler(self, addr, value):
+        """
+        Called by the fast path of OSCClientServer for parameter values
+        and meter blobs, does what msg_handler does for them
+        """
+        if stats.enabled:
+            stats.count_osc(addr)
+        self.health.received(addr)
+        if self.proxy != None:
+            self.proxy.upstream(addr, (value,))
+        if len(self.syncs) > 0:
+            data = (value,)
+            for sync in self.syncs:
+                sync.received(addr, data)
+        if addr == METERS:
+            self.meters.received(value)
+        else:
+            self.state.commands.submit(PRIORITY_OSC, self.state.received_osc, addr, value)
+
+    def add_sync(self, sync):
+        with self.syncs_lock:
+            self.syncs = self.syncs + (sync,)
+
+    def remove_sync(self, sync):
+        with self.syncs_lock:
+            self.syncs = tuple(other for other in self.syncs if other is not sync)
+
     def refresh_connection(self):
         # Tells mixer to send changes in state that have not been recieved from this OSC Client
         #   /xremote        - all parameter changes are broadcast to all active clients (Max 4)
         #   /xremotefnb     - No Feed Back. Parameter changes are only sent to the active clients which didn't initiate the change
+        # ConnectionHealth renews the subscription and reconnects when the mixer was lost,
+        # it runs on the shared timers together with the tempo LEDs and MIDI port checks
         try:
-            while True:
-                self.server.send_message("/xremotenfb", None)
-                time.sleep(self._REFRESH_TIMEOUT)
+            timers.run()
         except KeyboardInterrupt:
             exit()
             
-    def send(self, address, param = None):
-        self.server.send_message(address, param)
-            
-def find_mixer():
-    print('Searching for mixer...')
-    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-    client.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, True)
-    client.settimeout(15)
-    client.sendto("/xinfo\0\0".encode(), ("<broadcast>", XAirClient.XAIR_PORT))
-    try:
-        response = OscMessage(client.recv(512))
-    except socket.timeout:
-        print('No server found')
-        return None
-    client.close()
-
-    if response.address != '/xinfo':
-        print('Unknown response')
-        return None
-    else:
-        print('Found ' + response.params[2] + ' with firmware ' + response.params[3] + ' on IP ' + response.params[0])
-        return response.params[0]
+    def send_batch(self, messages):
+        """
+        Send several (address, value) messages in as few datagrams as
+        possible, packed into OSC bundles, or one by one if the mixer
+        ignores bundles. Every bundle counts as one packet of the send
+        budget, so this blocks while the budget is exhausted, or queues
+        the bundles when running on an event loop.
+        """
+        if len(messages) == 1 or not self.bundles:
+            for address, value in messages:
+                self.send(address, value)
+            return
+        if self.proxy != None:
+            for address, value in messages:
+                if value != None and address in self.state.store.ids:
+                    self.proxy.fan_out(address, value, None)
+        for data, packed in self.server.build_bundles(messages, self._MAX_DATAGRAM):
+            self.scheduler.send_datagram(self.server.send_datagram, data, packed)
+
+    def disable_bundles(self):
+        if self.bundles:
+            print('Mixer does not answer OSC bundles, sending single messages')
+            self.bundles = False
+
+    def send(self, address, param = None, coalesce = False):
+        # continuous values like faders may be coalesced, everything else is sent immediately
+        if self.proxy != None and param != None and address in self.state.store.ids:
+            self.proxy.fan_out(address, param, None)
+        self.scheduler.send(address, param, coalesce)
@@ -1,38 +1,194 @@
 #!/usr/bin/env python3
+# imported first, the startup timeline is measured from here
+from lib.stats import stats, timeline
 import argparse
+import atexit
+import signal
 import threading
-from lib.midicontroller import MidiController
-from lib.xair import XAirClient, find_mixer
+from concurrent.futures import ThreadPoolExecutor
 from lib.mixerstate import MixerState
+from lib.timers import timers
+from lib.layout import load_layout
+from lib.commandqueue import PRIORITY_OSC
+
+# Modules only needed by some options, or which can load in the
+# background, are imported where they are used to speed up the startup
+
+def open_controller(state, args):
+    from lib.midicontroller import MidiController
+    return MidiController(state, exit_on_disconnect = args.monitor, meter_mode = args.meters, raw_midi = not args.mido)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description = 'Remote control X-Air mixers with a midi controller')
     parser.add_argument('xair_address', help = 'ip address of your X-Air mixer (optional)', nargs = '?')
-    parser.add_argument('-m', '--monitor', help='monitor X-Touch connection and exit when disconnected', action="store_true")
+    parser.add_argument('-n', '--name', help = 'name of the mixer to use when searching the network')
+    parser.add_argument('-m', '--monitor', help='exit when the X-Touch is disconnected instead of waiting for it', action="store_true")
+    parser.add_argument('-a', '--asyncio', help = 'run on a single asyncio event loop instead of threads', action = "store_true")
+    parser.add_argument('-l', '--layout', help = 'control layout file (default: layouts/default.json)')
+    parser.add_argument('-r', '--rig', help = 'rig file with several mixers and controllers, runs on asyncio')
+    parser.add_argument('-s', '--stats', help = 'collect latency statistics, print them on exit or when receiving SIGUSR1', action = "store_true")
+    parser.add_argument('-t', '--timeline', help = 'print the startup timeline once the mixer state is loaded', action = "store_true")
+    parser.add_argument('--no-cache', help = 'do not show the cached mixer state on startup', action = "store_true")
+    parser.add_argument('--save-snapshot', help = 'save the current mixer state as snapshot NAME and exit', metavar = 'NAME')
+    parser.add_argument('--recall', help = 'recall snapshot NAME after connecting', metavar = 'NAME')
+    parser.add_argument('--send-window', help = 'coalesce fader changes per address within this window in ms (default: 20)', type = float, default = 20)
+    parser.add_argument('--send-rate', help = 'maximum number of OSC packets per second sent to the mixer (default: 500)', type = int, default = 500)
+    parser.add_argument('--record', help = 'append all OSC and MIDI traffic to the binary log FILE', metavar = 'FILE')
+    parser.add_argument('--mido', help = 'talk to the X-Touch through mido messages instead of raw rtmidi bytes', action = "store_true")
+    parser.add_argument('--meters', help = 'show channel levels on the encoder rings of faders', action = "store_true")
+    parser.add_argument('--meter-rate', help = 'maximum number of meter updates per second, up to 100 (default: 20)', type = float, default = 20)
+    parser.add_argument('--proxy', help = 'serve the mixer state to other OSC clients on this UDP port, 10024 if no PORT is given', type = int,
+                        nargs = '?', const = 10024, metavar = 'PORT')
     args = parser.parse_args()
+    if (args.asyncio or args.rig != None) and (args.save_snapshot != None or args.recall != None):
+        parser.error('--save-snapshot and --recall need the threaded runtime, they can not be used with -a or -r')
+    # the mixer sends meter values about every 50 ms, more updates would only repeat them
+    if not 0 < args.meter_rate <= 100:
+        parser.error('--meter-rate must be greater than 0 and at most 100')
+    timeline.mark('arguments parsed')
 
-    if args.xair_address is None:
-        address = find_mixer()
-        if address is None:
-            print('Error: Could not find any mixers in network. Please specify ip address manually.')
+    # every mixer session is a MixerState with its XAirClient
+    sessions = []
+    controllers = []
+    # (XAirClient, port) for every mixer served to local OSC clients
+    proxies = []
+    if args.rig != None:
+        from lib.rig import load_rig
+        from lib.xair import XAirClient
+        from lib.midicontroller import MidiController
+        try:
+            rig = load_rig(args.rig)
+            layouts = [load_layout(mixer['layout']) for mixer in rig.mixers]
+        except (IOError, ValueError) as e:
+            print('Error: Can not load rig: %s' % e)
             exit()
-        else:
-            args.xair_address = address
-
-    state = MixerState()
-    midi = MidiController(state)
-    state.midi_controller = midi
-    xair = XAirClient(args.xair_address, state)
-    state.xair_client = xair
-    xair.validate_connection()
-
-    if args.monitor:
-        print('Monitoring X-Touch connection enabled')
-        monitor = threading.Thread(target = midi.monitor_ports)
-        monitor.daemon = True
-        monitor.start()
-    
-    state.read_initial_state()
+        for mixer, layout in zip(rig.mixers, layouts):
+            state = MixerState(layout)
+            xair = XAirClient(mixer['address'], state, args.send_window / 1000, args.send_rate,
+                              threaded = False, port = mixer['port'], meter_rate = args.meter_rate)
+            state.xair_client = xair
+            sessions.append((state, xair))
+            if mixer['proxy'] != None:
+                proxies.append((xair, mixer['proxy']))
+        for controller in rig.controllers:
+            state = sessions[controller['mixer']][0]
+            midi = MidiController(state, port = controller['port'], exit_on_disconnect = args.monitor,
+                                  meter_mode = args.meters, raw_midi = not args.mido)
+            state.add_controller(midi)
+            controllers.append(midi)
+        args.asyncio = True
+    else:
+        try:
+            layout = load_layout(args.layout)
+        except (IOError, ValueError) as e:
+            print('Error: Can not load layout: %s' % e)
+            exit()
+
+        state = MixerState(layout)
+        # open the X-Touch while the mixer is searched
+        with ThreadPoolExecutor(1) as pool:
+            opening = pool.submit(open_controller, state, args)
+            if args.xair_address is None:
+                from lib.discovery import find_mixer, load_last_mixer
+                address = find_mixer(args.name)
+                last = load_last_mixer()
+                if address is None and last != None and (args.name == None or args.name in last[0:2]):
+                    # the mixer may still be booting, wait for the one used last time
+                    print('Using the last mixer %s on IP %s' % (last[1], last[0]))
+                    address = last[0]
+                if address is None:
+                    print('Error: Could not find any mixers in network. Please specify ip address manually.')
+                    exit()
+                else:
+                    args.xair_address = address
+            from lib.xair import XAirClient
+            xair = XAirClient(args.xair_address, state, args.send_window / 1000, args.send_rate,
+                              threaded = not args.asyncio, meter_rate = args.meter_rate)
+            midi = opening.result()
+        state.add_controller(midi)
+        state.xair_client = xair
+        sessions.append((state, xair))
+        controllers.append(midi)
+        if args.proxy != None:
+            proxies.append((xair, args.proxy))
+
+    for session in sessions:
+        session[0].update_meter_stream()
+
+    if len(proxies) > 0:
+        from lib.proxy import OSCProxy
+        for xair, port in proxies:
+            try:
+                proxy = OSCProxy(xair, port)
+            except OSError as e:
+                print('Error: Can not serve OSC clients on port %d: %s' % (port, e))
+                exit()
+            if not args.asyncio:
+                proxy.start()
+            print('Serving the mixer state to OSC clients on port %d' % port)
+
+    if args.record != None:
+        from lib.recorder import Recorder
+        try:
+            recorder = Recorder(args.record)
+        except (IOError, ValueError) as e:
+            print('Error: Can not record traffic: %s' % e)
+            exit()
+        for session in sessions:
+            recorder.add_client(session[1])
+        for controller in controllers:
+            recorder.add_controller(controller)
+        recorder.start_writer()
+        atexit.register(recorder.close)
+
+    if args.stats:
+        stats.enabled = True
+        def dump_stats(*args):
+            print(stats.dump())
+            for state, xair in sessions:
+                print(xair.health.summary())
+                if xair.proxy != None:
+                    print(xair.proxy.summary())
+                print(xair.scheduler.summary())
+                print(state.commands.summary())
+            print(timers.summary())
+            print(timeline.report())
+        atexit.register(dump_stats)
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, dump_stats)
+
+    def save_cache():
+        for state, xair in sessions:
+            if state.cache != None:
+                state.cache.flush()
+    atexit.register(save_cache)
+
+    if args.asyncio:
+        from lib.asyncruntime import AsyncRuntime
+        AsyncRuntime([xair for state, xair in sessions], controllers, not args.no_cache, args.timeline).run()
+        exit()
+
+    state.commands.start()
+    connected = xair.validate_connection()
+    if connected:
+        if not args.no_cache:
+            state.load_cache(xair.info_response)
+        state.read_initial_state()
+        xair.health.connected()
+        if args.timeline:
+            # runs after the synced values were applied
+            state.commands.submit(PRIORITY_OSC, lambda: print(timeline.report()))
+    elif args.save_snapshot != None or args.recall != None:
+        exit()
+    if args.save_snapshot != None:
+        # wait until the queue applied all synced values
+        synced = threading.Event()
+        state.commands.submit(PRIORITY_OSC, synced.set)
+        synced.wait()
+        state.snapshots.save(args.save_snapshot)
+        exit()
+    if args.recall != None:
+        state.snapshots.recall(args.recall)
     
-    # now refresh /xremote command while running
+    # now refresh /xremote command and watch the connection while running
     xair.refresh_connection()